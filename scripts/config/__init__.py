@@ -21,6 +21,16 @@ from .category_config import (
     get_all_categories
 )
 
+from .fee_config import (
+    SHIPPING_FEE_RULES,
+    DEFAULT_SHIPPING_FEE,
+    AMOUNT_FEE_RATES,
+    get_shipping_fee_per_unit,
+    calculate_shipping_fee,
+    shipping_fee_sql,
+    amount_fee_sql
+)
+
 __all__ = [
     # 商品分层配置
     'PRODUCT_TIERS',
@@ -37,4 +47,13 @@ __all__ = [
     'CATEGORY_CONFIGS',
     'get_category_config',
     'get_all_categories',
+    
+    # 费用配置
+    'SHIPPING_FEE_RULES',
+    'DEFAULT_SHIPPING_FEE',
+    'AMOUNT_FEE_RATES',
+    'get_shipping_fee_per_unit',
+    'calculate_shipping_fee',
+    'shipping_fee_sql',
+    'amount_fee_sql',
 ]
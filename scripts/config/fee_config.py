@@ -0,0 +1,46 @@
+"""
+费用配置
+运费规则和按销售额计提的费用比例；生成器计算订单运费、DWD 计算明细费用列共用同一份配置
+调整规则后执行 DWD 费用重算（mode=fees）即可，下游 DWS/ADS 只汇总明细上已存的费用列
+"""
+
+# 运费（元/件）：按一级类目前缀匹配，先匹配先用
+SHIPPING_FEE_RULES = [
+    ('整车', 30),
+]
+
+# 未命中任何规则的类目
+DEFAULT_SHIPPING_FEE = 3
+
+# 按销售额计提的费用：明细费用列 -> 比例
+AMOUNT_FEE_RATES = {
+    'after_sale_fee': 0.02,   # 售后费
+    'platform_fee': 0.05,     # 平台费
+    'mgmt_fee': 0.10,         # 管理费
+}
+
+
+def get_shipping_fee_per_unit(category_l1):
+    """获取一级类目的单件运费"""
+    for prefix, fee in SHIPPING_FEE_RULES:
+        if category_l1 and category_l1.startswith(prefix):
+            return fee
+    return DEFAULT_SHIPPING_FEE
+
+
+def calculate_shipping_fee(category_l1, quantity):
+    """计算一行商品的运费"""
+    return get_shipping_fee_per_unit(category_l1) * quantity
+
+
+def shipping_fee_sql(category_column, quantity_column):
+    """运费规则的 SQL 表达式（与 calculate_shipping_fee 一致）"""
+    cases = ' '.join(
+        f"WHEN {category_column} LIKE '{prefix}%' THEN {fee}" for prefix, fee in SHIPPING_FEE_RULES
+    )
+    return f"{quantity_column} * CASE {cases} ELSE {DEFAULT_SHIPPING_FEE} END"
+
+
+def amount_fee_sql(fee_column, amount_column):
+    """按销售额计提费用的 SQL 表达式"""
+    return f"ROUND({amount_column} * {AMOUNT_FEE_RATES[fee_column]}, 2)"
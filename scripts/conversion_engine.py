@@ -9,6 +9,8 @@ import multiprocessing
 from concurrent.futures import ProcessPoolExecutor, as_completed
 import time
 
+from config import calculate_shipping_fee
+
 
 # 全局配置
 TIER_CONVERSION_RATES = {
@@ -139,10 +141,7 @@ def _create_order_static(conversion, date, order_id, detail_id, product_dict, us
     amount = round(price * quantity, 2)
     cost_amount = round(cost * quantity, 2)
     
-    if product['一级类目'].startswith('整车'):
-        shipping_fee = 30 * quantity
-    else:
-        shipping_fee = 3 * quantity
+    shipping_fee = calculate_shipping_fee(product['一级类目'], quantity)
     
     order = {
         '订单ID': f'O{order_id:08d}',
@@ -0,0 +1,114 @@
+"""
+DAG 任务调度
+按声明的依赖并发执行互不依赖的构建步骤，记录每个节点的耗时
+节点失败时，依赖它的下游节点被跳过，其余分支照常执行
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def _check_dag(tasks):
+    """检查依赖是否都已声明、是否存在环"""
+    for name, (_, deps) in tasks.items():
+        for dep in deps:
+            if dep not in tasks:
+                raise ValueError(f"节点 {name} 依赖未声明的节点 {dep}")
+
+    visiting, visited = set(), set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"依赖存在环: {name}")
+        visiting.add(name)
+        for dep in tasks[name][1]:
+            visit(dep)
+        visiting.discard(name)
+        visited.add(name)
+
+    for name in tasks:
+        visit(name)
+
+
+def _critical_path(tasks, timings):
+    """按实际耗时计算关键路径（决定总耗时的最长依赖链）"""
+    finish = {}
+
+    def longest(name):
+        if name not in finish:
+            deps = [dep for dep in tasks[name][1] if dep in timings]
+            best = max(deps, key=longest, default=None)
+            chain = (longest(best)[1] + [name]) if best else [name]
+            total = (longest(best)[0] if best else 0) + timings.get(name, 0)
+            finish[name] = (total, chain)
+        return finish[name]
+
+    return max((longest(name) for name in timings), default=(0, []))
+
+
+def run_dag(tasks, max_workers=4):
+    """
+    按依赖并发执行任务
+
+    Args:
+        tasks: {节点名: (无参函数, [依赖节点名])}，函数返回 True 表示成功
+        max_workers: 最大并发数
+
+    Returns:
+        tuple: (是否全部成功, {节点名: 耗时秒数})
+    """
+    _check_dag(tasks)
+
+    status = {}      # 节点名 -> 'ok' / 'failed' / 'skipped'
+    timings = {}
+    running = {}     # future -> (节点名, 开始时间)
+    pending = dict(tasks)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # 上游失败的节点直接跳过
+            for name in list(pending):
+                if any(status.get(dep) in ('failed', 'skipped') for dep in pending[name][1]):
+                    status[name] = 'skipped'
+                    print(f"  ⊘ [{name}] 上游失败，跳过")
+                    del pending[name]
+
+            # 提交所有依赖已完成的节点
+            for name in list(pending):
+                func, deps = pending[name]
+                if all(status.get(dep) == 'ok' for dep in deps):
+                    running[executor.submit(func)] = (name, time.time())
+                    del pending[name]
+            sys.stdout.flush()
+
+            if not running:
+                break
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name, start = running.pop(future)
+                timings[name] = time.time() - start
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    print(f"  ✗ [{name}] 异常: {e}")
+                    ok = False
+                status[name] = 'ok' if ok else 'failed'
+                print(f"  {'✓' if ok else '✗'} [{name}] {timings[name]:.1f}秒")
+                sys.stdout.flush()
+
+    # 节点耗时汇总
+    print("\n  节点耗时:")
+    for name in tasks:
+        if name in timings:
+            print(f"    {name:<24} {timings[name]:>7.1f}秒  {status[name]}")
+        else:
+            print(f"    {name:<24} {'-':>7}    {status.get(name, 'skipped')}")
+    total, chain = _critical_path(tasks, timings)
+    if chain:
+        print(f"  关键路径: {' → '.join(chain)} ({total:.1f}秒)")
+    sys.stdout.flush()
+
+    return all(value == 'ok' for value in status.values()) and len(status) == len(tasks), timings
@@ -37,7 +37,8 @@ class DatabaseManager:
                 user=self.config['user'],
                 password=self.config['password'],
                 database=self.config['database'],
-                charset='utf8mb4'
+                charset='utf8mb4',
+                local_infile=True
             )
             return self.connection
         except Exception as e:
@@ -0,0 +1,454 @@
+"""
+ETL控制表管理
+记录各表的增量水位线、加载检查点等运行状态，供加载和各层转换共享
+"""
+import hashlib
+import json
+import os
+
+
+# 水位线表：每个目标表记录一个水位线（最大日期/ID）
+SQL_CREATE_WATERMARK = """
+CREATE TABLE IF NOT EXISTS etl_watermark (
+    table_name VARCHAR(64) PRIMARY KEY,
+    column_name VARCHAR(64) NOT NULL,
+    watermark VARCHAR(64),
+    updated_at DATETIME
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+
+def ensure_control_tables(conn):
+    """
+    创建ETL控制表（已存在则跳过）
+
+    Args:
+        conn: DB-API 连接（pymysql 连接或 engine.raw_connection()）
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SQL_CREATE_WATERMARK)
+        cursor.execute(SQL_CREATE_LOAD_CHECKPOINT)
+        cursor.execute(SQL_CREATE_LOAD_MANIFEST)
+        cursor.execute(SQL_CREATE_CHUNK_PROGRESS)
+        cursor.execute(SQL_CREATE_REMOVED_DATES)
+        conn.commit()
+    finally:
+        cursor.close()
+    ensure_column(conn, 'etl_load_manifest', 'full_replace', MANIFEST_FULL_REPLACE_COLUMN)
+
+
+def ensure_column(conn, table_name, column_name, definition):
+    """
+    为早期版本建的表补充新增列（表不存在或列已存在时跳过，旧记录取列默认值）
+
+    Returns:
+        bool: 是否新增了列
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            (table_name,)
+        )
+        if not cursor.fetchone()[0]:
+            return False
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+            (table_name, column_name)
+        )
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(f"ALTER TABLE `{table_name}` ADD COLUMN {definition}")
+        conn.commit()
+        return True
+    finally:
+        cursor.close()
+
+
+def get_watermark(conn, table_name):
+    """
+    读取表的水位线
+
+    Returns:
+        str: 水位线值，未记录时返回 None
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT watermark FROM etl_watermark WHERE table_name = %s", (table_name,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    finally:
+        cursor.close()
+
+
+def set_watermark(conn, table_name, column_name, watermark, commit=True):
+    """
+    更新表的水位线
+
+    Args:
+        conn: DB-API 连接
+        table_name: 目标表名
+        column_name: 水位线对应的列
+        watermark: 水位线值（转为字符串保存）
+        commit: 是否立即提交（与数据写入同事务时传 False）
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO etl_watermark (table_name, column_name, watermark, updated_at)
+            VALUES (%s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE column_name = VALUES(column_name),
+                watermark = VALUES(watermark), updated_at = VALUES(updated_at)
+            """,
+            (table_name, column_name, None if watermark is None else str(watermark))
+        )
+        if commit:
+            conn.commit()
+    finally:
+        cursor.close()
+
+
+def clear_watermark(conn, table_name):
+    """删除表的水位线（全量重建后重新开始增量）"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM etl_watermark WHERE table_name = %s", (table_name,))
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+# 加载检查点表：每个表按块记录源文件指纹、已加载行数和提交状态
+# chunk_index = -1 的记录表示整表加载完成
+SQL_CREATE_LOAD_CHECKPOINT = """
+CREATE TABLE IF NOT EXISTS etl_load_checkpoint (
+    table_name VARCHAR(64) NOT NULL,
+    chunk_index INT NOT NULL,
+    fingerprint VARCHAR(80) NOT NULL,
+    row_start BIGINT,
+    rows_loaded BIGINT,
+    status VARCHAR(16) NOT NULL,
+    updated_at DATETIME,
+    PRIMARY KEY (table_name, chunk_index)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+TABLE_DONE_CHUNK = -1
+
+
+def file_fingerprint(path, sample_bytes=65536):
+    """
+    计算源文件的廉价指纹：文件大小 + 修改时间 + 头/中/尾采样哈希
+    不读取整个文件，大文件也能毫秒级完成
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, 'rb') as f:
+        for offset in (0, max(0, size // 2 - sample_bytes // 2), max(0, size - sample_bytes)):
+            f.seek(offset)
+            digest.update(f.read(sample_bytes))
+    return f"{size}-{int(stat.st_mtime)}-{digest.hexdigest()}"
+
+
+def get_load_checkpoint(conn, table_name, fingerprint):
+    """
+    读取表的加载检查点（只认可与当前源文件指纹一致的记录）
+
+    Returns:
+        tuple: (是否整表完成, {chunk_index: rows_loaded})
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT chunk_index, rows_loaded FROM etl_load_checkpoint "
+            "WHERE table_name = %s AND fingerprint = %s AND status = 'committed'",
+            (table_name, fingerprint)
+        )
+        chunks = {row[0]: row[1] for row in cursor.fetchall()}
+        done = chunks.pop(TABLE_DONE_CHUNK, None) is not None
+        return done, chunks
+    finally:
+        cursor.close()
+
+
+def save_chunk_checkpoint(conn, table_name, chunk_index, fingerprint, row_start, rows_loaded, commit=False):
+    """
+    记录一个数据块已提交
+    默认不提交，由调用方与数据写入放在同一事务中提交，保证检查点与数据一致
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO etl_load_checkpoint
+                (table_name, chunk_index, fingerprint, row_start, rows_loaded, status, updated_at)
+            VALUES (%s, %s, %s, %s, %s, 'committed', NOW())
+            ON DUPLICATE KEY UPDATE fingerprint = VALUES(fingerprint), row_start = VALUES(row_start),
+                rows_loaded = VALUES(rows_loaded), status = VALUES(status), updated_at = VALUES(updated_at)
+            """,
+            (table_name, chunk_index, fingerprint, row_start, rows_loaded)
+        )
+        if commit:
+            conn.commit()
+    finally:
+        cursor.close()
+
+
+def mark_table_loaded(conn, table_name, fingerprint, total_rows):
+    """标记整表加载完成"""
+    save_chunk_checkpoint(conn, table_name, TABLE_DONE_CHUNK, fingerprint, 0, total_rows, commit=True)
+
+
+def reset_load_checkpoint(conn, table_name):
+    """清除表的全部检查点（重新开始加载）"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM etl_load_checkpoint WHERE table_name = %s", (table_name,))
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+# 加载清单表：记录每个表最近一次成功加载时的源文件指纹，指纹未变的表可直接跳过
+# full_replace 标记该次加载是否用源文件整表替换了表内容（增量合并后表中还有文件之外的旧行）
+MANIFEST_FULL_REPLACE_COLUMN = "full_replace TINYINT NOT NULL DEFAULT 0"
+
+SQL_CREATE_LOAD_MANIFEST = f"""
+CREATE TABLE IF NOT EXISTS etl_load_manifest (
+    table_name VARCHAR(64) PRIMARY KEY,
+    source_file VARCHAR(255),
+    fingerprint VARCHAR(80) NOT NULL,
+    row_count BIGINT,
+    {MANIFEST_FULL_REPLACE_COLUMN},
+    loaded_at DATETIME
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+
+def get_load_manifest(conn, full_replace_only=False):
+    """
+    读取加载清单
+
+    Args:
+        full_replace_only: 只返回整表替换加载的记录（表内容与源文件完全一致）
+
+    Returns:
+        dict: {table_name: fingerprint}
+    """
+    sql = "SELECT table_name, fingerprint FROM etl_load_manifest"
+    if full_replace_only:
+        sql += " WHERE full_replace = 1"
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql)
+        return {row[0]: row[1] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def record_load_manifest(conn, table_name, source_file, fingerprint, row_count, full_replace=True):
+    """记录表的一次成功加载（增量合并传 full_replace=False）"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO etl_load_manifest (table_name, source_file, fingerprint, row_count, full_replace, loaded_at)
+            VALUES (%s, %s, %s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE source_file = VALUES(source_file), fingerprint = VALUES(fingerprint),
+                row_count = VALUES(row_count), full_replace = VALUES(full_replace), loaded_at = VALUES(loaded_at)
+            """,
+            (table_name, source_file, fingerprint, row_count, 1 if full_replace else 0)
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def clear_load_manifest(conn, table_names):
+    """删除表的加载记录（表被删除或开始重新加载前调用，加载成功后再重新记录）"""
+    table_names = list(table_names)
+    if not table_names:
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"DELETE FROM etl_load_manifest WHERE table_name IN ({', '.join(['%s'] * len(table_names))})",
+            table_names
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+# 就绪清单文件：生成器每完成一个表就登记一次，监听模式的加载器据此边生成边导入
+READY_MANIFEST_NAME = '_ready_manifest.json'
+
+
+def read_ready_manifest(layer_dir):
+    """
+    读取就绪清单
+
+    Returns:
+        dict: {'run_id', 'status', 'tables': {table_name: {...}}}，文件不存在或正在写入时返回 None
+    """
+    path = os.path.join(layer_dir, READY_MANIFEST_NAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_ready_manifest(layer_dir, manifest):
+    """原子写入就绪清单（先写临时文件再替换，读取方不会看到半个文件）"""
+    path = os.path.join(layer_dir, READY_MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# 分块进度表：keyset 分块执行的大语句每提交一块记录一次位置，中断后可从该位置继续
+SQL_CREATE_CHUNK_PROGRESS = """
+CREATE TABLE IF NOT EXISTS etl_chunk_progress (
+    job_name VARCHAR(64) PRIMARY KEY,
+    last_key VARCHAR(64),
+    rows_done BIGINT,
+    status VARCHAR(16) NOT NULL,
+    updated_at DATETIME
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+
+def get_chunk_progress(conn, job_name):
+    """
+    读取分块进度
+
+    Returns:
+        tuple: (last_key, rows_done, 是否已完成)，无记录时返回 (None, 0, False)
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT last_key, rows_done, status FROM etl_chunk_progress WHERE job_name = %s", (job_name,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None, 0, False
+        return row[0], row[1] or 0, row[2] == 'done'
+    finally:
+        cursor.close()
+
+
+def save_chunk_progress(conn, job_name, last_key, rows_done, done=False, commit=False):
+    """
+    记录分块进度
+    默认不提交，由调用方与本块数据放在同一事务中提交
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO etl_chunk_progress (job_name, last_key, rows_done, status, updated_at)
+            VALUES (%s, %s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE last_key = VALUES(last_key), rows_done = VALUES(rows_done),
+                status = VALUES(status), updated_at = VALUES(updated_at)
+            """,
+            (job_name, None if last_key is None else str(last_key), rows_done, 'done' if done else 'running')
+        )
+        if commit:
+            conn.commit()
+    finally:
+        cursor.close()
+
+
+def clear_chunk_progress(conn, job_name):
+    """清除分块进度（重新开始）"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM etl_chunk_progress WHERE job_name = %s", (job_name,))
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+# 删除日期表：事实行被删除（而非更新）时记录其 date_key，
+# 下游按 etl_time 找变化日期时看不到已删除的行，从这里补上；
+# 汇总表写入失败、须在下次运行重算的日期也记录在这里（table_name 为汇总表）
+SQL_CREATE_REMOVED_DATES = """
+CREATE TABLE IF NOT EXISTS etl_removed_dates (
+    table_name VARCHAR(64) NOT NULL,
+    date_key INT NOT NULL,
+    removed_at DATETIME NOT NULL,
+    PRIMARY KEY (table_name, date_key),
+    INDEX idx_removed_at (removed_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+
+def record_removed_dates(conn, table_name, date_keys_sql):
+    """
+    记录即将被删除的行所在的 date_key（date_keys_sql 为返回 date_key 的 SELECT）
+    不提交，由调用方与删除语句放在同一事务中提交
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"""
+            INSERT INTO etl_removed_dates (table_name, date_key, removed_at)
+            SELECT %s, removed.date_key, NOW() FROM ({date_keys_sql}) removed
+            WHERE removed.date_key IS NOT NULL
+            ON DUPLICATE KEY UPDATE removed_at = VALUES(removed_at)
+            """,
+            (table_name,)
+        )
+    finally:
+        cursor.close()
+
+
+def record_pending_dates(conn, table_name, date_keys):
+    """记录须在下次运行重算的日期（如并行切片写入失败的日期）"""
+    date_keys = sorted({int(date_key) for date_key in date_keys})
+    if not date_keys:
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            "INSERT INTO etl_removed_dates (table_name, date_key, removed_at) VALUES (%s, %s, NOW()) "
+            "ON DUPLICATE KEY UPDATE removed_at = VALUES(removed_at)",
+            [(table_name, date_key) for date_key in date_keys]
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def get_removed_dates(conn, table_names, since):
+    """这些表在 since 之后删除过行的 date_key"""
+    table_names = list(table_names)
+    if not table_names:
+        return []
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT DISTINCT date_key FROM etl_removed_dates "
+            f"WHERE table_name IN ({', '.join(['%s'] * len(table_names))}) AND removed_at >= %s",
+            table_names + [since]
+        )
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def purge_removed_dates(conn, before):
+    """清除 before 之前的删除记录（下游已处理完成）"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM etl_removed_dates WHERE removed_at < %s", (before,))
+        conn.commit()
+    finally:
+        cursor.close()
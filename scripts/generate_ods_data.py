@@ -5,6 +5,7 @@ ODS层数据生成入口脚本
 import sys
 import json
 import os
+import time
 from pathlib import Path
 
 # 添加脚本目录到路径
@@ -16,6 +17,10 @@ from config import get_category_config
 from business_scale import get_scale_summary
 from traffic_distribution import TrafficDistributor
 from conversion_engine import ConversionEngine
+from etl_control import file_fingerprint, write_ready_manifest
+from key_resolution import (
+    add_integer_ids, build_dimension_maps, resolve_fact_order, resolve_fact_order_detail, RESOLVED_FACT_SOURCES
+)
 
 
 def main():
@@ -34,6 +39,10 @@ def main():
     business_scale = config.get('businessScale', '小型企业')
     time_span_days = config.get('timeSpanDays', 365)
     main_category = config.get('mainCategory', 'bicycle')
+    # 输出方式: 'csv' 写CSV文件, 'direct' 直接加载到数据库, 'both' 两者都做
+    output_mode = config.get('outputMode', 'csv')
+    # 预解析订单事实表的代理键（写入 data/dwd，DWD 全量构建时直接导入）；需要CSV输出以核对源文件指纹
+    resolve_keys = config.get('resolveKeys', False) and output_mode != 'direct'
     
     # 转换平台店铺格式（兼容新旧格式）
     platform_stores = {}
@@ -66,30 +75,94 @@ def main():
     print(f"时间跨度: {time_span_days} 天")
     print(f"预估订单: {scale_summary['estimated_orders']:,} 单")
     print(f"预估用户: {num_users:,} 个")
+    print(f"输出方式: {output_mode}")
     print("="*60)
     
     # 数据目录
     data_dir = BASE_DIR / 'data' / 'ods'
     data_dir.mkdir(parents=True, exist_ok=True)
     
+    # 直连模式：后台线程边生成边导入，每个表生成完即提交
+    loader = None
+    if output_mode in ('direct', 'both'):
+        from load_to_database import DirectLoader
+        loader = DirectLoader(config.get('dbConfig'), config.get('loadMode', 'full'))
+        if not loader.start():
+            return 1
+    
+    # 就绪清单：每个CSV落盘完成即登记，监听模式的加载器据此立即开始导入
+    # run_id 可由调用方指定（同时传给监听加载器，使其只接受本次运行的清单）
+    ready_manifest = {
+        'run_id': str(config.get('runId') or time.strftime('%Y%m%d%H%M%S')),
+        'status': 'running',
+        'tables': {}
+    }
+    if output_mode != 'direct':
+        write_ready_manifest(data_dir, ready_manifest)
+    
+    def publish(table_name, df):
+        """输出一个已生成完成的表：按输出方式写CSV和/或提交给直连加载器"""
+        add_integer_ids(df)
+        if output_mode != 'direct':
+            # 先写临时文件再原子替换，加载器不会读到写了一半的CSV
+            csv_path = data_dir / f'{table_name}.csv'
+            tmp_path = data_dir / f'{table_name}.csv.tmp'
+            df.to_csv(tmp_path, index=False, encoding='utf-8-sig')
+            os.replace(tmp_path, csv_path)
+            ready_manifest['tables'][table_name] = {
+                'file': csv_path.name,
+                'rows': len(df),
+                'fingerprint': file_fingerprint(csv_path),
+                'ready_at': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+            write_ready_manifest(data_dir, ready_manifest)
+            print(f"   ✓ 已保存: {table_name}.csv ({len(df):,} 行)")
+        if loader:
+            loader.submit(table_name, df)
+            print(f"   → 已提交导入: {table_name}")
+        sys.stdout.flush()
+    
+    def publish_resolved(resolved_facts):
+        """写出预解析的事实表CSV，并登记其来源 ODS 文件指纹（DWD 据此判断能否直接导入）"""
+        resolved_dir = BASE_DIR / 'data' / 'dwd'
+        resolved_dir.mkdir(parents=True, exist_ok=True)
+        manifest = {'run_id': ready_manifest['run_id'], 'status': 'complete', 'tables': {}}
+        for table_name, df in resolved_facts.items():
+            csv_path = resolved_dir / f'{table_name}.csv'
+            tmp_path = resolved_dir / f'{table_name}.csv.tmp'
+            df.to_csv(tmp_path, index=False, encoding='utf-8', na_rep='\\N')
+            os.replace(tmp_path, csv_path)
+            manifest['tables'][table_name] = {
+                'file': csv_path.name,
+                'rows': len(df),
+                'sources': {
+                    source: ready_manifest['tables'][source]['fingerprint']
+                    for source in RESOLVED_FACT_SOURCES[table_name]
+                }
+            }
+            print(f"   ✓ 已预解析: {table_name}.csv ({len(df):,} 行)")
+        write_ready_manifest(resolved_dir, manifest)
+        sys.stdout.flush()
+    
+    loader_finished = False
     try:
         # 1. 生成店铺数据
         print("\n【步骤 1/8】生成店铺数据")
         store_gen = StoreGenerator(platform_stores)
         stores_df = store_gen.generate()
-        store_gen.save_to_csv(stores_df, data_dir / 'ods_stores.csv')
+        publish('ods_stores', stores_df)
         
         # 2. 生成商品数据
         print("\n【步骤 2/8】生成商品数据")
         product_gen = ProductGenerator(stores_df, category_config)
         products_df = product_gen.generate()
-        product_gen.save_to_csv(products_df, data_dir / 'ods_products.csv')
+        publish('ods_products', products_df)
         
         # 3. 生成用户数据
         print("\n【步骤 3/8】生成用户数据")
         user_gen = UserGenerator(num_users, time_span_days)
         users_df = user_gen.generate()
-        user_gen.save_to_csv(users_df, data_dir / 'ods_users.csv')
+        publish('ods_users', users_df)
         
         # 4. 生成流量数据（使用流量分发器）
         print("\n【步骤 4/8】生成流量数据")
@@ -105,11 +178,19 @@ def main():
         )
         
         # 保存订单数据
-        orders_df.to_csv(data_dir / 'ods_orders.csv', index=False, encoding='utf-8-sig')
-        print(f"   ✓ 已保存: ods_orders.csv ({len(orders_df):,} 行)")
+        publish('ods_orders', orders_df)
+        publish('ods_order_details', order_details_df)
         
-        order_details_df.to_csv(data_dir / 'ods_order_details.csv', index=False, encoding='utf-8-sig')
-        print(f"   ✓ 已保存: ods_order_details.csv ({len(order_details_df):,} 行)")
+        # 在内存中解析订单/明细的代理键，免去 DWD 的多表关联
+        if resolve_keys:
+            key_maps = build_dimension_maps(stores_df, users_df, products_df)
+            fact_order_df = resolve_fact_order(orders_df, key_maps)
+            fact_order_detail_df = resolve_fact_order_detail(order_details_df, fact_order_df, key_maps)
+            publish_resolved({
+                'dwd_fact_order': fact_order_df,
+                'dwd_fact_order_detail': fact_order_detail_df,
+            })
+            del fact_order_df, fact_order_detail_df
         
         # 6. 拆分流量数据为推广表和商品流量表
         print("\n【步骤 6/8】拆分流量数据")
@@ -118,17 +199,16 @@ def main():
         promotion_df = traffic_df[traffic_df['流量类型'] == '付费'].copy()
         promotion_df['推广ID'] = [f'PM{i:08d}' for i in range(1, len(promotion_df) + 1)]
         promotion_df = promotion_df[[
-            '推广ID', '日期', '店铺ID', '平台', '商品ID', 
+            '推广ID', '日期', '店铺ID', '平台', 'SKU_ID', '商品ID', 
             '一级类目', '二级类目', '流量渠道', '推广费用', 
             '曝光量', '点击量', '点击率'
         ]]
         promotion_df.columns = [
-            'promotion_id', 'date', 'store_id', 'platform', 'product_id',
+            'promotion_id', 'date', 'store_id', 'platform', 'sku_id', 'product_id',
             'category_l1', 'category_l2', 'channel', 'cost',
             'impressions', 'clicks', 'ctr'
         ]
-        promotion_df.to_csv(data_dir / 'ods_promotion.csv', index=False, encoding='utf-8-sig')
-        print(f"   ✓ 已保存: ods_promotion.csv ({len(promotion_df):,} 行)")
+        publish('ods_promotion', promotion_df)
         
         # 商品自然流量表
         product_traffic_df = traffic_df[traffic_df['流量类型'] == '自然'].copy()
@@ -148,8 +228,7 @@ def main():
         product_traffic_df['add_to_cart'] = product_traffic_df['clicks'].apply(
             lambda x: int(x * random.uniform(0.2, 0.5))
         )
-        product_traffic_df.to_csv(data_dir / 'ods_product_traffic.csv', index=False, encoding='utf-8-sig')
-        print(f"   ✓ 已保存: ods_product_traffic.csv ({len(product_traffic_df):,} 行)")
+        publish('ods_product_traffic', product_traffic_df)
         
         # 7. 生成店铺流量汇总表
         print("\n【步骤 7/8】生成店铺流量汇总")
@@ -182,8 +261,7 @@ def main():
             'search_traffic', 'recommend_traffic', 'direct_traffic', 'other_traffic',
             'avg_stay_time', 'bounce_rate'
         ]
-        store_traffic.to_csv(data_dir / 'ods_traffic.csv', index=False, encoding='utf-8-sig')
-        print(f"   ✓ 已保存: ods_traffic.csv ({len(store_traffic):,} 行)")
+        publish('ods_traffic', store_traffic)
         
         # 8. 生成库存数据（简化版）
         print("\n【步骤 8/8】生成库存数据")
@@ -195,7 +273,8 @@ def main():
             inventory_records.append({
                 'inventory_id': f'INV{inventory_id:08d}',
                 'date': users_df['注册日期'].min(),
-                'product_id': product['SKU_ID'],
+                'sku_id': product['SKU_ID'],
+                'product_id': product['商品ID'],
                 'store_id': product['店铺ID'],
                 'change_type': '入库',
                 'change_quantity': product['库存'],
@@ -206,8 +285,20 @@ def main():
         
         import pandas as pd
         inventory_df = pd.DataFrame(inventory_records)
-        inventory_df.to_csv(data_dir / 'ods_inventory.csv', index=False, encoding='utf-8-sig')
-        print(f"   ✓ 已保存: ods_inventory.csv ({len(inventory_df):,} 行)")
+        publish('ods_inventory', inventory_df)
+        
+        if output_mode != 'direct':
+            ready_manifest['status'] = 'complete'
+            write_ready_manifest(data_dir, ready_manifest)
+        
+        # 等待直连导入全部完成
+        if loader:
+            print("\n等待直连导入完成...")
+            sys.stdout.flush()
+            loader_finished = True
+            if not loader.finish():
+                print("\n✗ 部分表导入失败")
+                return 1
         
         print("\n" + "="*60)
         print("✓ ODS层数据生成完成！")
@@ -216,10 +307,24 @@ def main():
         return 0
         
     except Exception as e:
+        if output_mode != 'direct':
+            ready_manifest['status'] = 'failed'
+            write_ready_manifest(data_dir, ready_manifest)
         print(f"\n✗ 数据生成失败: {e}")
         import traceback
         traceback.print_exc()
         return 1
+    finally:
+        # 生成失败时也要等后台导入线程处理完已提交的表（守护线程在解释器退出时会被中途杀掉，留下半建的表）
+        if loader and not loader_finished:
+            print("\n等待已提交的表导入完成...")
+            sys.stdout.flush()
+            loader.finish()
+            print(f"  已导入: {', '.join(loader.loaded_tables) or '无'}")
+            failed = [name for name in loader.table_names if name not in loader.loaded_tables]
+            if failed:
+                print(f"  未导入: {', '.join(failed)}")
+            sys.stdout.flush()
 
 
 if __name__ == '__main__':
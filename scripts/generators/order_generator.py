@@ -10,6 +10,7 @@ import multiprocessing
 from concurrent.futures import ProcessPoolExecutor, as_completed
 import time
 from .base_generator import BaseGenerator
+from config import calculate_shipping_fee
 
 
 class OrderGenerator(BaseGenerator):
@@ -230,11 +231,7 @@ class OrderGenerator(BaseGenerator):
                 total_amount += item_amount
                 total_cost += item_cost
                 
-                # 计算运费
-                if product['一级类目'].startswith('整车'):
-                    shipping_fee += 30 * quantity
-                else:
-                    shipping_fee += 3 * quantity
+                shipping_fee += calculate_shipping_fee(product['一级类目'], quantity)
                 
                 order_details.append([
                     f'OD{detail_id:08d}',
@@ -0,0 +1,166 @@
+"""
+代理键解析
+生成器已掌握全部店铺/用户/商品，直接在 Python 中构建维度键映射，把代理键写入事实行
+DWD 可以直接 LOAD DATA 导入预解析的事实数据，不再依赖多表关联的 INSERT ... SELECT
+"""
+import numpy as np
+import pandas as pd
+
+
+# 整数编号列：字符串ID（如 U00000001）保留用于展示，另附去掉前缀的 BIGINT 编号供数仓按整数关联
+INTEGER_ID_COLUMNS = {
+    '店铺ID': '店铺编号',
+    '用户ID': '用户编号',
+    'SKU_ID': 'SKU编号',
+    '订单ID': '订单编号',
+    '订单明细ID': '订单明细编号',
+    'store_id': 'store_no',
+    'sku_id': 'sku_no',
+}
+
+# 预解析的事实表：DWD 表名 -> 生成事实行所用的 ODS 源表（源文件指纹与数据库中已加载的一致才可直接导入）
+RESOLVED_FACT_SOURCES = {
+    'dwd_fact_order': ['ods_orders', 'ods_users', 'ods_stores'],
+    'dwd_fact_order_detail': ['ods_orders', 'ods_order_details', 'ods_users', 'ods_stores', 'ods_products'],
+}
+
+
+def add_integer_ids(df):
+    """为字符串ID列追加整数编号列（向量化解析数字部分，已存在的编号列不覆盖）"""
+    for id_col, no_col in INTEGER_ID_COLUMNS.items():
+        if id_col in df.columns and no_col not in df.columns:
+            position = df.columns.get_loc(id_col) + 1
+            numbers = df[id_col].astype('string').str.extract(r'(\d+)$', expand=False)
+            df.insert(position, no_col, pd.to_numeric(numbers).astype('Int64'))
+    return df
+
+
+class DimensionKeyMap:
+    """
+    维度键映射：自然键（字符串ID）-> 代理键及维度属性
+    自然键排序后存为 NumPy 数组，整列查找用 searchsorted 二分，百万行事实数据毫秒级完成
+    """
+
+    def __init__(self, natural_ids, surrogate_keys, **attributes):
+        ids = np.asarray(pd.Series(natural_ids).astype(str), dtype=str)
+        order = np.argsort(ids, kind='stable')
+        self.ids = ids[order]
+        self.keys = np.asarray(surrogate_keys, dtype=np.int64)[order]
+        self.attributes = {
+            name: pd.Series(values).reset_index(drop=True).iloc[order].reset_index(drop=True)
+            for name, values in attributes.items()
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _positions(self, values):
+        """返回 (位置, 是否命中)"""
+        values = np.asarray(pd.Series(values).astype(str), dtype=str)
+        if not len(self.ids):
+            return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.ids, values), len(self.ids) - 1)
+        return positions, self.ids[positions] == values
+
+    def lookup(self, values):
+        """查找代理键，未命中为 <NA>（与 LEFT JOIN 的 NULL 一致）"""
+        positions, found = self._positions(values)
+        if not len(self.ids):
+            return pd.array([pd.NA] * len(positions), dtype='Int64')
+        return pd.Series(self.keys[positions], dtype='Int64').mask(~found).array
+
+    def attribute(self, name, values, default=None):
+        """查找维度属性（保留原列类型），未命中时取 default（默认为空值）"""
+        positions, found = self._positions(values)
+        if not len(self.ids):
+            return pd.Series([default] * len(positions), dtype=self.attributes[name].dtype).array
+        column = self.attributes[name].iloc[positions].reset_index(drop=True)
+        return column.where(found, default).array
+
+
+def _date_key(times):
+    """日期时间列 -> YYYYMMDD 整数"""
+    times = pd.to_datetime(times, errors='coerce', format='mixed')
+    return (times.dt.year * 10000 + times.dt.month * 100 + times.dt.day).astype('Int64')
+
+
+def build_dimension_maps(stores_df, users_df, products_df):
+    """由生成器的店铺/用户/商品数据构建维度键映射（代理键即整数编号，与 DIM 层一致）"""
+    for df in (stores_df, users_df, products_df):
+        add_integer_ids(df)
+    return {
+        'store': DimensionKeyMap(stores_df['店铺ID'], stores_df['店铺编号']),
+        'user': DimensionKeyMap(users_df['用户ID'], users_df['用户编号']),
+        'product': DimensionKeyMap(
+            products_df['SKU_ID'], products_df['SKU编号'], cost=products_df['成本'], category_l1=products_df['一级类目']
+        ),
+    }
+
+
+def resolve_fact_order(orders_df, key_maps):
+    """
+    订单事实行（列与 dwd_fact_order 一致；profit_amount 和 etl_date/etl_time 由导入时计算填充）
+    用户或店铺未知的订单丢弃，与 SQL 构建中的 INNER JOIN 一致
+    """
+    add_integer_ids(orders_df)
+    user_key = key_maps['user'].lookup(orders_df['用户ID'])
+    store_key = key_maps['store'].lookup(orders_df['店铺ID'])
+    fact = pd.DataFrame({
+        'order_key': orders_df['订单编号'].array,
+        'order_id': orders_df['订单ID'].array,
+        'user_id': orders_df['用户ID'].array,
+        'store_id': orders_df['店铺ID'].array,
+        'user_key': user_key,
+        'store_key': store_key,
+        'date_key': _date_key(orders_df['下单时间']).array,
+        'order_status': orders_df['订单状态'].astype(str).to_numpy(),
+        'payment_method': orders_df['支付方式'].astype(str).to_numpy(),
+        'traffic_source': orders_df['流量来源'].astype(str).to_numpy(),
+        'platform': orders_df['平台'].astype(str).to_numpy(),
+        'order_time': orders_df['下单时间'].array,
+        'total_amount': orders_df['商品总额'].array,
+        'discount_amount': orders_df['优惠金额'].fillna(0).array,
+        'shipping_fee': orders_df['运费'].fillna(0).array,
+        'final_amount': orders_df['实付金额'].array,
+        'total_cost': orders_df['成本总额'].fillna(0).array,
+    })
+    valid = fact['order_key'].notna() & fact['user_key'].notna() & fact['store_key'].notna()
+    return fact[valid].reset_index(drop=True)
+
+
+def resolve_fact_order_detail(details_df, fact_order_df, key_maps):
+    """
+    订单明细事实行（列与 dwd_fact_order_detail 一致）
+    店铺/用户/日期键取自所属订单（订单不在事实表中的明细丢弃），商品键、成本和一级类目按 SKU 查找
+    成本/利润/费用等派生金额列不在这里计算：导入时由数据库按 DECIMAL 计算（category_l1 只作运费规则的输入），
+    舍入与 SQL 构建一致
+    """
+    add_integer_ids(details_df)
+    order_map = DimensionKeyMap(
+        fact_order_df['order_id'], fact_order_df['order_key'],
+        store_id=fact_order_df['store_id'], user_key=fact_order_df['user_key'],
+        store_key=fact_order_df['store_key'], date_key=fact_order_df['date_key']
+    )
+    order_ids = details_df['订单ID']
+    product_map = key_maps['product']
+    cost = product_map.attribute('cost', details_df['SKU_ID'], default=0.0)
+
+    fact = pd.DataFrame({
+        'order_detail_key': details_df['订单明细编号'].array,
+        'order_detail_id': details_df['订单明细ID'].array,
+        'order_key': order_map.lookup(order_ids),
+        'order_id': order_ids.array,
+        'product_id': details_df['商品ID'].array,
+        'store_id': order_map.attribute('store_id', order_ids),
+        'user_key': order_map.attribute('user_key', order_ids),
+        'product_key': product_map.lookup(details_df['SKU_ID']),
+        'store_key': order_map.attribute('store_key', order_ids),
+        'date_key': order_map.attribute('date_key', order_ids),
+        'quantity': details_df['数量'].array,
+        'price': details_df['单价'].array,
+        'amount': details_df['金额'].array,
+        'cost': cost,
+        'category_l1': product_map.attribute('category_l1', details_df['SKU_ID']),
+    })
+    valid = fact['order_detail_key'].notna() & fact['order_key'].notna()
+    return fact[valid].reset_index(drop=True)
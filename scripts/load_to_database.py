@@ -3,19 +3,39 @@
 支持全量模式（删除重建）和增量模式（追加数据）
 """
 import pandas as pd
+import numpy as np
 import pymysql
+from pymysql.converters import escape_string
 import os
 import sys
 import json
 from sqlalchemy import create_engine, text
+from sqlalchemy.types import BigInteger, Date, DateTime, String
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import signal
 import atexit
+import threading
+import queue
+
+from etl_control import (
+    ensure_control_tables, get_watermark, set_watermark,
+    file_fingerprint, get_load_checkpoint, save_chunk_checkpoint,
+    mark_table_loaded, reset_load_checkpoint,
+    get_load_manifest, record_load_manifest, clear_load_manifest, read_ready_manifest
+)
+from partitioning import (
+    month_start, month_range, partition_name, monthly_partition_clause, get_partitions,
+    ensure_month_partitions, truncate_month_partitions, create_exchange_table, exchange_month_partition
+)
 
 # 获取项目根目录
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 
+# 批量插入回退路径：每批序列化行数、单条INSERT语句字节上限
+INSERT_BATCH_ROWS = 50000
+MAX_INSERT_STATEMENT_BYTES = 16 * 1024 * 1024
+
 # 全局引擎对象，用于信号处理
 _global_engine = None
 
@@ -49,7 +69,7 @@ def signal_handler(signum, frame):
     print("\n\n[中断] 检测到用户中断，正在清理资源...")
     sys.stdout.flush()
     cleanup_engine()
-    print("[中断] 程序已安全退出")
+    print("[中断] 程序已安全退出（已提交的数据块已记录检查点，可使用 resume 模式继续）")
     sys.stdout.flush()
     sys.exit(1)
 
@@ -57,6 +77,7 @@ def signal_handler(signum, frame):
 COLUMN_MAPPING = {
     'ods_stores': {
         '店铺ID': 'store_id',
+        '店铺编号': 'store_no',
         '店铺名称': 'store_name',
         '店铺类型': 'store_type',
         '平台': 'platform',
@@ -64,10 +85,12 @@ COLUMN_MAPPING = {
     },
     'ods_products': {
         'SKU_ID': 'sku_id',
+        'SKU编号': 'sku_no',
         '商品ID': 'product_id',
         '产品编码': 'product_code',
         '规格编码': 'spec_code',
         '店铺ID': 'store_id',
+        '店铺编号': 'store_no',
         '平台': 'platform',
         '商品名称': 'product_name',
         '规格': 'spec',
@@ -81,6 +104,7 @@ COLUMN_MAPPING = {
     },
     'ods_users': {
         '用户ID': 'user_id',
+        '用户编号': 'user_no',
         '用户名': 'user_name',
         '性别': 'gender',
         '年龄': 'age',
@@ -89,8 +113,11 @@ COLUMN_MAPPING = {
     },
     'ods_orders': {
         '订单ID': 'order_id',
+        '订单编号': 'order_no',
         '用户ID': 'user_id',
+        '用户编号': 'user_no',
         '店铺ID': 'store_id',
+        '店铺编号': 'store_no',
         '平台': 'platform',
         '下单时间': 'order_time',
         '订单状态': 'order_status',
@@ -106,8 +133,11 @@ COLUMN_MAPPING = {
     },
     'ods_order_details': {
         '订单明细ID': 'order_detail_id',
+        '订单明细编号': 'order_detail_no',
         '订单ID': 'order_id',
+        '订单编号': 'order_no',
         'SKU_ID': 'sku_id',
+        'SKU编号': 'sku_no',
         '商品ID': 'product_id',
         '数量': 'quantity',
         '单价': 'price',
@@ -171,6 +201,134 @@ COLUMN_MAPPING = {
 }
 
 
+# 加载模式说明
+MODE_LABELS = {
+    'full': '全量（删除重建）',
+    'reload': '原子重载（影子表切换）',
+    'resume': '断点续传（跳过已完成的表和数据块）',
+    'incremental': '增量（暂存表合并）',
+}
+
+# 影子表后缀：reload 模式先加载到 <表>__new，再一次性 RENAME 切换，旧表改名为 <表>__old 后异步删除
+SHADOW_SUFFIX = '__new'
+OLD_SUFFIX = '__old'
+
+# 日期/时间列类型（其余文本列统一建为 VARCHAR，便于建索引）
+DATE_COLUMN_TYPES = {
+    'date': Date(),
+    'open_date': Date(),
+    'register_date': Date(),
+    'order_time': DateTime(),
+    'create_time': DateTime(),
+    'update_time': DateTime(),
+}
+
+# 整数编号列（字符串ID去掉前缀后的数字），统一建为 BIGINT，供 DWD 按整数关联
+INTEGER_KEY_COLUMNS = {'store_no', 'user_no', 'sku_no', 'order_no', 'order_detail_no'}
+
+# 带日期列的表增加存储生成列 date_key（YYYYMMDD 整数）并建索引，DWD 按整数关联和过滤，不再逐行 DATE_FORMAT
+DATE_KEY_SOURCES = {
+    'ods_orders': 'order_time',
+    'ods_promotion': 'date',
+    'ods_traffic': 'date',
+    'ods_inventory': 'date',
+    'ods_product_traffic': 'date',
+}
+
+# ODS表的延迟索引（数据导入完成后统一创建）
+TABLE_INDEXES = {
+    'ods_stores': {
+        'idx_store_no': ['store_no'],
+    },
+    'ods_products': {
+        'idx_sku_no': ['sku_no'],
+        'idx_store_no': ['store_no'],
+    },
+    'ods_users': {
+        'idx_user_no': ['user_no'],
+    },
+    'ods_orders': {
+        'idx_order_no': ['order_no'],
+        'idx_user_no': ['user_no'],
+        'idx_store_no': ['store_no'],
+        'idx_order_time': ['order_time'],
+        'idx_date_key': ['date_key'],
+    },
+    'ods_order_details': {
+        'idx_order_no': ['order_no'],
+        'idx_sku_no': ['sku_no'],
+    },
+    'ods_promotion': {
+        'idx_promotion_id': ['promotion_id'],
+        'idx_date': ['date'],
+        'idx_date_key': ['date_key'],
+        'idx_sku_no': ['sku_no'],
+    },
+    'ods_traffic': {
+        'idx_date_store': ['date', 'store_no'],
+        'idx_date_key': ['date_key'],
+    },
+    'ods_inventory': {
+        'idx_inventory_id': ['inventory_id'],
+        'idx_date_key': ['date_key'],
+        'idx_sku_no': ['sku_no'],
+    },
+    'ods_product_traffic': {
+        'idx_date_sku': ['date', 'sku_no'],
+        'idx_store_no': ['store_no'],
+    },
+}
+
+# 增量模式：暂存表后缀、各表合并主键、水位线列（只读取水位线之后的新数据）
+STAGE_SUFFIX = '__stage'
+
+TABLE_MERGE_KEYS = {
+    'ods_stores': ['store_no'],
+    'ods_products': ['sku_no'],
+    'ods_users': ['user_no'],
+    'ods_orders': ['order_no', 'order_time'],  # 分区表的唯一键必须包含分区列
+    'ods_order_details': ['order_detail_no'],
+    'ods_promotion': ['promotion_id'],
+    'ods_traffic': ['date', 'store_no'],
+    'ods_inventory': ['inventory_id'],
+    'ods_product_traffic': ['date', 'sku_no', 'channel'],
+}
+
+# 合并键中只因分区要求才加入分区列的表：行的身份键（不含分区列）
+# 重新抽取的行分区列变化时（如订单的下单时间被修正），合并前先删除同身份键的旧行，避免同一订单出现两行
+MERGE_IDENTITY_KEYS = {
+    'ods_orders': ['order_no'],
+}
+
+INCREMENTAL_WATERMARKS = {
+    'ods_orders': 'order_time',
+    'ods_order_details': 'order_detail_id',
+    'ods_promotion': 'date',
+    'ods_traffic': 'date',
+    'ods_product_traffic': 'date',
+    'ods_inventory': 'inventory_id',
+}
+
+# 增量读取CSV的分块行数
+CSV_CHUNK_ROWS = 200000
+
+# 按月 RANGE 分区的表：表名 -> 分区日期列
+PARTITIONED_TABLES = {
+    'ods_orders': 'order_time',
+    'ods_product_traffic': 'date',
+}
+
+# 全量/续传模式下每个检查点数据块的行数
+CHECKPOINT_CHUNK_ROWS = 200000
+
+# 监听模式：轮询就绪清单的间隔（秒）、清单长时间无更新时放弃等待（秒）
+WATCH_POLL_SECONDS = 1.0
+WATCH_IDLE_TIMEOUT = 3600
+
+# 后台删除旧表的线程（进程退出前等待完成）
+_background_drops = []
+
+
 def get_db_connection(db_config):
     """获取数据库连接"""
     try:
@@ -271,52 +429,172 @@ def load_csv_with_load_data_infile(csv_path, table_name, engine, column_mapping)
         return False, 0
 
 
-def load_dataframes_to_db(dataframes, mode='full', db_config=None):
+def _detect_load_data(engine):
+    """检测服务器是否开启 local_infile（未开启时回退到批量插入）"""
+    try:
+        with engine.connect() as conn:
+            result = conn.execute(text("SHOW VARIABLES LIKE 'local_infile'"))
+            row = result.fetchone()
+            if row and row[1].lower() != 'on':
+                print("  ⚠️ local_infile 未开启，使用批量插入模式")
+                print("  提示：执行 SET GLOBAL local_infile=1; 可启用极速导入（需要SUPER权限）")
+                sys.stdout.flush()
+                return False
+    except:
+        return False
+    return True
+
+
+def _load_dataframe(df, table_name, mode, engine, use_load_data):
     """
-    直接从 DataFrame 加载到数据库（跳过 CSV，最快）
-    dataframes: 字典 {table_name: dataframe}
+    将单个内存 DataFrame 导入目标表（直连模式）
+    返回使用的导入方式
     """
-    print(f"\n{'='*60}")
-    print(f"直接从内存加载数据到数据库（高速模式）")
-    print(f"{'='*60}")
+    target_table = f"{table_name}{SHADOW_SUFFIX}" if mode == 'reload' else table_name
     
-    # 创建数据库（如果不存在）
-    if not create_database_if_not_exists(db_config):
-        print("✗ 数据库创建失败")
-        return False
+    # 加载记录先作废：中途失败时表可能为空或不完整，不能再按指纹跳过
+    conn = engine.raw_connection()
+    try:
+        clear_load_manifest(conn, [table_name])
+    finally:
+        conn.close()
     
-    from sqlalchemy import create_engine, text
+    # 删除旧表（reload 模式只删除遗留的影子表）
+    if mode in ('full', 'reload'):
+        with engine.connect() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {target_table}"))
+            conn.commit()
     
-    engine = create_engine(
-        f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}?charset=utf8mb4",
-        pool_size=20,
-        max_overflow=40,
-        pool_pre_ping=True,
-        pool_recycle=3600,
-        echo=False,
-        connect_args={
-            'connect_timeout': 300,
-            'read_timeout': 300,
-            'write_timeout': 300
-        }
-    )
+    # 列名映射
+    if table_name in COLUMN_MAPPING:
+        df = df.rename(columns=COLUMN_MAPPING[table_name])
     
-    # 优化 MySQL 参数
-    try:
-        with engine.connect() as conn:
+    # 增量模式经暂存表按主键合并，其余模式直接导入
+    if mode == 'incremental':
+        method = merge_incremental(df, table_name, engine, use_load_data)
+    else:
+        method = _load_table(df, target_table, engine, use_load_data)
+        create_deferred_indexes(engine, table_name, target_table)
+    record_watermark(engine, table_name, df, keep_max=(mode == 'incremental'))
+    return method
+
+
+class DirectLoader:
+    """
+    直连加载器：生成器每完成一个表就提交给后台线程导入，不经过 CSV 中转
+    小表（店铺/商品/用户）在流量和订单仍在生成时即可完成导入
+    
+    用法:
+        loader = DirectLoader(db_config, mode='full')
+        if loader.start():
+            loader.submit('ods_stores', stores_df)
+            ...
+            success = loader.finish()
+    """
+    
+    def __init__(self, db_config, mode='full'):
+        self.db_config = db_config
+        self.mode = mode
+        self.engine = None
+        self.use_load_data = False
+        self.table_names = []
+        self.loaded_tables = []
+        self.imported_rows = 0
+        self._queue = queue.Queue()
+        self._thread = None
+    
+    def start(self):
+        """创建数据库和连接，启动后台导入线程"""
+        global _global_engine
+        
+        if not create_database_if_not_exists(self.db_config):
+            print("✗ 数据库创建失败")
+            return False
+        
+        db_config = self.db_config
+        self.engine = create_engine(
+            f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}?charset=utf8mb4&local_infile=1",
+            pool_size=20,
+            max_overflow=40,
+            pool_pre_ping=True,
+            pool_recycle=3600,
+            echo=False,
+            connect_args={
+                'connect_timeout': 300,
+                'read_timeout': 300,
+                'write_timeout': 300
+            }
+        )
+        _global_engine = self.engine
+        
+        conn = self.engine.raw_connection()
+        try:
+            ensure_control_tables(conn)
+        finally:
+            conn.close()
+        
+        self.use_load_data = _detect_load_data(self.engine)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        print(f"  ✓ 直连加载已启动 - 模式: {MODE_LABELS.get(self.mode, self.mode)}")
+        sys.stdout.flush()
+        return True
+    
+    def submit(self, table_name, df):
+        """提交一个已生成完成的表（提交后调用方不应再修改该 DataFrame）"""
+        self.table_names.append(table_name)
+        self._queue.put((table_name, df))
+    
+    def _run(self):
+        import time
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            table_name, df = item
             try:
-                conn.execute(text("SET SESSION foreign_key_checks = 0"))
-                conn.execute(text("SET SESSION unique_checks = 0"))
-                conn.execute(text("SET SESSION autocommit = 0"))
-                conn.commit()
-                print("  ✓ MySQL性能参数已优化")
-                sys.stdout.flush()
+                table_start = time.time()
+                method = _load_dataframe(df, table_name, self.mode, self.engine, self.use_load_data)
+                elapsed = time.time() - table_start
+                speed = int(len(df) / elapsed) if elapsed > 0 else len(df)
+                suffix = ' [LOAD DATA]' if method == 'load_data' else ''
+                print(f"  ✓ [直连] {table_name}: {len(df):,} 行 ({speed:,} 行/秒){suffix}")
+                self.imported_rows += len(df)
+                self.loaded_tables.append(table_name)
             except Exception as e:
-                print(f"  警告: 性能优化设置失败 - {e}")
-                sys.stdout.flush()
-    except Exception as e:
-        print(f"  警告: 无法连接数据库进行优化 - {e}")
+                print(f"  ✗ [直连] {table_name}: 失败 - {str(e)}")
+            sys.stdout.flush()
+    
+    def finish(self):
+        """等待队列中的表全部导入完成，reload 模式统一切换；返回是否全部成功"""
+        if self._thread is None:
+            return False
+        self._queue.put(None)
+        self._thread.join()
+        
+        global _global_engine
+        if self.mode == 'reload':
+            _finish_shadow_reload(self.engine, self.db_config, self.table_names, self.loaded_tables)
+        
+        try:
+            self.engine.dispose()
+        except:
+            pass
+        _global_engine = None
+        
+        print(f"\n直连加载完成: {len(self.loaded_tables)}/{len(self.table_names)} 个表成功, 共 {self.imported_rows:,} 行")
         sys.stdout.flush()
+        return len(self.loaded_tables) == len(self.table_names)
+
+
+def load_dataframes_to_db(dataframes, mode='full', db_config=None):
+    """
+    直接从 DataFrame 加载到数据库（跳过 CSV，最快）
+    dataframes: 字典 {table_name: dataframe}
+    """
+    print(f"\n{'='*60}")
+    print(f"直接从内存加载数据到数据库（高速模式）")
+    print(f"{'='*60}")
     
     # 表名映射
     table_mapping = {
@@ -330,81 +608,288 @@ def load_dataframes_to_db(dataframes, mode='full', db_config=None):
         'inventory': 'ods_inventory'
     }
     
-    success_count = 0
+    loader = DirectLoader(db_config, mode)
+    if not loader.start():
+        return False
     
     for df_name, df in dataframes.items():
-        table_name = table_mapping.get(df_name, f'ods_{df_name}')
-        
-        try:
-            print(f"\n  正在加载: {table_name} ({len(df):,} 行)...")
-            sys.stdout.flush()
-            
-            # 删除旧表
-            if mode == 'full':
-                with engine.connect() as conn:
-                    conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
-                    conn.commit()
-            
-            # 列名映射
-            if table_name in COLUMN_MAPPING:
-                df = df.rename(columns=COLUMN_MAPPING[table_name])
-            
-            # 使用原生批量插入（高速模式）
-            batch_insert_native(df, table_name, engine)
-            
-            print(f"  ✓ 加载成功: {table_name} ({len(df):,} 行)")
-            sys.stdout.flush()
-            success_count += 1
-            
-        except Exception as e:
-            print(f"  ✗ 加载失败: {table_name} - {str(e)}")
-            sys.stdout.flush()
+        table_name = df_name if df_name.startswith('ods_') else table_mapping.get(df_name, f'ods_{df_name}')
+        loader.submit(table_name, df)
     
-    # 恢复 MySQL 设置
+    return loader.finish()
+
+
+def create_table_from_df(df, table_name, engine):
+    """
+    按DataFrame结构创建空表（已存在则替换）
+    文本列建为 VARCHAR(255)、日期列建为 DATE/DATETIME、整数编号列建为 BIGINT，保证后续可以直接建索引
+    """
+    dtype = {}
+    for col in df.columns:
+        if col in DATE_COLUMN_TYPES:
+            dtype[col] = DATE_COLUMN_TYPES[col]
+        elif col in INTEGER_KEY_COLUMNS:
+            dtype[col] = BigInteger()
+        elif df[col].dtype == object or isinstance(df[col].dtype, (pd.StringDtype, pd.CategoricalDtype)):
+            dtype[col] = String(255)
+    df.iloc[0:0].to_sql(table_name, con=engine, if_exists='replace', index=False, dtype=dtype)
+    _add_date_key(engine, table_name, df)
+    _apply_partitioning(engine, table_name, df)
+
+
+def _add_date_key(engine, table_name, df):
+    """
+    为带日期列的表增加存储生成列 date_key（影子表/暂存表按正式表处理）
+    导入语句都显式列出数据列，生成列由 MySQL 在写入时自动计算
+    """
+    base_table = table_name
+    for suffix in (SHADOW_SUFFIX, STAGE_SUFFIX):
+        if base_table.endswith(suffix):
+            base_table = base_table[:-len(suffix)]
+    column = DATE_KEY_SOURCES.get(base_table)
+    if column is None or column not in df.columns or 'date_key' in df.columns:
+        return
+    with engine.connect() as conn:
+        conn.execute(text(
+            f"ALTER TABLE `{table_name}` ADD COLUMN date_key INT AS "
+            f"(YEAR(`{column}`) * 10000 + MONTH(`{column}`) * 100 + DAY(`{column}`)) STORED"
+        ))
+        conn.commit()
+
+
+def _partition_column(table_name):
+    """分区表的分区列（影子表按正式表处理），非分区表返回 None"""
+    if table_name.endswith(SHADOW_SUFFIX):
+        table_name = table_name[:-len(SHADOW_SUFFIX)]
+    return PARTITIONED_TABLES.get(table_name)
+
+
+def _df_months(df, column):
+    """DataFrame 中日期列覆盖的月份"""
+    if column not in df.columns:
+        return []
+    values = pd.to_datetime(df[column], errors='coerce', format='mixed').dropna()
+    if values.empty:
+        return []
+    return month_range(values.min(), values.max())
+
+
+def _apply_partitioning(engine, table_name, df):
+    """按数据覆盖的月份为新表建立按月分区（非分区表或无数据时跳过）"""
+    column = _partition_column(table_name)
+    months = _df_months(df, column) if column else []
+    if not months:
+        return
+    with engine.connect() as conn:
+        conn.execute(text(f"ALTER TABLE `{table_name}` {monthly_partition_clause(column, months)}"))
+        conn.commit()
+
+
+def _ensure_partitions(engine, table_name, df):
+    """向已存在的分区表写入前，为数据中的新月份补建分区"""
+    column = _partition_column(table_name)
+    months = _df_months(df, column) if column else []
+    if not months:
+        return
+    conn = engine.raw_connection()
     try:
-        with engine.connect() as conn:
-            try:
-                conn.execute(text("SET SESSION foreign_key_checks = 1"))
-                conn.execute(text("SET SESSION unique_checks = 1"))
-                conn.execute(text("COMMIT"))
-                print("\n  ✓ MySQL设置已恢复")
-                sys.stdout.flush()
-            except Exception as e:
-                print(f"  警告: 恢复设置失败 - {e}")
-                sys.stdout.flush()
-    except Exception as e:
-        print(f"  警告: 无法连接数据库恢复设置 - {e}")
-        sys.stdout.flush()
+        ensure_month_partitions(conn, table_name, months)
     finally:
-        # 确保引擎资源释放
+        conn.close()
+
+
+def create_deferred_indexes(engine, table_name, target_table=None):
+    """
+    数据导入完成后一次性创建索引（单条 ALTER TABLE，只重建一次）
+    table_name: 逻辑表名（用于查找索引定义）
+    target_table: 实际建索引的表（影子表），默认同 table_name
+    """
+    target_table = target_table or table_name
+    indexes = TABLE_INDEXES.get(table_name)
+    if not indexes:
+        return
+    
+    with engine.connect() as conn:
+        existing = {row[0] for row in conn.execute(text(f"SHOW COLUMNS FROM `{target_table}`"))}
+        # 已存在的索引跳过（建索引后、标记完成前中断时，续传会再次走到这里）
+        existing_indexes = {row[2] for row in conn.execute(text(f"SHOW INDEX FROM `{target_table}`"))}
+        clauses = [
+            f"ADD INDEX `{index_name}` ({', '.join(f'`{col}`' for col in columns)})"
+            for index_name, columns in indexes.items()
+            if index_name not in existing_indexes and all(col in existing for col in columns)
+        ]
+        if clauses:
+            conn.execute(text(f"ALTER TABLE `{target_table}` {', '.join(clauses)}"))
+            conn.commit()
+
+
+def _table_exists(conn, table_name):
+    """检查当前库中表是否存在"""
+    result = conn.execute(
+        text("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :t"),
+        {'t': table_name}
+    )
+    return result.scalar() > 0
+
+
+def swap_shadow_tables(engine, table_names):
+    """
+    将一层的所有影子表通过一条 RENAME TABLE 原子切换为正式表
+    旧表改名为 <表>__old，返回需要删除的旧表列表
+    """
+    renames = []
+    old_tables = []
+    with engine.connect() as conn:
+        for table_name in table_names:
+            old_table = f"{table_name}{OLD_SUFFIX}"
+            # 清理上次中断遗留的旧表，避免改名冲突
+            conn.execute(text(f"DROP TABLE IF EXISTS `{old_table}`"))
+            if _table_exists(conn, table_name):
+                renames.append(f"`{table_name}` TO `{old_table}`")
+                old_tables.append(old_table)
+            renames.append(f"`{table_name}{SHADOW_SUFFIX}` TO `{table_name}`")
+        conn.execute(text(f"RENAME TABLE {', '.join(renames)}"))
+        conn.commit()
+    return old_tables
+
+
+def drop_tables_async(db_config, table_names):
+    """在后台线程中删除旧表（读请求不受影响）"""
+    if not table_names:
+        return
+    
+    def _drop():
+        conn = get_db_connection(db_config)
+        if not conn:
+            return
         try:
-            engine.dispose()
-        except:
-            pass
+            cursor = conn.cursor()
+            for table_name in table_names:
+                cursor.execute(f"DROP TABLE IF EXISTS `{table_name}`")
+            conn.commit()
+            cursor.close()
+        except Exception as e:
+            print(f"  警告: 删除旧表失败 - {e}")
+            sys.stdout.flush()
+        finally:
+            conn.close()
     
-    print(f"\n数据加载完成: {success_count}/{len(dataframes)} 个表成功")
-    return success_count == len(dataframes)
+    thread = threading.Thread(target=_drop, name='drop-old-tables')
+    thread.start()
+    _background_drops.append(thread)
+
+
+def wait_for_background_drops():
+    """等待后台删除旧表完成"""
+    while _background_drops:
+        thread = _background_drops.pop()
+        thread.join()
+
+
+def drop_shadow_tables(engine, table_names):
+    """加载失败时清理影子表，保留正式表不变"""
+    with engine.connect() as conn:
+        for table_name in table_names:
+            conn.execute(text(f"DROP TABLE IF EXISTS `{table_name}{SHADOW_SUFFIX}`"))
+        conn.commit()
+
+
+def _object_literal(value):
+    """object 列中单个非空值的SQL字面量（与逐行 executemany 的参数转换一致）"""
+    if isinstance(value, (bool, np.bool_)):
+        return '1' if value else '0'
+    if isinstance(value, (bytes, bytearray)):
+        return "X'" + bytes(value).hex() + "'"
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return repr(float(value)) if np.isfinite(value) else 'NULL'
+    return "'" + escape_string(str(value)) + "'"
+
+
+def _sql_literals(series):
+    """
+    将一列数据向量化转换为SQL字面量数组（NULL / 数字 / 转义后的字符串）
+    按列处理，避免逐单元格调用 pd.isna；非有限浮点数（inf）写为 NULL
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # 分类列：只序列化类别本身，再按编码取值
+        categories = _sql_literals(pd.Series(series.cat.categories))
+        codes = series.cat.codes.to_numpy()
+        out = categories[codes]
+        out[codes < 0] = 'NULL'
+        return out
+    
+    mask = series.isna().to_numpy()
+    kind = series.dtype.kind
+    
+    if kind == 'b':
+        # 可空布尔列的 NA 先填充，再由 mask 写为 NULL
+        out = np.where(series.to_numpy(dtype=bool, na_value=False), '1', '0').astype(object)
+    elif kind == 'f':
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+        out = values.astype(str).astype(object)
+        mask = mask | ~np.isfinite(values)
+    elif kind in 'iu':
+        # 可空整数等扩展类型：转为object，避免整数被提升为浮点
+        values = series.to_numpy(dtype=object) if pd.api.types.is_extension_array_dtype(series.dtype) else series.to_numpy()
+        out = values.astype(str).astype(object)
+    elif kind == 'M':
+        out = series.dt.strftime("'%Y-%m-%d %H:%M:%S'").to_numpy(dtype=object)
+    else:
+        values = series.to_numpy(dtype=object)
+        out = np.full(len(values), 'NULL', dtype=object)
+        valid = ~mask
+        out[valid] = [_object_literal(v) for v in values[valid]]
+    
+    if mask.any():
+        out[mask] = 'NULL'
+    return out
 
 
-def batch_insert_native(df, table_name, engine):
+def _build_insert_statements(df, start, stop, sql_prefix, max_statement_bytes):
     """
-    高性能批量插入 - 行业标准速度
-    使用executemany + 大批次 + 禁用索引检查
-    目标：10万行/秒
+    序列化 df[start:stop] 为若干条多行 INSERT 语句
+    每条语句不超过 max_statement_bytes（由 max_allowed_packet 决定）
     """
-    import numpy as np
+    columns = [_sql_literals(df[col].iloc[start:stop]) for col in df.columns]
+    rows = ['(' + ','.join(row) + ')' for row in zip(*columns)]
     
-    df = df.replace({np.nan: None})
+    statements = []
+    prefix_bytes = len(sql_prefix.encode('utf-8'))
+    current = []
+    current_bytes = prefix_bytes
+    for row in rows:
+        row_bytes = len(row.encode('utf-8')) + 1
+        if current and current_bytes + row_bytes > max_statement_bytes:
+            statements.append(sql_prefix + ','.join(current))
+            current = []
+            current_bytes = prefix_bytes
+        current.append(row)
+        current_bytes += row_bytes
+    if current:
+        statements.append(sql_prefix + ','.join(current))
+    return statements
+
+
+def batch_insert_native(df, table_name, engine, create_table=True, before_commit=None):
+    """
+    高性能批量插入（LOAD DATA 不可用时的回退路径）
+    按列向量化序列化为多行 INSERT ... VALUES，语句大小受 max_allowed_packet 约束
+    后台线程序列化第 N+1 批的同时，主线程执行第 N 批（不复制整个DataFrame）
     
-    columns = df.columns.tolist()
-    columns_str = ', '.join([f'`{col}`' for col in columns])
-    placeholders = ', '.join(['%s'] * len(columns))
+    create_table: 是否先按 DataFrame 重建表结构（追加数据块时传 False）
+    before_commit: 提交前回调 before_commit(conn)，用于在同一事务中写入检查点
+    """
+    columns_str = ', '.join([f'`{col}`' for col in df.columns])
+    sql_prefix = f"INSERT INTO `{table_name}` ({columns_str}) VALUES "
     
-    # 先用pandas创建表结构
-    df.iloc[0:0].to_sql(table_name, con=engine, if_exists='replace', index=False)
+    # 先创建表结构
+    if create_table:
+        create_table_from_df(df, table_name, engine)
     
     total_rows = len(df)
-    batch_size = 10000  # 1万条/批，平衡内存和速度
+    batch_size = INSERT_BATCH_ROWS
     
     conn = engine.raw_connection()
     cursor = conn.cursor()
@@ -415,14 +900,32 @@ def batch_insert_native(df, table_name, engine):
         cursor.execute("SET foreign_key_checks=0")
         cursor.execute("SET autocommit=0")
         
-        # 批量插入
-        sql = f"INSERT INTO `{table_name}` ({columns_str}) VALUES ({placeholders})"
+        # 单条语句上限：max_allowed_packet 留出余量
+        cursor.execute("SELECT @@max_allowed_packet")
+        max_packet = int(cursor.fetchone()[0])
+        max_statement_bytes = max(1024 * 1024, min(max_packet - 64 * 1024, MAX_INSERT_STATEMENT_BYTES))
         
-        for i in range(0, total_rows, batch_size):
-            batch = df.iloc[i:i+batch_size]
-            values = [tuple(None if pd.isna(x) else x for x in row) for row in batch.values]
-            cursor.executemany(sql, values)
+        # 序列化与执行流水线：序列化在后台线程，网络I/O期间释放GIL
+        with ThreadPoolExecutor(max_workers=1) as serializer:
+            pending = None
+            if total_rows > 0:
+                pending = serializer.submit(
+                    _build_insert_statements, df, 0, min(batch_size, total_rows),
+                    sql_prefix, max_statement_bytes
+                )
+            for start in range(0, total_rows, batch_size):
+                statements = pending.result()
+                next_start = start + batch_size
+                if next_start < total_rows:
+                    pending = serializer.submit(
+                        _build_insert_statements, df, next_start, min(next_start + batch_size, total_rows),
+                        sql_prefix, max_statement_bytes
+                    )
+                for statement in statements:
+                    cursor.execute(statement)
         
+        if before_commit:
+            before_commit(conn)
         conn.commit()
         
         # 恢复设置
@@ -437,10 +940,11 @@ def batch_insert_native(df, table_name, engine):
         conn.close()
 
 
-def load_with_load_data_infile(df, table_name, engine):
+def load_with_load_data_infile(df, table_name, engine, create_table=True, before_commit=None):
     """
     使用 LOAD DATA LOCAL INFILE 极速导入（需要开启 local_infile）
     性能：比批量插入快 5-10 倍
+    create_table / before_commit 含义同 batch_insert_native
     
     需要配置：
     1. MySQL配置文件添加：local_infile=1
@@ -465,13 +969,8 @@ def load_with_load_data_infile(df, table_name, engine):
         columns = ', '.join([f'`{col}`' for col in df.columns])
         
         # 创建表结构（空表）
-        first_row = df.iloc[0:1]
-        first_row.to_sql(table_name, con=engine, if_exists='replace', index=False)
-        
-        # 清空表，准备LOAD DATA
-        with engine.connect() as conn_temp:
-            conn_temp.execute(text(f"TRUNCATE TABLE `{table_name}`"))
-            conn_temp.commit()
+        if create_table:
+            create_table_from_df(df, table_name, engine)
         
         # 使用 LOAD DATA LOCAL INFILE
         conn = engine.raw_connection()
@@ -501,6 +1000,8 @@ def load_with_load_data_infile(df, table_name, engine):
             """
             
             cursor.execute(load_sql)
+            # 必须紧跟 LOAD DATA 读取，后续 SET 语句会覆盖 rowcount
+            affected_rows = cursor.rowcount
             
             # 恢复设置
             cursor.execute("SET unique_checks=1")
@@ -511,8 +1012,9 @@ def load_with_load_data_infile(df, table_name, engine):
             except:
                 pass
             
+            if before_commit:
+                before_commit(conn)
             conn.commit()
-            affected_rows = cursor.rowcount
             
             return True, affected_rows
             
@@ -553,23 +1055,258 @@ def load_with_load_data_infile(df, table_name, engine):
                 pass
 
 
-def load_csv_file(csv_path, table_name):
-    """多线程读取单个CSV文件"""
+def _load_table(df, table_name, engine, use_load_data, create_table=True, before_commit=None):
+    """
+    导入单个表：大表优先 LOAD DATA INFILE，失败或不可用时回退到批量插入
+    返回使用的导入方式（'load_data' / 'insert'）
+    """
+    if not create_table:
+        _ensure_partitions(engine, table_name, df)
+    
+    if use_load_data and len(df) > 10000:
+        success, affected = load_with_load_data_infile(df, table_name, engine, create_table, before_commit)
+        if success and affected > 0:
+            return 'load_data'
+    
+    batch_insert_native(df, table_name, engine, create_table, before_commit)
+    return 'insert'
+
+
+def load_table_checkpointed(df, table_name, engine, use_load_data, fingerprint, committed_chunks=None):
+    """
+    分块导入单个表，每块数据与检查点在同一事务中提交
+    committed_chunks: resume 模式下已提交的块 {chunk_index: rows}，这些块直接跳过
+    返回使用的导入方式
+    """
+    committed_chunks = committed_chunks or {}
+    total_rows = len(df)
+    method = 'insert'
+    
+    # 按整表数据建表（分区表按全部月份建分区）；续传时表已存在
+    if 0 not in committed_chunks:
+        create_table_from_df(df, table_name, engine)
+    
+    for chunk_index, start in enumerate(range(0, max(total_rows, 1), CHECKPOINT_CHUNK_ROWS)):
+        if chunk_index in committed_chunks:
+            continue
+        
+        chunk = df.iloc[start:start + CHECKPOINT_CHUNK_ROWS]
+        
+        def _save_checkpoint(conn, chunk_index=chunk_index, start=start, rows=len(chunk)):
+            save_chunk_checkpoint(conn, table_name, chunk_index, fingerprint, start, rows)
+        
+        method = _load_table(chunk, table_name, engine, use_load_data, False, _save_checkpoint)
+        if len(committed_chunks) > 0 or chunk_index > 0:
+            print(f"    {table_name}: 块 {chunk_index + 1} 已提交 ({min(start + len(chunk), total_rows):,}/{total_rows:,} 行)")
+            sys.stdout.flush()
+    
+    create_deferred_indexes(engine, table_name)
+    
+    conn = engine.raw_connection()
     try:
-        df = pd.read_csv(csv_path, encoding='utf-8-sig', low_memory=False)
-        if table_name in COLUMN_MAPPING:
-            df = df.rename(columns=COLUMN_MAPPING[table_name])
+        mark_table_loaded(conn, table_name, fingerprint, total_rows)
+    finally:
+        conn.close()
+    return method
+
+
+def _finish_shadow_reload(engine, db_config, table_names, loaded_tables):
+    """reload 模式收尾：全部影子表就绪后原子切换，旧表后台删除"""
+    if len(loaded_tables) != len(table_names):
+        print("\n  ✗ 部分表加载失败，放弃切换，正式表保持不变")
+        drop_shadow_tables(engine, table_names)
+        sys.stdout.flush()
+        return False
+    
+    old_tables = swap_shadow_tables(engine, table_names)
+    print(f"\n  ✓ 已原子切换 {len(table_names)} 个表（RENAME TABLE）")
+    drop_tables_async(db_config, old_tables)
+    if old_tables:
+        print(f"  后台删除 {len(old_tables)} 个旧表...")
+    sys.stdout.flush()
+    return True
+
+
+def _watermark_key(values, column):
+    """
+    水位线列转为可比较的原生类型（按字符串比较时 '10' < '9'）：
+    日期时间列按时间、纯数字按数值、带前缀的字符串ID（如 OD00000010）按数字部分，其余按字符串
+    """
+    values = pd.Series(values).reset_index(drop=True)
+    if column in DATE_COLUMN_TYPES:
+        return pd.to_datetime(values, errors='coerce')
+    numeric = pd.to_numeric(values, errors='coerce')
+    if numeric.notna().all():
+        return numeric
+    digits = pd.to_numeric(values.astype(str).str.extract(r'(\d+)$', expand=False), errors='coerce')
+    if digits.notna().all():
+        return digits
+    return values.astype(str)
+
+
+def load_csv_file(csv_path, table_name, watermark=None):
+    """
+    多线程读取单个CSV文件
+    watermark: 增量模式下的水位线，只保留水位线列 >= 该值的行（分块读取过滤）
+    """
+    try:
+        column = INCREMENTAL_WATERMARKS.get(table_name)
+        if watermark is None or column is None:
+            df = pd.read_csv(csv_path, encoding='utf-8-sig', low_memory=False)
+            if table_name in COLUMN_MAPPING:
+                df = df.rename(columns=COLUMN_MAPPING[table_name])
+            return table_name, df, None
+        
+        chunks = []
+        reader = pd.read_csv(csv_path, encoding='utf-8-sig', low_memory=False, chunksize=CSV_CHUNK_ROWS)
+        for chunk in reader:
+            if table_name in COLUMN_MAPPING:
+                chunk = chunk.rename(columns=COLUMN_MAPPING[table_name])
+            keys = _watermark_key(chunk[column], column)
+            threshold = _watermark_key([watermark], column)[0]
+            chunks.append(chunk[(keys >= threshold).to_numpy()])
+        df = pd.concat(chunks, ignore_index=True)
         return table_name, df, None
     except Exception as e:
         return table_name, None, str(e)
 
 
-def load_layer_to_db(layer, mode='full', db_config=None):
+def _has_merge_key(conn, table_name, keys):
+    """
+    确保正式表上有合并主键对应的唯一索引（uk_merge）
+    已有重复数据导致无法创建时返回 False，改用反连接插入
+    """
+    result = conn.execute(
+        text("SELECT COUNT(*) FROM information_schema.statistics "
+             "WHERE table_schema = DATABASE() AND table_name = :t AND index_name = 'uk_merge'"),
+        {'t': table_name}
+    )
+    if result.scalar() > 0:
+        return True
+    try:
+        key_columns = ', '.join(f'`{col}`' for col in keys)
+        conn.execute(text(f"ALTER TABLE `{table_name}` ADD UNIQUE KEY `uk_merge` ({key_columns})"))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        return False
+
+
+def merge_incremental(df, table_name, engine, use_load_data):
+    """
+    增量合并：新数据先批量导入 <表>__stage，再按主键合并到正式表
+    有唯一索引时使用 INSERT ... ON DUPLICATE KEY UPDATE，否则使用反连接只插入新主键
+    MERGE_IDENTITY_KEYS 中的表先删除身份键相同但分区列已变化的旧行，再合并
+    返回合并方式（'create' / 'upsert' / 'anti_join' / 'append'）
+    """
+    stage_table = f"{table_name}{STAGE_SUFFIX}"
+    _load_table(df, stage_table, engine, use_load_data)
+    
+    keys = [col for col in TABLE_MERGE_KEYS.get(table_name, []) if col in df.columns]
+    columns = [f'`{col}`' for col in df.columns]
+    columns_str = ', '.join(columns)
+    
+    with engine.connect() as conn:
+        if not _table_exists(conn, table_name):
+            # 首次加载：暂存表直接转正
+            conn.execute(text(f"RENAME TABLE `{stage_table}` TO `{table_name}`"))
+            conn.commit()
+            method = 'create'
+        else:
+            _ensure_partitions(engine, table_name, df)
+            # 唯一索引可能需要 ALTER 创建（隐式提交），须在删除旧行之前确定
+            has_merge_key = bool(keys) and _has_merge_key(conn, table_name, keys)
+            identity = [col for col in MERGE_IDENTITY_KEYS.get(table_name, []) if col in df.columns]
+            changed = [col for col in keys if col not in identity]
+            if identity and changed:
+                # 与随后的合并在同一事务中提交
+                join_on = ' AND '.join(f"t.`{col}` = s.`{col}`" for col in identity)
+                differs = ' OR '.join(f"NOT (t.`{col}` <=> s.`{col}`)" for col in changed)
+                conn.execute(text(
+                    f"DELETE t FROM `{table_name}` t INNER JOIN `{stage_table}` s ON {join_on} WHERE {differs}"
+                ))
+            if has_merge_key:
+                updates = ', '.join(f"{col} = VALUES({col})" for col in columns if col.strip('`') not in keys)
+                conn.execute(text(
+                    f"INSERT INTO `{table_name}` ({columns_str}) SELECT {columns_str} FROM `{stage_table}` "
+                    f"ON DUPLICATE KEY UPDATE {updates or f'{columns[0]} = {columns[0]}'}"
+                ))
+                method = 'upsert'
+            elif keys:
+                join_on = ' AND '.join(f"t.`{col}` = s.`{col}`" for col in keys)
+                select_cols = ', '.join(f"s.{col}" for col in columns)
+                conn.execute(text(
+                    f"INSERT INTO `{table_name}` ({columns_str}) SELECT {select_cols} FROM `{stage_table}` s "
+                    f"LEFT JOIN `{table_name}` t ON {join_on} WHERE t.`{keys[0]}` IS NULL"
+                ))
+                method = 'anti_join'
+            else:
+                conn.execute(text(f"INSERT INTO `{table_name}` ({columns_str}) SELECT {columns_str} FROM `{stage_table}`"))
+                method = 'append'
+            conn.commit()
+            conn.execute(text(f"DROP TABLE IF EXISTS `{stage_table}`"))
+            conn.commit()
+    
+    if method == 'create':
+        _apply_partitioning(engine, table_name, df)
+        create_deferred_indexes(engine, table_name)
+    return method
+
+
+def record_watermark(engine, table_name, df, keep_max=False):
+    """
+    按本次加载数据的最大值更新水位线（不扫描正式表）
+    keep_max: 增量模式下与已有水位线取较大值
+    按列的原生类型比较取最大值，保存该行的原始值（读取时再按同一类型解析）
+    """
+    column = INCREMENTAL_WATERMARKS.get(table_name)
+    if column is None or column not in df.columns:
+        return
+    values = df[column].dropna()
+    if values.empty:
+        return
+    values = values.reset_index(drop=True)
+    keys = _watermark_key(values, column)
+    if keys.isna().all():
+        return
+    latest = str(values[keys.idxmax()])
+    
+    conn = engine.raw_connection()
+    try:
+        if keep_max:
+            previous = get_watermark(conn, table_name)
+            if previous is not None:
+                keys = _watermark_key([latest, previous], column)
+                if keys[0] < keys[1]:
+                    latest = previous
+        set_watermark(conn, table_name, column, latest)
+    finally:
+        conn.close()
+
+
+def record_loaded_sources(engine, table_names, csv_paths, fingerprints, dataframes, full_replace=True):
+    """将成功加载的表及其源文件指纹写入加载清单（full_replace: 是否整表替换加载）"""
+    conn = engine.raw_connection()
+    try:
+        for table_name in table_names:
+            record_load_manifest(
+                conn, table_name, os.path.basename(csv_paths[table_name]),
+                fingerprints[table_name], len(dataframes[table_name]), full_replace
+            )
+    finally:
+        conn.close()
+
+
+def load_layer_to_db(layer, mode='full', db_config=None, force=False):
     """
     加载指定层的数据到数据库（优化版：使用 LOAD DATA INFILE）
     layer: 'ods', 'dwd', 'dws'
-    mode: 'full' 全量模式（删除重建）, 'incremental' 增量模式（追加）
+    mode: 'full' 全量模式（删除重建）, 'reload' 原子重载（影子表 + RENAME 切换）,
+          'incremental' 增量模式（暂存表 + 按主键合并，只读取水位线之后的数据）,
+          'resume' 断点续传（跳过已完成的表和数据块，从中断处继续）
     db_config: 数据库配置
+    force: 为 True 时忽略加载清单，源文件未变化的表也重新加载
     """
     print(f"\n{'='*60}")
     print(f"开始加载 {layer.upper()} 层数据 - 模式: {mode}")
@@ -625,18 +1362,61 @@ def load_layer_to_db(layer, mode='full', db_config=None):
         print(f"警告: {layer_path} 目录下没有CSV文件")
         return False
     
+    csv_paths = {f.replace('.csv', ''): os.path.join(layer_path, f) for f in csv_files}
+    fingerprints = {table_name: file_fingerprint(path) for table_name, path in csv_paths.items()}
+    
+    # 增量模式：读取各表水位线，只读取水位线之后的数据
+    # 续传模式：读取检查点，已完成的表不再读取
+    # 加载清单：源文件指纹与上次成功加载一致且表仍存在的，直接跳过
+    #           （非增量模式要求上次也是整表加载，增量合并过的表仍按源文件重建）
+    watermarks = {}
+    resume_chunks = {}
+    completed_tables = []
+    unchanged_tables = []
+    conn = engine.raw_connection()
+    try:
+        ensure_control_tables(conn)
+        manifest = {} if force else get_load_manifest(conn, full_replace_only=(mode != 'incremental'))
+        with engine.connect() as sa_conn:
+            for table_name in list(csv_paths.keys()):
+                if manifest.get(table_name) == fingerprints[table_name] and _table_exists(sa_conn, table_name):
+                    unchanged_tables.append(table_name)
+                    del csv_paths[table_name]
+        
+        for table_name in list(csv_paths.keys()):
+            if mode == 'incremental' and table_name in INCREMENTAL_WATERMARKS:
+                watermarks[table_name] = get_watermark(conn, table_name)
+            elif mode == 'resume':
+                done, chunks = get_load_checkpoint(conn, table_name, fingerprints[table_name])
+                if done:
+                    completed_tables.append(table_name)
+                    del csv_paths[table_name]
+                else:
+                    resume_chunks[table_name] = chunks
+    finally:
+        conn.close()
+    
+    if unchanged_tables:
+        print(f"\n源文件未变化: 跳过 {len(unchanged_tables)} 个表 ({', '.join(sorted(unchanged_tables))})")
+        sys.stdout.flush()
+    if completed_tables:
+        print(f"\n断点续传: 跳过 {len(completed_tables)} 个已完成的表 ({', '.join(sorted(completed_tables))})")
+        sys.stdout.flush()
+    if not csv_paths:
+        print("✓ 所有表均已是最新，无需加载")
+        engine.dispose()
+        return True
+    
     # 多线程读取所有CSV文件到内存（极致并发）
-    print(f"\n使用多线程读取 {len(csv_files)} 个CSV文件...")
+    print(f"\n使用多线程读取 {len(csv_paths)} 个CSV文件...")
     sys.stdout.flush()
     
     dataframes = {}
-    max_read_workers = min(len(csv_files), 16)
+    max_read_workers = min(len(csv_paths), 16)
     with ThreadPoolExecutor(max_workers=max_read_workers) as executor:
         futures = {}
-        for csv_file in csv_files:
-            table_name = csv_file.replace('.csv', '')
-            csv_path = os.path.join(layer_path, csv_file)
-            futures[executor.submit(load_csv_file, csv_path, table_name)] = table_name
+        for table_name, csv_path in csv_paths.items():
+            futures[executor.submit(load_csv_file, csv_path, table_name, watermarks.get(table_name))] = table_name
         
         for future in as_completed(futures):
             table_name, df, error = future.result()
@@ -655,32 +1435,42 @@ def load_layer_to_db(layer, mode='full', db_config=None):
     print(f"\n所有文件已读取到内存，开始并行导入...")
     sys.stdout.flush()
     
-    # 先删除旧表
-    if mode == 'full':
-        print("  删除旧表...")
+    # 将要加载的表先作废加载记录，全部成功后再写回（中途失败的表下次不会因指纹一致被跳过）
+    conn = engine.raw_connection()
+    try:
+        clear_load_manifest(conn, dataframes.keys())
+    finally:
+        conn.close()
+    
+    # 先删除旧表（reload 模式只清理遗留的影子表，正式表在切换前保持可读）
+    # 续传模式只删除需要从头加载的表（无已提交数据块或表已不存在）
+    if mode in ('full', 'resume'):
         with engine.connect() as conn:
-            for table_name in dataframes.keys():
-                conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
-            conn.commit()
-        print("  ✓ 旧表已删除")
-        sys.stdout.flush()
+            fresh_tables = [
+                table_name for table_name in dataframes.keys()
+                if mode == 'full' or not resume_chunks.get(table_name) or not _table_exists(conn, table_name)
+            ]
+        if fresh_tables:
+            print("  删除旧表...")
+            with engine.connect() as conn:
+                for table_name in fresh_tables:
+                    conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+                conn.commit()
+            conn = engine.raw_connection()
+            try:
+                for table_name in fresh_tables:
+                    reset_load_checkpoint(conn, table_name)
+                    resume_chunks[table_name] = {}
+            finally:
+                conn.close()
+            print("  ✓ 旧表已删除")
+            sys.stdout.flush()
+    elif mode == 'reload':
+        drop_shadow_tables(engine, dataframes.keys())
     
     # 尝试使用 LOAD DATA INFILE（最快），失败则回退到批量插入
     success_count = 0
-    use_load_data = True  # 默认尝试使用 LOAD DATA INFILE
-    
-    # 先测试是否支持 LOAD DATA LOCAL INFILE
-    try:
-        with engine.connect() as conn:
-            result = conn.execute(text("SHOW VARIABLES LIKE 'local_infile'"))
-            row = result.fetchone()
-            if row and row[1].lower() != 'on':
-                print("  ⚠️ local_infile 未开启，使用批量插入模式")
-                print("  提示：执行 SET GLOBAL local_infile=1; 可启用极速导入（需要SUPER权限）")
-                sys.stdout.flush()
-                use_load_data = False
-    except:
-        use_load_data = False
+    use_load_data = _detect_load_data(engine)
     
     # 按数据量排序，小表先导入
     sorted_tables = sorted(dataframes.items(), key=lambda x: len(x[1]))
@@ -690,34 +1480,57 @@ def load_layer_to_db(layer, mode='full', db_config=None):
     start_time = time.time()
     imported_rows = 0
     
+    loaded_tables = []
     for table_name, df in sorted_tables:
         try:
             table_start = time.time()
             rows = len(df)
+            target_table = f"{table_name}{SHADOW_SUFFIX}" if mode == 'reload' else table_name
             
-            # 大表尝试LOAD DATA INFILE
-            if use_load_data and rows > 10000:
-                success, affected = load_with_load_data_infile(df, table_name, engine)
-                if success and affected > 0:
-                    elapsed = time.time() - table_start
-                    speed = int(rows / elapsed) if elapsed > 0 else rows
-                    print(f"  ✓ {table_name}: {rows:,} 行 ({speed:,} 行/秒) [LOAD DATA]")
-                    imported_rows += rows
+            if mode == 'incremental':
+                if rows == 0:
+                    print(f"  - {table_name}: 无新增数据")
                     success_count += 1
+                    loaded_tables.append(table_name)
                     continue
+                method = merge_incremental(df, table_name, engine, use_load_data)
+            elif mode == 'reload':
+                method = _load_table(df, target_table, engine, use_load_data)
+                create_deferred_indexes(engine, table_name, target_table)
+            else:
+                method = load_table_checkpointed(
+                    df, table_name, engine, use_load_data,
+                    fingerprints[table_name], resume_chunks.get(table_name)
+                )
+            record_watermark(engine, table_name, df, keep_max=(mode == 'incremental'))
             
-            # 批量插入
-            batch_insert_native(df, table_name, engine)
             elapsed = time.time() - table_start
             speed = int(rows / elapsed) if elapsed > 0 else rows
-            print(f"  ✓ {table_name}: {rows:,} 行 ({speed:,} 行/秒)")
+            suffix = {
+                'load_data': ' [LOAD DATA]',
+                'upsert': ' [增量合并]',
+                'anti_join': ' [增量追加]',
+            }.get(method, '')
+            print(f"  ✓ {table_name}: {rows:,} 行 ({speed:,} 行/秒){suffix}")
             imported_rows += rows
             success_count += 1
+            loaded_tables.append(table_name)
             
         except Exception as e:
             print(f"  ✗ {table_name}: 失败 - {str(e)[:50]}")
             sys.stdout.flush()
     
+    # reload 模式：全部成功才切换，否则丢弃影子表、保留旧数据
+    if mode == 'reload':
+        if not _finish_shadow_reload(engine, db_config, list(dataframes.keys()), loaded_tables):
+            loaded_tables = []
+    
+    # 记录加载清单（下次源文件未变化时跳过）
+    if loaded_tables:
+        record_loaded_sources(
+            engine, loaded_tables, csv_paths, fingerprints, dataframes, full_replace=(mode != 'incremental')
+        )
+    
     # 打印总体性能
     total_time = time.time() - start_time
     avg_speed = int(imported_rows / total_time) if total_time > 0 else imported_rows
@@ -749,6 +1562,175 @@ def load_layer_to_db(layer, mode='full', db_config=None):
     return success_count == len(dataframes)
 
 
+def reload_month_partitions(layer, months, db_config):
+    """
+    分区级重载：只重建分区表中指定月份的数据，其它月份不受影响
+    每个月的数据先导入交换表，再 EXCHANGE PARTITION 原子替换；源文件中该月无数据时清空分区
+    months: ['2024-03', ...]
+    """
+    print(f"\n{'='*60}")
+    print(f"分区级重载 {layer.upper()} 层 - 月份: {', '.join(months)}")
+    print(f"{'='*60}")
+    sys.stdout.flush()
+    
+    months = [month_start(month) for month in months]
+    engine = create_engine(
+        f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}?charset=utf8mb4&local_infile=1",
+        pool_pre_ping=True,
+        pool_recycle=3600
+    )
+    use_load_data = _detect_load_data(engine)
+    success = True
+    
+    for table_name, column in PARTITIONED_TABLES.items():
+        csv_path = os.path.join(DATA_DIR, layer, f'{table_name}.csv')
+        if not os.path.exists(csv_path):
+            continue
+        
+        conn = engine.raw_connection()
+        try:
+            if not get_partitions(conn, table_name):
+                print(f"  ✗ {table_name}: 不是分区表，请先执行全量加载")
+                sys.stdout.flush()
+                success = False
+                continue
+            
+            _, df, error = load_csv_file(csv_path, table_name)
+            if error:
+                print(f"  ✗ 读取失败: {table_name} - {error}")
+                sys.stdout.flush()
+                success = False
+                continue
+            
+            row_months = pd.to_datetime(df[column], errors='coerce', format='mixed').dt.to_period('M')
+            ensure_month_partitions(conn, table_name, months)
+            existing = set(get_partitions(conn, table_name))
+            missing = [f"{month:%Y-%m}" for month in months if partition_name(month) not in existing]
+            if missing:
+                print(f"  ✗ {table_name}: 无法为这些月份建立分区: {', '.join(missing)}（请先执行全量加载）")
+                sys.stdout.flush()
+                success = False
+                continue
+            for month in months:
+                month_df = df[row_months == pd.Period(month, freq='M')]
+                if month_df.empty:
+                    truncate_month_partitions(conn, table_name, [month])
+                    print(f"  ✓ {table_name}.{partition_name(month)}: 源文件无数据，已清空分区")
+                    continue
+                
+                exchange_table = f"{table_name}__{partition_name(month)}"
+                create_exchange_table(conn, table_name, exchange_table)
+                _load_table(month_df, exchange_table, engine, use_load_data, create_table=False)
+                exchange_month_partition(conn, table_name, month, exchange_table)
+                cursor = conn.cursor()
+                cursor.execute(f"DROP TABLE IF EXISTS `{exchange_table}`")
+                cursor.close()
+                print(f"  ✓ {table_name}.{partition_name(month)}: {len(month_df):,} 行（分区交换）")
+                sys.stdout.flush()
+        except Exception as e:
+            print(f"  ✗ {table_name}: 分区重载失败 - {str(e)}")
+            sys.stdout.flush()
+            success = False
+        finally:
+            conn.close()
+    
+    engine.dispose()
+    return success
+
+
+def watch_layer_to_db(layer, mode='full', db_config=None, run_id=None):
+    """
+    监听模式：轮询生成器写出的就绪清单，每个表一就绪就读取并导入
+    生成与加载重叠进行，店铺/商品/用户在流量生成结束前就已导入完成
+    清单状态为 complete 且所有表都已提交后结束；状态为 failed 时中止
+    run_id: 只接受该次运行的清单；未指定时只接受监听开始之后启动的运行
+    （监听先于生成器启动时，磁盘上还是上一轮 complete 的清单，其文件指纹仍一致，不能当作本轮数据导入）
+    """
+    import time
+    
+    started_run_id = time.strftime('%Y%m%d%H%M%S')
+    
+    def is_current(manifest):
+        manifest_run_id = str(manifest.get('run_id') or '')
+        if run_id:
+            return manifest_run_id == str(run_id)
+        return manifest_run_id >= started_run_id
+    
+    print(f"\n{'='*60}")
+    print(f"监听 {layer.upper()} 层就绪清单 - 模式: {mode}")
+    print(f"{'='*60}")
+    sys.stdout.flush()
+    
+    layer_path = os.path.join(DATA_DIR, layer)
+    loader = DirectLoader(db_config, mode)
+    if not loader.start():
+        return False
+    
+    submitted = {}
+    last_change = time.time()
+    status = None
+    waiting_reported = False
+    while True:
+        manifest = read_ready_manifest(layer_path)
+        if manifest and not is_current(manifest):
+            if not waiting_reported:
+                print(f"  等待本轮生成（忽略旧清单 run_id={manifest.get('run_id')}）")
+                sys.stdout.flush()
+                waiting_reported = True
+            manifest = None
+        if manifest:
+            status = manifest.get('status')
+            for table_name, entry in manifest.get('tables', {}).items():
+                if table_name in submitted:
+                    continue
+                csv_path = os.path.join(layer_path, entry['file'])
+                fingerprint = file_fingerprint(csv_path)
+                if fingerprint != entry.get('fingerprint'):
+                    continue  # 文件与清单登记不一致（已被下一轮覆盖），等待清单更新
+                _, df, error = load_csv_file(csv_path, table_name)
+                if error:
+                    print(f"  ✗ 读取失败: {table_name} - {error}")
+                    sys.stdout.flush()
+                    continue
+                print(f"  ✓ 已就绪: {table_name} ({len(df):,} 行)")
+                sys.stdout.flush()
+                loader.submit(table_name, df)
+                submitted[table_name] = (entry['file'], fingerprint, len(df))
+                last_change = time.time()
+            
+            if status == 'failed':
+                print("  ✗ 生成器报告失败，停止监听")
+                break
+            if status == 'complete' and len(submitted) >= len(manifest.get('tables', {})):
+                break
+        
+        if time.time() - last_change > WATCH_IDLE_TIMEOUT:
+            print(f"  ✗ 就绪清单超过 {WATCH_IDLE_TIMEOUT} 秒无更新，停止监听")
+            break
+        time.sleep(WATCH_POLL_SECONDS)
+    
+    success = loader.finish() and status == 'complete'
+    
+    # 记录加载清单（与普通加载共享：下次源文件未变化时跳过）
+    if loader.loaded_tables and (mode != 'reload' or success):
+        engine = create_engine(
+            f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}?charset=utf8mb4",
+            pool_pre_ping=True
+        )
+        conn = engine.raw_connection()
+        try:
+            for table_name in loader.loaded_tables:
+                source_file, fingerprint, rows = submitted[table_name]
+                record_load_manifest(
+                    conn, table_name, source_file, fingerprint, rows, full_replace=(mode != 'incremental')
+                )
+        finally:
+            conn.close()
+            engine.dispose()
+    
+    return success
+
+
 def main():
     """主函数"""
     # 注册信号处理器
@@ -777,13 +1759,16 @@ def main():
     
     layer = config.get('layer', 'ods')
     mode = config.get('mode', 'full')
+    force = config.get('force', False)
+    watch = config.get('watch', False)
+    months = config.get('months')  # 分区级重载的月份，如 ['2024-03']
     
     print("="*60)
     print("数据库加载工具")
     print("="*60)
     print(f"数据库: {db_config['host']}:{db_config['port']}/{db_config['database']}")
     print(f"层级: {layer.upper()}")
-    print(f"模式: {'全量（删除重建）' if mode == 'full' else '增量（追加数据）'}")
+    print(f"模式: {MODE_LABELS.get(mode, mode)}{' (监听就绪清单)' if watch else ''}")
     print("="*60)
     
     try:
@@ -792,7 +1777,15 @@ def main():
             return
         
         # 加载数据
-        success = load_layer_to_db(layer, mode, db_config)
+        if months:
+            success = reload_month_partitions(layer, months, db_config)
+        elif watch:
+            success = watch_layer_to_db(layer, mode, db_config, config.get('runId'))
+        else:
+            success = load_layer_to_db(layer, mode, db_config, force)
+        
+        # 等待后台删除旧表完成后再退出
+        wait_for_background_drops()
         
         if success:
             print("\n✓ 数据加载完成！")
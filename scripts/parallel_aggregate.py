@@ -0,0 +1,111 @@
+"""
+按 date_key 切片并行聚合
+单条 INSERT ... SELECT ... GROUP BY 只占用 MySQL 的一个线程；把日期切成 N 片，
+每片在独立连接上写入同一张以 date_key 开头为主键的目标表，各片主键区间互不重叠
+全部完成后核对各片写入行数之和与目标表中这些日期的行数
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db_manager import DatabaseManager
+
+
+def split_slices(date_keys, count):
+    """把有序的 date_key 列表切成最多 count 片连续区间（每片行数大致相当时各片耗时接近）"""
+    date_keys = sorted(date_keys)
+    count = max(1, min(count, len(date_keys)))
+    size, extra = divmod(len(date_keys), count)
+    slices, start = [], 0
+    for index in range(count):
+        end = start + size + (1 if index < extra else 0)
+        slices.append(date_keys[start:end])
+        start = end
+    return [piece for piece in slices if piece]
+
+
+def _date_filter(date_keys):
+    values = ', '.join(str(int(date_key)) for date_key in date_keys)
+    return lambda column: f" AND {column} IN ({values})"
+
+
+def _run_slice(db_config, sql):
+    """在独立连接上执行一片，返回 (写入行数, 耗时)；失败返回 (None, 耗时)"""
+    start = time.time()
+    manager = DatabaseManager(db_config)
+    if not manager.connect():
+        return None, time.time() - start
+    cursor = manager.connection.cursor()
+    try:
+        # 读已提交：INSERT ... SELECT 不对源表加共享锁，各片之间互不阻塞
+        cursor.execute("SET SESSION transaction_isolation = 'READ-COMMITTED'")
+        cursor.execute(sql)
+        rows = cursor.rowcount
+        manager.connection.commit()
+        return rows, time.time() - start
+    except Exception as e:
+        print(f"    ✗ 切片失败: {e}")
+        sys.stdout.flush()
+        manager.connection.rollback()
+        return None, time.time() - start
+    finally:
+        cursor.close()
+        manager.connection.close()
+
+
+def run_sliced_insert(db_manager, table_name, build_sql, date_keys, parallelism):
+    """
+    按 date_key 切片并行执行 INSERT ... SELECT
+
+    Args:
+        db_manager: 主连接（用于核对行数，其配置用于创建切片连接）
+        table_name: 目标表（主键以 date_key 开头）
+        build_sql: date_filter(列) -> INSERT 语句
+        date_keys: 要写入的 date_key（目标表中这些日期应已清空）
+        parallelism: 并发连接数
+
+    Returns:
+        list: 未能写入的 date_key（失败切片的日期；行数核对不一致时为全部日期），全部成功时为空列表
+    """
+    if not date_keys:
+        print("  ✓ 无日期，跳过")
+        sys.stdout.flush()
+        return []
+    slices = split_slices(date_keys, parallelism)
+    print(f"  并行聚合: {len(date_keys)} 天 → {len(slices)} 片")
+    sys.stdout.flush()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(slices)))) as executor:
+        futures = [
+            executor.submit(_run_slice, db_manager.config, build_sql(_date_filter(piece)))
+            for piece in slices
+        ]
+        results = [future.result() for future in futures]
+
+    total = 0
+    failed = []
+    for piece, (rows, elapsed) in zip(slices, results):
+        mark = '✓' if rows is not None else '✗'
+        print(f"    {mark} {piece[0]} ~ {piece[-1]}: {rows or 0:,}行 ({elapsed:.1f}s)")
+        total += rows or 0
+        if rows is None:
+            failed += piece
+    sys.stdout.flush()
+    if failed:
+        return failed
+
+    # 核对：各片写入行数之和应等于目标表中这些日期的行数（有重叠或漏写的切片会不一致）
+    db_manager.connection.commit()  # 结束主连接上的旧事务，读取各片已提交的数据
+    cursor = db_manager.connection.cursor()
+    try:
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name} WHERE 1 = 1{_date_filter(date_keys)('date_key')}")
+        actual = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    if actual != total:
+        print(f"  ✗ 行数核对失败: 各片合计 {total:,} 行，目标表 {actual:,} 行")
+        sys.stdout.flush()
+        return sorted(date_keys)
+    print(f"  ✓ 行数核对一致: {total:,} 行")
+    sys.stdout.flush()
+    return []
@@ -0,0 +1,223 @@
+"""
+分区管理
+按月 RANGE 分区的建表子句、补充新月份分区、分区级截断/交换/清理
+日期列使用 TO_DAYS(列) 分区，date_key 整数列直接按 YYYYMMDD 分区，均支持分区裁剪
+"""
+from datetime import date
+
+
+# 首个分区收纳早于数据起始月的行（含 NULL），末个分区收纳尚未建分区的新月份
+PARTITION_MIN = 'p0'
+PARTITION_MAX = 'pmax'
+
+
+def month_start(value):
+    """取所在月的第一天（支持 date/datetime/Timestamp、'YYYY-MM' 和 'YYYY-MM-DD...' 字符串）"""
+    if isinstance(value, str):
+        return date(int(value[:4]), int(value[5:7]), 1)
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    """下个月的第一天"""
+    if month.month == 12:
+        return date(month.year + 1, 1, 1)
+    return date(month.year, month.month + 1, 1)
+
+
+def add_months(month, count):
+    """month 加上 count 个月（count 可为负）"""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_range(start, end):
+    """start 到 end（含）之间每个月的第一天"""
+    months = []
+    month = month_start(start)
+    last = month_start(end)
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def partition_name(month):
+    """月份分区名，如 p202401"""
+    return f"p{month.year:04d}{month.month:02d}"
+
+
+def _bound(month, int_key):
+    if int_key:
+        return str(month.year * 10000 + month.month * 100 + 1)
+    return f"TO_DAYS('{month.isoformat()}')"
+
+
+def _month_partition_defs(months, int_key):
+    return [
+        f"PARTITION {partition_name(month)} VALUES LESS THAN ({_bound(next_month(month), int_key)})"
+        for month in months
+    ]
+
+
+def monthly_partition_clause(column, months, int_key=False):
+    """
+    生成按月 RANGE 分区子句（追加在 CREATE TABLE ... ENGINE=... 之后或 ALTER TABLE 之后）
+
+    Args:
+        column: 分区列
+        months: 需要建分区的月份（month_range 的结果）
+        int_key: 分区列是否为 YYYYMMDD 整数（date_key）
+    """
+    expr = column if int_key else f"TO_DAYS(`{column}`)"
+    defs = [f"PARTITION {PARTITION_MIN} VALUES LESS THAN ({_bound(months[0], int_key)})"]
+    defs += _month_partition_defs(months, int_key)
+    defs.append(f"PARTITION {PARTITION_MAX} VALUES LESS THAN MAXVALUE")
+    return f"PARTITION BY RANGE ({expr}) (\n    " + ",\n    ".join(defs) + "\n)"
+
+
+def get_partitions(conn, table_name):
+    """按顺序返回表的分区名（未分区返回空列表）"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION",
+            (table_name,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _reorganize(conn, table_name, partition, defs):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"ALTER TABLE `{table_name}` REORGANIZE PARTITION {partition} INTO ({', '.join(defs)})")
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def ensure_month_partitions(conn, table_name, months, int_key=False):
+    """
+    为缺少分区的月份补建分区：晚于现有最后一个月的从 pmax 中拆出，
+    早于首个月份分区的从 p0 中拆出（p0 中这些月份的数据随之移入新分区，可以按月截断/交换）；
+    返回新增的分区数
+    """
+    existing = set(get_partitions(conn, table_name))
+    if PARTITION_MAX not in existing:
+        return 0
+    month_names = sorted(name for name in existing if name not in (PARTITION_MIN, PARTITION_MAX))
+    first = month_names[0] if month_names else None
+    last = month_names[-1] if month_names else None
+    added = 0
+
+    later = [month for month in months if last is None or partition_name(month) > last]
+    if later:
+        # 新分区须从现有最后一个月份分区之后连续覆盖，中间月份的数据不能落入后面的分区
+        start = next_month(month_start(f"{last[1:5]}-{last[5:7]}")) if last else min(later)
+        later = month_range(start, max(later))
+        defs = _month_partition_defs(later, int_key)
+        defs.append(f"PARTITION {PARTITION_MAX} VALUES LESS THAN MAXVALUE")
+        _reorganize(conn, table_name, PARTITION_MAX, defs)
+        added += len(later)
+
+    earlier = [month for month in months if first is not None and partition_name(month) < first]
+    if earlier and PARTITION_MIN in existing:
+        # 新分区须连续覆盖到首个月份分区之前，p0 收缩为早于最早新月份的部分
+        first_month = month_start(f"{first[1:5]}-{first[5:7]}")
+        earlier = month_range(min(earlier), add_months(first_month, -1))
+        defs = [f"PARTITION {PARTITION_MIN} VALUES LESS THAN ({_bound(earlier[0], int_key)})"]
+        defs += _month_partition_defs(earlier, int_key)
+        _reorganize(conn, table_name, PARTITION_MIN, defs)
+        added += len(earlier)
+    return added
+
+
+def truncate_month_partitions(conn, table_name, months):
+    """清空指定月份的分区（不存在的分区跳过）；返回被清空的分区名"""
+    existing = set(get_partitions(conn, table_name))
+    names = [partition_name(month) for month in months if partition_name(month) in existing]
+    if names:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"ALTER TABLE `{table_name}` TRUNCATE PARTITION {', '.join(names)}")
+            conn.commit()
+        finally:
+            cursor.close()
+    return names
+
+
+def _auto_increment(cursor, table_name):
+    """读取表当前的自增计数器（无自增列返回 None）"""
+    try:
+        # MySQL 8 默认缓存 information_schema 统计信息，需读取实时值
+        cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+    except Exception:
+        pass
+    cursor.execute(
+        "SELECT AUTO_INCREMENT FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table_name,)
+    )
+    row = cursor.fetchone()
+    return int(row[0]) if row and row[0] else None
+
+
+def create_exchange_table(conn, table_name, exchange_table):
+    """
+    创建用于分区交换的非分区表（结构与分区表一致）
+    同步自增计数器，交换回去后新行的自增键不会与其它分区冲突
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP TABLE IF EXISTS `{exchange_table}`")
+        cursor.execute(f"CREATE TABLE `{exchange_table}` LIKE `{table_name}`")
+        cursor.execute(f"ALTER TABLE `{exchange_table}` REMOVE PARTITIONING")
+        next_id = _auto_increment(cursor, table_name)
+        if next_id:
+            cursor.execute(f"ALTER TABLE `{exchange_table}` AUTO_INCREMENT = {next_id}")
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def exchange_month_partition(conn, table_name, month, exchange_table):
+    """
+    用交换表的数据原子替换某个月份分区（交换后旧数据留在交换表中）
+    交换前分区表照常可读，适合单月重建
+    """
+    cursor = conn.cursor()
+    try:
+        next_id = _auto_increment(cursor, exchange_table)
+        cursor.execute(
+            f"ALTER TABLE `{table_name}` EXCHANGE PARTITION {partition_name(month)} WITH TABLE `{exchange_table}`"
+        )
+        if next_id:
+            cursor.execute(f"ALTER TABLE `{table_name}` AUTO_INCREMENT = {next_id}")
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def drop_partitions_before(conn, table_name, month):
+    """删除早于指定月份的分区（数据保留策略）；返回被删除的分区名"""
+    cutoff = partition_name(month_start(month))
+    names = [
+        name for name in get_partitions(conn, table_name)
+        if name == PARTITION_MIN or (name != PARTITION_MAX and name < cutoff)
+    ]
+    # p0 不能删除（需要兜底早期数据），改为清空
+    month_names = [name for name in names if name != PARTITION_MIN]
+    cursor = conn.cursor()
+    try:
+        if PARTITION_MIN in names:
+            cursor.execute(f"ALTER TABLE `{table_name}` TRUNCATE PARTITION {PARTITION_MIN}")
+        if month_names:
+            cursor.execute(f"ALTER TABLE `{table_name}` DROP PARTITION {', '.join(month_names)}")
+        conn.commit()
+    finally:
+        cursor.close()
+    return month_names
@@ -1,6 +1,9 @@
 """
 ADS层转换 - 应用数据层
 面向业务的宽表和报表
+销售统计读取 DWS 层的商品日汇总 dws_trade_product_1d 和成交订单明细宽表 dws_paid_order_line（须先执行 DWS 转换）
+流量宽表所用的 SPU-日流量/销量汇总保存为持久中间表 ads_mid_*，按日期增量刷新，可供其他报表复用
+config.tables 指定时只重算这些表（报表或中间表），其余表保持不变
 """
 import sys
 import json
@@ -9,6 +12,7 @@ import atexit
 
 # 导入数据库管理器
 from db_manager import get_db_manager, cleanup_global_db_manager
+from etl_control import ensure_control_tables, get_watermark, set_watermark
 
 
 def signal_handler(signum, frame):
@@ -18,389 +22,570 @@ def signal_handler(signum, frame):
     sys.exit(1)
 
 
-def transform_ads(mode='full', db_config=None):
-    """转换ADS层数据 - 业务宽表"""
+# ========== 表结构 ==========
+# 主键即报表粒度，数据按主键顺序 INSERT ... SELECT 写入；中文列名沿用原报表
+
+SQL_CREATE_TABLES = {
+    'ads_daily_report': """
+    CREATE TABLE IF NOT EXISTS ads_daily_report (
+        date_key INT NOT NULL,
+        store_key BIGINT NOT NULL,
+        product_key BIGINT NOT NULL,
+        `日期` DATE,
+        `平台` VARCHAR(20) NOT NULL,
+        `店铺` VARCHAR(100),
+        `SPU编码` VARCHAR(50),
+        `SKU编码` VARCHAR(100),
+        `商品名称` VARCHAR(200),
+        `规格` VARCHAR(100),
+        `一级类目` VARCHAR(50),
+        `二级类目` VARCHAR(50),
+        `订单数` INT,
+        `客户数` INT,
+        `销量` INT,
+        `销售额` DECIMAL(16,2),
+        `商品成本` DECIMAL(16,2),
+        `运费` DECIMAL(16,2),
+        `毛利` DECIMAL(16,2),
+        `毛利率` DECIMAL(10,2),
+        `推广费` DECIMAL(16,2),
+        `售后费` DECIMAL(16,2),
+        `平台费` DECIMAL(16,2),
+        `管理费` DECIMAL(16,2),
+        `净利润` DECIMAL(16,2),
+        `净利率` DECIMAL(10,2),
+        `客单价` DECIMAL(12,2),
+        PRIMARY KEY (date_key, store_key, product_key),
+        INDEX idx_date (`日期`),
+        INDEX idx_platform (`平台`),
+        INDEX idx_store (`店铺`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'ads_platform_summary': """
+    CREATE TABLE IF NOT EXISTS ads_platform_summary (
+        `平台` VARCHAR(20) NOT NULL PRIMARY KEY,
+        `店铺数` INT,
+        `总订单数` BIGINT,
+        `总客户数` BIGINT,
+        `总销售额` DECIMAL(18,2),
+        `总成本` DECIMAL(18,2),
+        `总毛利` DECIMAL(18,2),
+        `总推广费` DECIMAL(18,2),
+        `总净利润` DECIMAL(18,2),
+        `净利率` DECIMAL(10,2),
+        `客单价` DECIMAL(12,2)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'ads_store_ranking': """
+    CREATE TABLE IF NOT EXISTS ads_store_ranking (
+        `平台` VARCHAR(20) NOT NULL,
+        `店铺` VARCHAR(100) NOT NULL,
+        `总订单数` BIGINT,
+        `总销售额` DECIMAL(18,2),
+        `总净利润` DECIMAL(18,2),
+        `净利率` DECIMAL(10,2),
+        `销售排名` INT,
+        `利润排名` INT,
+        PRIMARY KEY (`平台`, `店铺`),
+        INDEX idx_sales_rank (`销售排名`),
+        INDEX idx_profit_rank (`利润排名`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'ads_traffic_report': """
+    CREATE TABLE IF NOT EXISTS ads_traffic_report (
+        `日期` DATE NOT NULL,
+        `平台` VARCHAR(20) NOT NULL,
+        `店铺` VARCHAR(100) NOT NULL,
+        `SPU编码` VARCHAR(50) NOT NULL,
+        `一级类目` VARCHAR(50),
+        `二级类目` VARCHAR(50),
+        `流量类型` VARCHAR(10) NOT NULL,
+        `曝光量` BIGINT,
+        `点击量` BIGINT,
+        `点击率` DECIMAL(10,2),
+        `收藏量` BIGINT,
+        `加购量` BIGINT,
+        `销量` BIGINT,
+        `销售额` DECIMAL(16,2),
+        `点击转化率` DECIMAL(10,2),
+        `推广费用` DECIMAL(16,2),
+        `平均点击成本` DECIMAL(10,2),
+        `ROI` DECIMAL(12,2),
+        PRIMARY KEY (`日期`, `平台`, `店铺`, `SPU编码`, `流量类型`),
+        INDEX idx_platform (`平台`),
+        INDEX idx_spu (`SPU编码`),
+        INDEX idx_traffic_type (`流量类型`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'ads_mid_paid_traffic': """
+    CREATE TABLE IF NOT EXISTS ads_mid_paid_traffic (
+        date_key INT NOT NULL,
+        platform VARCHAR(20) NOT NULL,
+        store_key BIGINT NOT NULL,
+        product_id VARCHAR(50) NOT NULL,
+        channel VARCHAR(50) NOT NULL,
+        date_value DATE,
+        store_name VARCHAR(100),
+        category_l1 VARCHAR(50),
+        category_l2 VARCHAR(50),
+        impressions BIGINT,
+        clicks BIGINT,
+        cost DECIMAL(16,2),
+        PRIMARY KEY (date_key, platform, store_key, product_id, channel)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'ads_mid_natural_traffic': """
+    CREATE TABLE IF NOT EXISTS ads_mid_natural_traffic (
+        date_key INT NOT NULL,
+        platform VARCHAR(20) NOT NULL,
+        store_key BIGINT NOT NULL,
+        product_id VARCHAR(50) NOT NULL,
+        channel VARCHAR(50) NOT NULL,
+        date_value DATE,
+        store_name VARCHAR(100),
+        category_l1 VARCHAR(50),
+        category_l2 VARCHAR(50),
+        impressions BIGINT,
+        clicks BIGINT,
+        favorites BIGINT,
+        add_to_cart BIGINT,
+        PRIMARY KEY (date_key, platform, store_key, product_id, channel)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'ads_mid_spu_sales': """
+    CREATE TABLE IF NOT EXISTS ads_mid_spu_sales (
+        date_key INT NOT NULL,
+        platform VARCHAR(20) NOT NULL,
+        store_key BIGINT NOT NULL,
+        product_id VARCHAR(50) NOT NULL,
+        traffic_type VARCHAR(10) NOT NULL,
+        quantity BIGINT,
+        amount DECIMAL(16,2),
+        PRIMARY KEY (date_key, platform, store_key, product_id, traffic_type)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+}
+
+
+# ========== 中间表（date_filter(列) 返回该列的 date_key 过滤条件，以 AND 开头） ==========
+
+def _sql_mid_paid_traffic(date_filter):
+    """付费流量：推广事实按 日期 × 平台 × 店铺 × SPU × 渠道 汇总"""
+    return f"""
+    INSERT INTO ads_mid_paid_traffic
+        (date_key, platform, store_key, product_id, channel, date_value, store_name,
+         category_l1, category_l2, impressions, clicks, cost)
+    SELECT
+        fp.date_key, COALESCE(fp.platform, ''), fp.store_key, p.product_id, COALESCE(fp.channel, ''),
+        MAX(d.date_value), MAX(s.store_name), MAX(p.category_l1), MAX(p.category_l2),
+        SUM(fp.impressions),
+        SUM(fp.clicks),
+        ROUND(SUM(fp.cost), 2)
+    FROM dwd_fact_promotion fp
+    INNER JOIN dim_date d ON fp.date_key = d.date_key
+    INNER JOIN dim_store s ON fp.store_key = s.store_key
+    INNER JOIN dim_product p ON fp.product_key = p.product_key
+    WHERE p.product_id IS NOT NULL{date_filter('fp.date_key')}
+    GROUP BY fp.date_key, COALESCE(fp.platform, ''), fp.store_key, p.product_id, COALESCE(fp.channel, '')
+    ORDER BY fp.date_key, COALESCE(fp.platform, ''), fp.store_key, p.product_id, COALESCE(fp.channel, '')
+    """
+
+
+def _sql_mid_natural_traffic(date_filter):
+    """自然流量：商品流量按 日期 × 平台 × 店铺 × SPU × 渠道 汇总"""
+    return f"""
+    INSERT INTO ads_mid_natural_traffic
+        (date_key, platform, store_key, product_id, channel, date_value, store_name,
+         category_l1, category_l2, impressions, clicks, favorites, add_to_cart)
+    SELECT
+        pt.date_key, COALESCE(pt.platform, ''), s.store_key, p.product_id, COALESCE(pt.channel, ''),
+        MAX(pt.date), MAX(s.store_name), MAX(p.category_l1), MAX(p.category_l2),
+        SUM(pt.impressions),
+        SUM(pt.clicks),
+        SUM(pt.favorites),
+        SUM(pt.add_to_cart)
+    FROM ods_product_traffic pt
+    INNER JOIN dim_store s ON pt.store_no = s.store_key
+    INNER JOIN dim_product p ON pt.sku_no = p.product_key
+    WHERE p.product_id IS NOT NULL{date_filter('pt.date_key')}
+    GROUP BY pt.date_key, COALESCE(pt.platform, ''), s.store_key, p.product_id, COALESCE(pt.channel, '')
+    ORDER BY pt.date_key, COALESCE(pt.platform, ''), s.store_key, p.product_id, COALESCE(pt.channel, '')
+    """
+
+
+def _sql_mid_spu_sales(date_filter):
+    """SPU 销量：成交明细按 日期 × 平台 × 店铺 × SPU × 流量类型（付费推广 / 其他来源）汇总"""
+    return f"""
+    INSERT INTO ads_mid_spu_sales
+        (date_key, platform, store_key, product_id, traffic_type, quantity, amount)
+    SELECT
+        l.date_key, COALESCE(l.platform, ''), l.store_key, l.product_id,
+        CASE WHEN l.traffic_source = '付费推广' THEN '付费' ELSE '自然' END,
+        SUM(l.quantity),
+        ROUND(SUM(l.amount), 2)
+    FROM dws_paid_order_line l
+    WHERE l.traffic_source IS NOT NULL AND l.store_key IS NOT NULL AND l.product_id IS NOT NULL{date_filter('l.date_key')}
+    GROUP BY l.date_key, COALESCE(l.platform, ''), l.store_key, l.product_id,
+        CASE WHEN l.traffic_source = '付费推广' THEN '付费' ELSE '自然' END
+    ORDER BY l.date_key, COALESCE(l.platform, ''), l.store_key, l.product_id,
+        CASE WHEN l.traffic_source = '付费推广' THEN '付费' ELSE '自然' END
+    """
+
+
+# 中间表：表名 -> (标题, 构建函数, 变化检测)
+# 变化检测 ('etl_time', 表) 取上次刷新以来 etl_time 有更新的日期，水位线为本次运行开始时间；
+# ('date_key', 表) 用于没有 etl_time 的 ODS 表，重算不早于上次已处理最大日期的数据（最后一天可能不完整），
+# 水位线为来源的最大日期
+MID_TABLES = {
+    'ads_mid_paid_traffic': ('付费流量中间表', _sql_mid_paid_traffic, ('etl_time', ['dwd_fact_promotion'])),
+    'ads_mid_natural_traffic': ('自然流量中间表', _sql_mid_natural_traffic, ('date_key', ['ods_product_traffic'])),
+    'ads_mid_spu_sales': ('SPU销量中间表', _sql_mid_spu_sales, ('etl_time', ['dws_paid_order_line'])),
+}
+
+
+def _fetch_column(db_manager, sql):
+    cursor = db_manager.connection.cursor()
+    try:
+        cursor.execute(sql)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _in_filter(date_keys):
+    values = ', '.join(str(int(date_key)) for date_key in date_keys)
+    return lambda column: f" AND {column} IN ({values})"
+
+
+def _no_filter(column):
+    return ''
+
+
+def _changed_date_keys(db_manager, changes, since):
+    """上次刷新以来来源表中有变化的 date_key"""
+    column, source_tables = changes
+    if column == 'etl_time':
+        condition = f"etl_time >= {db_manager.connection.escape(since)}"
+    else:
+        condition = f"date_key >= {int(since)}"
+    date_keys = set()
+    for source_table in source_tables:
+        date_keys.update(_fetch_column(
+            db_manager, f"SELECT DISTINCT date_key FROM {source_table} WHERE {condition} AND date_key IS NOT NULL"
+        ))
+    return sorted(date_keys)
+
+
+def refresh_mid_table(db_manager, table_name, mode, run_started):
+    """
+    刷新中间表
+    全量或尚无水位线时写入全部日期；增量时只删除并重算来源有变化的日期，成功后推进该表的水位线
+    """
+    conn = db_manager.connection
+    _, build_sql, changes = MID_TABLES[table_name]
+    column, source_tables = changes
+    since = get_watermark(conn, table_name) if mode == 'incremental' else None
+
+    if mode == 'full':
+        db_manager.execute_sql(f"DROP TABLE IF EXISTS {table_name}", "删除旧表")
+    db_manager.execute_sql(SQL_CREATE_TABLES[table_name], "创建表结构")
+
+    # 水位线在读取来源之前确定，读取期间写入的数据留给下次刷新
+    if column == 'etl_time':
+        new_watermark = run_started
+    else:
+        latest = [_fetch_column(db_manager, f"SELECT MAX(date_key) FROM {table}")[0] for table in source_tables]
+        new_watermark = max((value for value in latest if value is not None), default=None)
+
+    if since is None:
+        db_manager.execute_sql(f"TRUNCATE TABLE {table_name}", "清空旧数据")
+        if not db_manager.execute_sql(build_sql(_no_filter), "汇总全部日期"):
+            return False
+    else:
+        date_keys = _changed_date_keys(db_manager, changes, since)
+        if not date_keys:
+            print("  ✓ 无变化的日期，跳过")
+            sys.stdout.flush()
+        else:
+            date_filter = _in_filter(date_keys)
+            print(f"  变化日期: {len(date_keys)} 天 ({date_keys[0]} ~ {date_keys[-1]})")
+            sys.stdout.flush()
+            if not db_manager.execute_sql(
+                f"DELETE FROM {table_name} WHERE 1 = 1{date_filter('date_key')}", "删除变化日期的旧数据",
+                skip_commit=True
+            ):
+                return False
+            if not db_manager.execute_sql(build_sql(date_filter), "重算变化日期"):
+                return False
+
+    if new_watermark is not None:
+        set_watermark(conn, table_name, column, new_watermark)
+    return True
+
+
+# ========== 报表 ==========
+
+# SKU-日销售（DWS 商品日汇总）与 SKU-日推广费各自先聚合，UNION ALL 后按 (date_key, store_key, product_key)
+# 一次分组即完成全外合并：只有推广没有销售的商品自然保留，不再需要逐行 NOT EXISTS 回查
+# 运费和各项费用是 DWD 明细上按费用配置算好的列，这里只做汇总；毛利/净利润在派生表中算出一次，外层复用
+SQL_DAILY_REPORT = """
+    INSERT INTO ads_daily_report (
+        date_key, store_key, product_key, `日期`, `平台`, `店铺`, `SPU编码`, `SKU编码`, `商品名称`, `规格`,
+        `一级类目`, `二级类目`, `订单数`, `客户数`, `销量`, `销售额`, `商品成本`, `运费`, `毛利`, `毛利率`,
+        `推广费`, `售后费`, `平台费`, `管理费`, `净利润`, `净利率`, `客单价`
+    )
+    SELECT
+        f.date_key,
+        f.store_key,
+        f.product_key,
+        d.date_value,
+        f.platform,
+        s.store_name,
+        p.product_id,
+        p.sku_id,
+        p.product_name,
+        p.spec,
+        p.category_l1,
+        p.category_l2,
+        f.order_count,
+        f.buyer_count,
+        f.quantity,
+        ROUND(f.amount, 2),
+        ROUND(f.cost_amount, 2),
+        ROUND(f.shipping_fee, 2),
+        ROUND(f.gross_profit, 2),
+        ROUND(CASE WHEN f.amount > 0 THEN f.gross_profit / f.amount * 100 ELSE 0 END, 2),
+        ROUND(f.promo_cost, 2),
+        ROUND(f.after_sale_fee, 2),
+        ROUND(f.platform_fee, 2),
+        ROUND(f.mgmt_fee, 2),
+        ROUND(f.net_profit, 2),
+        ROUND(CASE WHEN f.amount > 0 THEN f.net_profit / f.amount * 100 ELSE 0 END, 2),
+        ROUND(CASE WHEN f.order_count > 0 THEN f.amount / f.order_count ELSE 0 END, 2)
+    FROM (
+        SELECT
+            m.*,
+            m.amount - m.cost_amount - m.shipping_fee AS gross_profit,
+            m.amount - m.cost_amount - m.shipping_fee - m.promo_cost
+                - m.after_sale_fee - m.platform_fee - m.mgmt_fee AS net_profit
+        FROM (
+            SELECT
+                u.date_key, u.store_key, u.product_key,
+                COALESCE(MAX(u.platform), '') AS platform,
+                SUM(u.order_count) AS order_count,
+                SUM(u.buyer_count) AS buyer_count,
+                SUM(u.quantity) AS quantity,
+                SUM(u.amount) AS amount,
+                SUM(u.cost_amount) AS cost_amount,
+                SUM(u.shipping_fee) AS shipping_fee,
+                SUM(u.after_sale_fee) AS after_sale_fee,
+                SUM(u.platform_fee) AS platform_fee,
+                SUM(u.mgmt_fee) AS mgmt_fee,
+                SUM(u.promo_cost) AS promo_cost
+            FROM (
+                -- SKU-日销售
+                SELECT
+                    t.date_key, COALESCE(t.store_key, 0) AS store_key, t.product_key, t.platform,
+                    t.order_count, t.buyer_count, t.sales_quantity AS quantity, t.sales_amount AS amount,
+                    t.cost_amount, t.shipping_fee, t.after_sale_fee, t.platform_fee, t.mgmt_fee, 0 AS promo_cost
+                FROM dws_trade_product_1d t
+
+                UNION ALL
+
+                -- SKU-日推广费
+                SELECT
+                    fp.date_key, COALESCE(fp.store_key, 0), COALESCE(fp.product_key, 0), MAX(fp.platform),
+                    0, 0, 0, 0, 0, 0, 0, 0, 0, SUM(fp.cost)
+                FROM dwd_fact_promotion fp
+                GROUP BY fp.date_key, COALESCE(fp.store_key, 0), COALESCE(fp.product_key, 0)
+            ) u
+            GROUP BY u.date_key, u.store_key, u.product_key
+        ) m
+    ) f
+    LEFT JOIN dim_date d ON f.date_key = d.date_key
+    LEFT JOIN dim_store s ON f.store_key = s.store_key
+    LEFT JOIN dim_product p ON f.product_key = p.product_key
+    ORDER BY f.date_key, f.store_key, f.product_key
+    """
+
+SQL_PLATFORM_SUMMARY = """
+    INSERT INTO ads_platform_summary (
+        `平台`, `店铺数`, `总订单数`, `总客户数`, `总销售额`, `总成本`, `总毛利`, `总推广费`, `总净利润`, `净利率`, `客单价`
+    )
+    SELECT 
+        `平台`,
+        COUNT(DISTINCT `店铺`) AS `店铺数`,
+        SUM(`订单数`) AS `总订单数`,
+        SUM(`客户数`) AS `总客户数`,
+        ROUND(SUM(`销售额`), 2) AS `总销售额`,
+        ROUND(SUM(`商品成本`), 2) AS `总成本`,
+        ROUND(SUM(`毛利`), 2) AS `总毛利`,
+        ROUND(SUM(`推广费`), 2) AS `总推广费`,
+        ROUND(SUM(`净利润`), 2) AS `总净利润`,
+        ROUND(CASE WHEN SUM(`销售额`) > 0 THEN SUM(`净利润`) / SUM(`销售额`) * 100 ELSE 0 END, 2) AS `净利率`,
+        ROUND(SUM(`销售额`) / SUM(`订单数`), 2) AS `客单价`
+    FROM ads_daily_report
+    GROUP BY `平台`
+    ORDER BY `平台`
+    """
+
+SQL_STORE_RANKING = """
+    INSERT INTO ads_store_ranking (`平台`, `店铺`, `总订单数`, `总销售额`, `总净利润`, `净利率`, `销售排名`, `利润排名`)
+    SELECT 
+        `平台`, COALESCE(`店铺`, '') AS `店铺`,
+        SUM(`订单数`) AS `总订单数`,
+        ROUND(SUM(`销售额`), 2) AS `总销售额`,
+        ROUND(SUM(`净利润`), 2) AS `总净利润`,
+        ROUND(CASE WHEN SUM(`销售额`) > 0 THEN SUM(`净利润`) / SUM(`销售额`) * 100 ELSE 0 END, 2) AS `净利率`,
+        ROW_NUMBER() OVER (ORDER BY SUM(`销售额`) DESC) AS `销售排名`,
+        ROW_NUMBER() OVER (ORDER BY SUM(`净利润`) DESC) AS `利润排名`
+    FROM ads_daily_report
+    GROUP BY `平台`, COALESCE(`店铺`, '')
+    ORDER BY `平台`, `店铺`
+    """
+
+
+# 流量宽表的流量指标（中间表中没有的指标记为 0）
+TRAFFIC_MEASURES = ['impressions', 'clicks', 'favorites', 'add_to_cart', 'cost']
+
+
+def _sql_traffic_part(source, traffic_type, measures):
+    """
+    流量宽表的一种流量类型：中间表先在键上按 SPU 汇总（去掉渠道），按主键关联同类型的 SPU 销量，
+    再按报表粒度（日期 × 平台 × 店铺名称 × SPU）输出
+    """
+    inner = ', '.join(f"SUM({measure}) AS {measure}" for measure in measures)
+    outer = ', '.join(
+        f"SUM(t.{measure}) AS {measure}" if measure in measures else f"0 AS {measure}"
+        for measure in TRAFFIC_MEASURES
+    )
+    return f"""
+        SELECT
+            MAX(t.date_value) AS date_value,
+            t.platform,
+            COALESCE(t.store_name, '') AS store_name,
+            t.product_id,
+            MAX(t.category_l1) AS category_l1,
+            MAX(t.category_l2) AS category_l2,
+            '{traffic_type}' AS traffic_type,
+            {outer},
+            SUM(COALESCE(sa.quantity, 0)) AS quantity,
+            SUM(COALESCE(sa.amount, 0)) AS amount
+        FROM (
+            SELECT
+                date_key, platform, store_key, product_id,
+                MAX(date_value) AS date_value, MAX(store_name) AS store_name,
+                MAX(category_l1) AS category_l1, MAX(category_l2) AS category_l2,
+                {inner}
+            FROM {source}
+            GROUP BY date_key, platform, store_key, product_id
+        ) t
+        LEFT JOIN ads_mid_spu_sales sa
+            ON sa.date_key = t.date_key AND sa.platform = t.platform AND sa.store_key = t.store_key
+            AND sa.product_id = t.product_id AND sa.traffic_type = '{traffic_type}'
+        GROUP BY t.date_key, t.platform, COALESCE(t.store_name, ''), t.product_id"""
+
+
+SQL_TRAFFIC_REPORT = f"""
+    INSERT INTO ads_traffic_report (
+        `日期`, `平台`, `店铺`, `SPU编码`, `一级类目`, `二级类目`, `流量类型`, `曝光量`, `点击量`, `点击率`,
+        `收藏量`, `加购量`, `销量`, `销售额`, `点击转化率`, `推广费用`, `平均点击成本`, `ROI`
+    )
+    SELECT
+        r.date_value,
+        r.platform,
+        r.store_name,
+        r.product_id,
+        r.category_l1,
+        r.category_l2,
+        r.traffic_type,
+        r.impressions,
+        r.clicks,
+        ROUND(CASE WHEN r.impressions > 0 THEN r.clicks / r.impressions * 100 ELSE 0 END, 2),
+        r.favorites,
+        r.add_to_cart,
+        r.quantity,
+        ROUND(r.amount, 2),
+        ROUND(CASE WHEN r.clicks > 0 THEN r.quantity / r.clicks * 100 ELSE 0 END, 2),
+        ROUND(r.cost, 2),
+        ROUND(CASE WHEN r.clicks > 0 THEN r.cost / r.clicks ELSE 0 END, 2),
+        ROUND(CASE WHEN r.cost > 0 THEN r.amount / r.cost ELSE 0 END, 2)
+    FROM ({_sql_traffic_part('ads_mid_paid_traffic', '付费', ['impressions', 'clicks', 'cost'])}
+        UNION ALL{_sql_traffic_part('ads_mid_natural_traffic', '自然', ['impressions', 'clicks', 'favorites', 'add_to_cart'])}
+    ) r
+    ORDER BY 1, 2, 3, 4, 7
+"""
+
+
+# 报表：表名 -> (标题, SQL, 依赖的中间表)；平台汇总和店铺排行读取日报宽表的现有数据
+REPORTS = {
+    'ads_daily_report': ('日报宽表（包含所有推广费）', SQL_DAILY_REPORT, []),
+    'ads_platform_summary': ('平台汇总表', SQL_PLATFORM_SUMMARY, []),
+    'ads_store_ranking': ('店铺排行榜', SQL_STORE_RANKING, []),
+    'ads_traffic_report': (
+        '流量宽表（SPU维度 + 所有渠道）', SQL_TRAFFIC_REPORT,
+        ['ads_mid_paid_traffic', 'ads_mid_natural_traffic', 'ads_mid_spu_sales']
+    ),
+}
+
+
+def _prepare_table(db_manager, table_name, mode):
+    """建表并清空：全量模式先删除旧表（结构可能变化），报表每次按当前 DWS 数据和中间表整表重写"""
+    if mode == 'full':
+        db_manager.execute_sql(f"DROP TABLE IF EXISTS {table_name}", "删除旧表")
+    db_manager.execute_sql(SQL_CREATE_TABLES[table_name], "创建表结构")
+    db_manager.execute_sql(f"TRUNCATE TABLE {table_name}", "清空旧数据")
+
+
+def transform_ads(mode='full', db_config=None, tables=None):
+    """
+    转换ADS层数据 - 业务宽表
+    mode: 'full' 删除重建；'incremental' 中间表只重算有变化的日期，报表整表重写
+    tables: 只重算这些表（报表或中间表）；报表依赖的中间表随之按 mode 刷新，其余表保持不变
+    """
     print("="*60)
     print("ADS层数据转换 - 业务宽表")
     print("="*60)
     
+    tables = list(tables or [])
+    unknown = [name for name in tables if name not in REPORTS and name not in MID_TABLES]
+    if unknown:
+        print(f"✗ 未知的ADS表: {', '.join(unknown)}")
+        return False
+    reports = [name for name in REPORTS if not tables or name in tables]
+    mids = [
+        name for name in MID_TABLES
+        if name in tables or any(name in REPORTS[report][2] for report in reports)
+    ]
+    if tables:
+        print(f"只重算: {', '.join(mids + reports)}")
+    
     # 使用数据库管理器
     db_manager = get_db_manager(db_config)
     if not db_manager:
         return False
     
     try:
-        # ========== 1. 日报宽表 ==========
-        print("\n【第一步】日报宽表")
-        
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS ads_daily_report", "删除旧表")
-        
-        # 新逻辑：先汇总推广数据，再关联销售数据，确保所有推广费都体现
-        sql_daily_report = """
-        CREATE TABLE IF NOT EXISTS ads_daily_report AS
-        SELECT 
-            base.`日期`,
-            base.`平台`,
-            base.`店铺`,
-            base.`SPU编码`,
-            base.`SKU编码`,
-            base.`商品名称`,
-            base.`规格`,
-            base.`一级类目`,
-            base.`二级类目`,
-            COALESCE(base.`订单数`, 0) AS `订单数`,
-            COALESCE(base.`客户数`, 0) AS `客户数`,
-            COALESCE(base.`销量`, 0) AS `销量`,
-            COALESCE(base.`销售额`, 0) AS `销售额`,
-            COALESCE(base.`商品成本`, 0) AS `商品成本`,
-            COALESCE(base.`运费`, 0) AS `运费`,
-            COALESCE(base.`毛利`, 0) AS `毛利`,
-            COALESCE(base.`毛利率`, 0) AS `毛利率`,
-            COALESCE(base.`推广费`, 0) AS `推广费`,
-            COALESCE(base.`售后费`, 0) AS `售后费`,
-            COALESCE(base.`平台费`, 0) AS `平台费`,
-            COALESCE(base.`管理费`, 0) AS `管理费`,
-            COALESCE(base.`净利润`, 0) AS `净利润`,
-            COALESCE(base.`净利率`, 0) AS `净利率`,
-            COALESCE(base.`客单价`, 0) AS `客单价`
-        FROM (
-            -- 销售数据（有订单的商品）
-            SELECT 
-                d.date_value AS `日期`,
-                f.platform AS `平台`,
-                s.store_name AS `店铺`,
-                p.product_id AS `SPU编码`,
-                p.sku_id AS `SKU编码`,
-                p.product_name AS `商品名称`,
-                p.spec AS `规格`,
-                p.category_l1 AS `一级类目`,
-                p.category_l2 AS `二级类目`,
-                COUNT(DISTINCT f.order_id) AS `订单数`,
-                COUNT(DISTINCT f.user_key) AS `客户数`,
-                SUM(fd.quantity) AS `销量`,
-                ROUND(SUM(fd.amount), 2) AS `销售额`,
-                ROUND(SUM(fd.cost_amount), 2) AS `商品成本`,
-                ROUND(SUM(fd.quantity * CASE WHEN p.category_l1 LIKE '整车%' THEN 30 ELSE 3 END), 2) AS `运费`,
-                ROUND(SUM(fd.amount) - SUM(fd.cost_amount) - SUM(fd.quantity * CASE WHEN p.category_l1 LIKE '整车%' THEN 30 ELSE 3 END), 2) AS `毛利`,
-                ROUND(CASE WHEN SUM(fd.amount) > 0 
-                    THEN (SUM(fd.amount) - SUM(fd.cost_amount) - SUM(fd.quantity * CASE WHEN p.category_l1 LIKE '整车%' THEN 30 ELSE 3 END)) / SUM(fd.amount) * 100 
-                    ELSE 0 END, 2) AS `毛利率`,
-                COALESCE(pm.promo_cost, 0) AS `推广费`,
-                ROUND(SUM(fd.amount) * 0.02, 2) AS `售后费`,
-                ROUND(SUM(fd.amount) * 0.05, 2) AS `平台费`,
-                ROUND(SUM(fd.amount) * 0.10, 2) AS `管理费`,
-                ROUND((SUM(fd.amount) - SUM(fd.cost_amount) - SUM(fd.quantity * CASE WHEN p.category_l1 LIKE '整车%' THEN 30 ELSE 3 END)) 
-                    - COALESCE(pm.promo_cost, 0) 
-                    - SUM(fd.amount) * 0.02 - SUM(fd.amount) * 0.05 - SUM(fd.amount) * 0.10, 2) AS `净利润`,
-                ROUND(CASE WHEN SUM(fd.amount) > 0 
-                    THEN ((SUM(fd.amount) - SUM(fd.cost_amount) - SUM(fd.quantity * CASE WHEN p.category_l1 LIKE '整车%' THEN 30 ELSE 3 END)) 
-                        - COALESCE(pm.promo_cost, 0) 
-                        - SUM(fd.amount) * 0.02 - SUM(fd.amount) * 0.05 - SUM(fd.amount) * 0.10) / SUM(fd.amount) * 100 
-                    ELSE 0 END, 2) AS `净利率`,
-                ROUND(CASE WHEN COUNT(DISTINCT f.order_id) > 0 
-                    THEN SUM(fd.amount) / COUNT(DISTINCT f.order_id) ELSE 0 END, 2) AS `客单价`
-            FROM dwd_fact_order f
-            INNER JOIN dwd_fact_order_detail fd ON f.order_id = fd.order_id
-            LEFT JOIN dim_date d ON f.date_key = d.date_key
-            LEFT JOIN dim_store s ON f.store_key = s.store_key
-            LEFT JOIN dim_product p ON fd.product_key = p.product_key
-            LEFT JOIN (
-                SELECT date_key, store_key, product_key, SUM(cost) AS promo_cost
-                FROM dwd_fact_promotion 
-                GROUP BY date_key, store_key, product_key
-            ) pm ON f.date_key = pm.date_key AND f.store_key = pm.store_key AND fd.product_key = pm.product_key
-            WHERE f.order_status IN ('已完成', '已发货')
-            GROUP BY d.date_value, f.platform, f.store_key, s.store_name, fd.product_key, p.product_id, p.sku_id, p.product_name, p.spec, p.category_l1, p.category_l2, pm.promo_cost
-            
-            UNION ALL
-            
-            -- 推广数据（只有推广没有销售的商品）
-            SELECT 
-                d.date_value AS `日期`,
-                fp.platform AS `平台`,
-                s.store_name AS `店铺`,
-                p.product_id AS `SPU编码`,
-                p.sku_id AS `SKU编码`,
-                p.product_name AS `商品名称`,
-                p.spec AS `规格`,
-                p.category_l1 AS `一级类目`,
-                p.category_l2 AS `二级类目`,
-                0 AS `订单数`,
-                0 AS `客户数`,
-                0 AS `销量`,
-                0 AS `销售额`,
-                0 AS `商品成本`,
-                0 AS `运费`,
-                0 AS `毛利`,
-                0 AS `毛利率`,
-                SUM(fp.cost) AS `推广费`,
-                0 AS `售后费`,
-                0 AS `平台费`,
-                0 AS `管理费`,
-                -SUM(fp.cost) AS `净利润`,
-                0 AS `净利率`,
-                0 AS `客单价`
-            FROM dwd_fact_promotion fp
-            LEFT JOIN dim_date d ON fp.date_key = d.date_key
-            LEFT JOIN dim_store s ON fp.store_key = s.store_key
-            LEFT JOIN dim_product p ON fp.product_key = p.product_key
-            -- 排除已经在销售数据中的记录
-            WHERE NOT EXISTS (
-                SELECT 1 
-                FROM dwd_fact_order f
-                INNER JOIN dwd_fact_order_detail fd ON f.order_id = fd.order_id
-                WHERE f.order_status IN ('已完成', '已发货')
-                  AND f.date_key = fp.date_key
-                  AND f.store_key = fp.store_key
-                  AND fd.product_key = fp.product_key
-            )
-            GROUP BY d.date_value, fp.platform, fp.store_key, s.store_name, fp.product_key, p.product_id, p.sku_id, p.product_name, p.spec, p.category_l1, p.category_l2
-        ) base
-        ORDER BY base.`日期` DESC, base.`平台`, base.`店铺`
-        """
-        if not db_manager.execute_sql(sql_daily_report, "创建日报宽表（包含所有推广费）"):
-            return False
-        
-        db_manager.execute_sql("ALTER TABLE ads_daily_report ADD INDEX idx_date (`日期`)", "创建日期索引")
-        db_manager.execute_sql("ALTER TABLE ads_daily_report ADD INDEX idx_platform (`平台`)", "创建平台索引")
-        
-        # ========== 2. 平台汇总表 ==========
-        print("\n【第二步】平台汇总表")
-        
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS ads_platform_summary", "删除旧表")
-        
-        sql_platform = """
-        CREATE TABLE IF NOT EXISTS ads_platform_summary AS
-        SELECT 
-            `平台`,
-            COUNT(DISTINCT `店铺`) AS `店铺数`,
-            SUM(`订单数`) AS `总订单数`,
-            SUM(`客户数`) AS `总客户数`,
-            ROUND(SUM(`销售额`), 2) AS `总销售额`,
-            ROUND(SUM(`商品成本`), 2) AS `总成本`,
-            ROUND(SUM(`毛利`), 2) AS `总毛利`,
-            ROUND(SUM(`推广费`), 2) AS `总推广费`,
-            ROUND(SUM(`净利润`), 2) AS `总净利润`,
-            ROUND(CASE WHEN SUM(`销售额`) > 0 THEN SUM(`净利润`) / SUM(`销售额`) * 100 ELSE 0 END, 2) AS `净利率`,
-            ROUND(SUM(`销售额`) / SUM(`订单数`), 2) AS `客单价`
-        FROM ads_daily_report
-        GROUP BY `平台`
-        ORDER BY `总销售额` DESC
-        """
-        db_manager.execute_sql(sql_platform, "创建平台汇总表")
-        
-        # ========== 3. 店铺排行榜 ==========
-        print("\n【第三步】店铺排行榜")
-        
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS ads_store_ranking", "删除旧表")
-        
-        sql_store_rank = """
-        CREATE TABLE IF NOT EXISTS ads_store_ranking AS
-        SELECT 
-            `平台`, `店铺`,
-            SUM(`订单数`) AS `总订单数`,
-            ROUND(SUM(`销售额`), 2) AS `总销售额`,
-            ROUND(SUM(`净利润`), 2) AS `总净利润`,
-            ROUND(CASE WHEN SUM(`销售额`) > 0 THEN SUM(`净利润`) / SUM(`销售额`) * 100 ELSE 0 END, 2) AS `净利率`,
-            ROW_NUMBER() OVER (ORDER BY SUM(`销售额`) DESC) AS `销售排名`,
-            ROW_NUMBER() OVER (ORDER BY SUM(`净利润`) DESC) AS `利润排名`
-        FROM ads_daily_report
-        GROUP BY `平台`, `店铺`
-        ORDER BY `总销售额` DESC
-        """
-        db_manager.execute_sql(sql_store_rank, "创建店铺排行榜")
-        
-        # ========== 4. 流量宽表（完整版：SPU维度 + 所有渠道）==========
-        print("\n【第四步】流量宽表（SPU维度 + 所有渠道）")
-        
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS ads_traffic_report", "删除旧表")
-        
-        # 先创建付费流量汇总（按SPU聚合）
-        sql_paid_traffic = """
-        CREATE TEMPORARY TABLE tmp_paid_traffic AS
-        SELECT 
-            d.date_value AS `日期`,
-            fp.platform AS `平台`,
-            s.store_name AS `店铺`,
-            p.product_id AS `SPU编码`,
-            p.category_l1 AS `一级类目`,
-            p.category_l2 AS `二级类目`,
-            fp.channel AS `流量渠道`,
-            SUM(fp.impressions) AS `曝光量`,
-            SUM(fp.clicks) AS `点击量`,
-            ROUND(SUM(fp.cost), 2) AS `推广费用`,
-            ROUND(CASE WHEN SUM(fp.clicks) > 0 THEN SUM(fp.cost) / SUM(fp.clicks) ELSE 0 END, 2) AS `平均点击成本`
-        FROM dwd_fact_promotion fp
-        INNER JOIN dim_date d ON fp.date_key = d.date_key
-        INNER JOIN dim_store s ON fp.store_key = s.store_key
-        INNER JOIN dim_product p ON fp.product_key = p.product_key
-        GROUP BY d.date_value, fp.platform, s.store_name, p.product_id, p.category_l1, p.category_l2, fp.channel
-        """
-        db_manager.execute_sql(sql_paid_traffic, "创建付费流量临时表")
-        
-        # 创建自然流量汇总（按SPU聚合）
-        sql_natural_traffic = """
-        CREATE TEMPORARY TABLE tmp_natural_traffic AS
-        SELECT 
-            pt.date AS `日期`,
-            pt.platform AS `平台`,
-            s.store_name AS `店铺`,
-            p.product_id AS `SPU编码`,
-            p.category_l1 AS `一级类目`,
-            p.category_l2 AS `二级类目`,
-            pt.channel AS `流量渠道`,
-            SUM(pt.impressions) AS `曝光量`,
-            SUM(pt.clicks) AS `点击量`,
-            SUM(pt.favorites) AS `收藏量`,
-            SUM(pt.add_to_cart) AS `加购量`
-        FROM ods_product_traffic pt
-        INNER JOIN dim_store s ON pt.store_id = s.store_id
-        INNER JOIN dim_product p ON pt.sku_id = p.sku_id
-        GROUP BY pt.date, pt.platform, s.store_name, p.product_id, p.category_l1, p.category_l2, pt.channel
-        """
-        db_manager.execute_sql(sql_natural_traffic, "创建自然流量临时表")
-        
-        # 创建销售数据汇总（按SPU聚合，直接从DWD层计算）- 用于付费流量
-        # 只统计流量来源为"付费推广"的订单
-        sql_sales_spu_paid = """
-        CREATE TEMPORARY TABLE tmp_sales_spu_paid AS
-        SELECT 
-            d.date_value AS `日期`,
-            f.platform AS `平台`,
-            s.store_name AS `店铺`,
-            p.product_id AS `SPU编码`,
-            SUM(fd.quantity) AS `销量`,
-            ROUND(SUM(fd.amount), 2) AS `销售额`
-        FROM dwd_fact_order f
-        INNER JOIN dwd_fact_order_detail fd ON f.order_id = fd.order_id
-        INNER JOIN dim_date d ON f.date_key = d.date_key
-        INNER JOIN dim_store s ON f.store_key = s.store_key
-        INNER JOIN dim_product p ON fd.product_key = p.product_key
-        WHERE f.order_status IN ('已完成', '已发货')
-          AND f.traffic_source = '付费推广'
-        GROUP BY d.date_value, f.platform, s.store_name, p.product_id
-        """
-        db_manager.execute_sql(sql_sales_spu_paid, "创建SPU销售汇总临时表(付费)")
-        
-        # 创建销售数据汇总（按SPU聚合，直接从DWD层计算）- 用于自然流量
-        # 统计流量来源不是"付费推广"的订单
-        sql_sales_spu_natural = """
-        CREATE TEMPORARY TABLE tmp_sales_spu_natural AS
-        SELECT 
-            d.date_value AS `日期`,
-            f.platform AS `平台`,
-            s.store_name AS `店铺`,
-            p.product_id AS `SPU编码`,
-            SUM(fd.quantity) AS `销量`,
-            ROUND(SUM(fd.amount), 2) AS `销售额`
-        FROM dwd_fact_order f
-        INNER JOIN dwd_fact_order_detail fd ON f.order_id = fd.order_id
-        INNER JOIN dim_date d ON f.date_key = d.date_key
-        INNER JOIN dim_store s ON f.store_key = s.store_key
-        INNER JOIN dim_product p ON fd.product_key = p.product_key
-        WHERE f.order_status IN ('已完成', '已发货')
-          AND f.traffic_source != '付费推广'
-        GROUP BY d.date_value, f.platform, s.store_name, p.product_id
-        """
-        db_manager.execute_sql(sql_sales_spu_natural, "创建SPU销售汇总临时表(自然)")
-        
-        # 先按 SPU 汇总流量，再分别关联对应的销量（避免重复计算）
-        sql_traffic_report = """
-        CREATE TABLE ads_traffic_report AS
-        SELECT 
-            paid_agg.`日期`,
-            paid_agg.`平台`,
-            paid_agg.`店铺`,
-            paid_agg.`SPU编码`,
-            paid_agg.`一级类目`,
-            paid_agg.`二级类目`,
-            '付费' AS `流量类型`,
-            paid_agg.`曝光量`,
-            paid_agg.`点击量`,
-            ROUND(CASE WHEN paid_agg.`曝光量` > 0 THEN paid_agg.`点击量` / paid_agg.`曝光量` * 100 ELSE 0 END, 2) AS `点击率`,
-            0 AS `收藏量`,
-            0 AS `加购量`,
-            COALESCE(paid_sales.`销量`, 0) AS `销量`,
-            COALESCE(paid_sales.`销售额`, 0) AS `销售额`,
-            ROUND(CASE WHEN paid_agg.`点击量` > 0 THEN COALESCE(paid_sales.`销量`, 0) / paid_agg.`点击量` * 100 ELSE 0 END, 2) AS `点击转化率`,
-            paid_agg.`推广费用`,
-            ROUND(CASE WHEN paid_agg.`点击量` > 0 THEN paid_agg.`推广费用` / paid_agg.`点击量` ELSE 0 END, 2) AS `平均点击成本`,
-            ROUND(CASE WHEN paid_agg.`推广费用` > 0 THEN COALESCE(paid_sales.`销售额`, 0) / paid_agg.`推广费用` ELSE 0 END, 2) AS `ROI`
-        FROM (
-            -- 付费流量汇总（按 SPU 聚合）
-            SELECT 
-                `日期`, `平台`, `店铺`, `SPU编码`, `一级类目`, `二级类目`,
-                SUM(`曝光量`) AS `曝光量`,
-                SUM(`点击量`) AS `点击量`,
-                SUM(`推广费用`) AS `推广费用`
-            FROM tmp_paid_traffic
-            GROUP BY `日期`, `平台`, `店铺`, `SPU编码`, `一级类目`, `二级类目`
-        ) paid_agg
-        LEFT JOIN tmp_sales_spu_paid paid_sales
-            ON paid_agg.`日期` = paid_sales.`日期` 
-            AND paid_agg.`平台` = paid_sales.`平台` 
-            AND paid_agg.`店铺` = paid_sales.`店铺`
-            AND paid_agg.`SPU编码` = paid_sales.`SPU编码`
-        
-        UNION ALL
-        
-        SELECT 
-            nat_agg.`日期`,
-            nat_agg.`平台`,
-            nat_agg.`店铺`,
-            nat_agg.`SPU编码`,
-            nat_agg.`一级类目`,
-            nat_agg.`二级类目`,
-            '自然' AS `流量类型`,
-            nat_agg.`曝光量`,
-            nat_agg.`点击量`,
-            ROUND(CASE WHEN nat_agg.`曝光量` > 0 THEN nat_agg.`点击量` / nat_agg.`曝光量` * 100 ELSE 0 END, 2) AS `点击率`,
-            nat_agg.`收藏量`,
-            nat_agg.`加购量`,
-            COALESCE(nat_sales.`销量`, 0) AS `销量`,
-            COALESCE(nat_sales.`销售额`, 0) AS `销售额`,
-            ROUND(CASE WHEN nat_agg.`点击量` > 0 THEN COALESCE(nat_sales.`销量`, 0) / nat_agg.`点击量` * 100 ELSE 0 END, 2) AS `点击转化率`,
-            0 AS `推广费用`,
-            0 AS `平均点击成本`,
-            0 AS `ROI`
-        FROM (
-            -- 自然流量汇总（按 SPU 聚合）
-            SELECT 
-                `日期`, `平台`, `店铺`, `SPU编码`, `一级类目`, `二级类目`,
-                SUM(`曝光量`) AS `曝光量`,
-                SUM(`点击量`) AS `点击量`,
-                SUM(`收藏量`) AS `收藏量`,
-                SUM(`加购量`) AS `加购量`
-            FROM tmp_natural_traffic
-            GROUP BY `日期`, `平台`, `店铺`, `SPU编码`, `一级类目`, `二级类目`
-        ) nat_agg
-        LEFT JOIN tmp_sales_spu_natural nat_sales
-            ON nat_agg.`日期` = nat_sales.`日期` 
-            AND nat_agg.`平台` = nat_sales.`平台` 
-            AND nat_agg.`店铺` = nat_sales.`店铺`
-            AND nat_agg.`SPU编码` = nat_sales.`SPU编码`
-        
-        ORDER BY `日期` DESC, `平台`, `店铺`, `SPU编码`, `流量类型`
-        """
-        db_manager.execute_sql(sql_traffic_report, "创建流量宽表")
-        
-        # 添加索引（TEXT类型需要指定前缀长度）
-        db_manager.execute_sql("ALTER TABLE ads_traffic_report ADD INDEX idx_date (`日期`(10))", "创建日期索引")
-        db_manager.execute_sql("ALTER TABLE ads_traffic_report ADD INDEX idx_platform (`平台`(20))", "创建平台索引")
-        db_manager.execute_sql("ALTER TABLE ads_traffic_report ADD INDEX idx_spu (`SPU编码`(50))", "创建SPU索引")
-        db_manager.execute_sql("ALTER TABLE ads_traffic_report ADD INDEX idx_traffic_type (`流量类型`)", "创建流量类型索引")
+        ensure_control_tables(db_manager.connection)
+        run_started = _fetch_column(db_manager, "SELECT NOW()")[0]
         
-        print("\n  注意：流量表已按 SPU 汇总，不再按流量渠道明细展示")
+        # ========== 1. 中间表 ==========
+        if mids:
+            print("\n【第一步】中间表（按日期增量刷新）")
+        for index, table_name in enumerate(mids, 1):
+            print(f"\n1.{index} {MID_TABLES[table_name][0]} ({table_name})")
+            if not refresh_mid_table(db_manager, table_name, mode, run_started):
+                return False
         
-        # 清理临时表
-        db_manager.execute_sql("DROP TEMPORARY TABLE IF EXISTS tmp_paid_traffic", "清理临时表")
-        db_manager.execute_sql("DROP TEMPORARY TABLE IF EXISTS tmp_natural_traffic", "清理临时表")
-        db_manager.execute_sql("DROP TEMPORARY TABLE IF EXISTS tmp_sales_spu_paid", "清理临时表")
-        db_manager.execute_sql("DROP TEMPORARY TABLE IF EXISTS tmp_sales_spu_natural", "清理临时表")
+        # ========== 2. 报表 ==========
+        if reports:
+            print("\n【第二步】报表")
+        for index, table_name in enumerate(reports, 1):
+            title, sql, _ = REPORTS[table_name]
+            print(f"\n2.{index} {title}")
+            _prepare_table(db_manager, table_name, mode)
+            if not db_manager.execute_sql(sql, f"写入{title}"):
+                return False
         
         print("\n" + "="*60)
         print("✓ ADS层转换完成！")
@@ -430,10 +615,11 @@ def main():
     })
     
     mode = config.get('mode', 'full')
+    tables = config.get('tables')
     print(f"模式: {'全量' if mode == 'full' else '增量'}")
     
     try:
-        success = transform_ads(mode, db_config)
+        success = transform_ads(mode, db_config, tables)
         if not success:
             sys.exit(1)
     except KeyboardInterrupt:
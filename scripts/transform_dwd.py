@@ -4,7 +4,7 @@ DWD层转换 - 明细数据层（事实表）
 支持千万级数据的企业级数仓设计
 
 优化策略：
-- 分批处理：每次处理10万行，避免内存溢出
+- 分批处理：按源表键范围分块（keyset），每块10万行单独提交，可断点续传
 - 避免复杂JOIN：先处理主表，再关联维度
 - 使用临时表：减少锁竞争
 """
@@ -12,17 +12,86 @@ import sys
 import json
 import signal
 import atexit
+import os
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
+
+import pymysql
+from pymysql.constants import ER
 
 # 导入数据库管理器
-from db_manager import get_db_manager, cleanup_global_db_manager
+from db_manager import DatabaseManager, get_db_manager, cleanup_global_db_manager
+from dag_scheduler import run_dag
+from etl_control import (
+    ensure_control_tables, get_watermark, set_watermark,
+    get_chunk_progress, save_chunk_progress, clear_chunk_progress,
+    get_load_manifest, read_ready_manifest, record_removed_dates, ensure_column
+)
+from config import AMOUNT_FEE_RATES, shipping_fee_sql, amount_fee_sql
+from partitioning import (
+    month_start, month_range, next_month, add_months, partition_name, monthly_partition_clause,
+    get_partitions, ensure_month_partitions, create_exchange_table, exchange_month_partition,
+    drop_partitions_before
+)
 
 # 分批处理配置
 BATCH_SIZE = 100000  # 每批10万行
 
 _start_time = None  # 全局开始时间
 
+# 生成器预解析代理键的事实表CSV（resolveKeys），全量构建时直接 LOAD DATA 导入
+RESOLVED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'dwd')
+
+# 维度成员最近一次写入时间（早期版本建的维度表自动补列）
+DIM_ETL_TIME_COLUMN = "etl_time DATETIME"
+
+# 订单明细的费用列（费用重算只更新这些列）
+FEE_COLUMNS = ['shipping_fee', *AMOUNT_FEE_RATES]
+
+# 预解析事实CSV中不属于事实表的列：导入时读入同名用户变量，仅用于计算派生列
+RESOLVED_VARIABLES = ['category_l1']
+
+# 按 date_key 月度分区的事实表
+PARTITIONED_FACTS = ['dwd_fact_order', 'dwd_fact_order_detail', 'dwd_fact_promotion']
+
+# 增量构建的水位线：事实表 -> (ODS 源表, 水位线列)；明细随所属订单的下单时间推进
+FACT_WATERMARKS = {
+    'dwd_fact_order': ('ods_orders', 'order_time'),
+    'dwd_fact_order_detail': ('ods_orders', 'order_time'),
+    'dwd_fact_promotion': ('ods_promotion', 'date'),
+    'dwd_fact_traffic': ('ods_traffic', 'date'),
+    'dwd_fact_inventory': ('ods_inventory', 'date'),
+}
+
+# 全量构建按键范围分块提交的事实表（分块进度记录名与表名相同）
+CHUNKED_FACT_TABLES = ['dwd_fact_order', 'dwd_fact_order_detail']
+
+MODE_LABELS = {
+    'full': '全量',
+    'incremental': '增量',
+    'resume': '断点续传',
+    'fees': '费用重算',
+}
+
+# DWD 构建依赖：维度表互相独立；订单明细依赖订单事实表，其余事实表只依赖维度表
+DWD_DEPENDENCIES = {
+    'dim_date': [],
+    'dim_user': [],
+    'dim_product': [],
+    'dim_store': [],
+    'fact_order': ['dim_user', 'dim_store'],
+    'fact_order_detail': ['fact_order', 'dim_product'],
+    'fact_promotion': ['dim_store', 'dim_product'],
+    'fact_traffic': ['dim_store'],
+    'fact_inventory': ['dim_product', 'dim_store'],
+}
+
+# DAG 默认最大并发数（每个并发节点占用一个数据库连接）
+DEFAULT_PARALLELISM = 4
+
+# 增量回看天数：水位线之前这些天内的源数据重新合并，用于吸收迟到的更新
+DEFAULT_LOOKBACK_DAYS = 3
+
 
 def log(message, level='INFO'):
     """带时间戳的日志输出"""
@@ -42,144 +111,231 @@ def signal_handler(signum, frame):
     cleanup_global_db_manager()
     sys.exit(1)
 
-def batch_update(conn, update_sql, table_name, id_column, description):
-    """分批更新数据"""
+def keyset_execute(db_manager, job_name, source_table, key_column, key_expr, build_chunk_sql, description,
+                   resume=False):
+    """
+    按源表键范围分块执行大语句（keyset 分页，替代 LIMIT OFFSET）
+    每块先在源表键索引上定位上界（ORDER BY key LIMIT 1 OFFSET n），再处理 (上一块上界, 本块上界] 的行
+    每块与进度记录同事务提交，undo 日志和锁持有时间与块大小成正比；中断后 resume=True 可从上次位置继续
+    
+    Args:
+        job_name: 进度记录名（etl_chunk_progress.job_name）
+        source_table / key_column: 定位分块边界的源表和有索引的键列（可不唯一，同值的行总在同一块）
+        key_expr: 键在 DML 语句中的写法（如 o.order_no）
+        build_chunk_sql: 函数 (key_filter) -> INSERT/UPDATE 语句，key_filter 以 AND 开头
+    """
+    conn = db_manager.connection
+    if resume:
+        last_key, rows_done, done = get_chunk_progress(conn, job_name)
+        if done:
+            print(f"  {description}... ✓ 已完成（跳过）")
+            sys.stdout.flush()
+            return True
+        if last_key is not None:
+            print(f"  {description}: 从 {last_key} 之后继续（已处理 {rows_done:,} 行）")
+            sys.stdout.flush()
+    else:
+        clear_chunk_progress(conn, job_name)
+        last_key, rows_done = None, 0
+    
+    start_time = time.time()
+    chunks = 0
     cursor = conn.cursor()
     try:
-        # 获取总行数
-        total = get_table_count(conn, table_name)
-        if total == 0:
-            print(f"  {description}... ✓ 无数据")
-            return True
-        
-        batches = (total + BATCH_SIZE - 1) // BATCH_SIZE
-        print(f"  {description} ({total:,}行, {batches}批)...")
-        sys.stdout.flush()
-        
-        start_time = time.time()
-        processed = 0
-        
-        for batch in range(batches):
-            offset = batch * BATCH_SIZE
-            # 使用LIMIT分批更新
-            batch_sql = f"""
-            UPDATE {table_name} t
-            INNER JOIN ({update_sql}) src ON t.{id_column} = src.{id_column}
-            SET {', '.join([f't.{col} = src.{col}' for col in get_update_columns(update_sql)])}
-            WHERE t.{id_column} IN (
-                SELECT {id_column} FROM (
-                    SELECT {id_column} FROM {table_name} LIMIT {BATCH_SIZE} OFFSET {offset}
-                ) tmp
-            )
-            """
-            # 简化：直接用原SQL的LIMIT方式
-            cursor.execute(f"{update_sql} LIMIT {BATCH_SIZE} OFFSET {offset}")
+        while True:
+            if last_key is None:
+                cursor.execute(
+                    f"SELECT {key_column} FROM {source_table} WHERE {key_column} IS NOT NULL "
+                    f"ORDER BY {key_column} LIMIT 1 OFFSET {BATCH_SIZE - 1}"
+                )
+            else:
+                cursor.execute(
+                    f"SELECT {key_column} FROM {source_table} WHERE {key_column} > %s "
+                    f"ORDER BY {key_column} LIMIT 1 OFFSET {BATCH_SIZE - 1}",
+                    (last_key,)
+                )
+            row = cursor.fetchone()
+            upper = row[0] if row else None
+            
+            key_filter = ''
+            if last_key is not None:
+                key_filter += f" AND {key_expr} > {conn.escape(last_key)}"
+            if upper is not None:
+                key_filter += f" AND {key_expr} <= {conn.escape(upper)}"
+            
+            cursor.execute(build_chunk_sql(key_filter))
+            rows_done += max(cursor.rowcount, 0)
+            save_chunk_progress(conn, job_name, upper, rows_done, done=upper is None)
             conn.commit()
+            chunks += 1
             
-            processed += min(BATCH_SIZE, total - offset)
-            progress = int(processed / total * 100)
             elapsed = time.time() - start_time
-            speed = int(processed / elapsed) if elapsed > 0 else 0
-            print(f"\r  {description} ({total:,}行, {batches}批)... {progress}% ({speed:,}行/秒)", end='', flush=True)
+            speed = int(rows_done / elapsed) if elapsed > 0 else 0
+            print(f"\r  {description}... 第{chunks}块 {rows_done:,}行 ({speed:,}行/秒)", end='', flush=True)
+            
+            if upper is None:
+                break
+            last_key = upper
         
         elapsed = time.time() - start_time
-        speed = int(total / elapsed) if elapsed > 0 else 0
-        print(f"\r  {description}... ✓ {total:,}行 ({elapsed:.1f}秒, {speed:,}行/秒)")
+        speed = int(rows_done / elapsed) if elapsed > 0 else 0
+        print(f"\r  {description}... ✓ {rows_done:,}行, {chunks}块 ({elapsed:.1f}秒, {speed:,}行/秒)")
         sys.stdout.flush()
         return True
     except Exception as e:
         print(f" ✗ 失败: {e}")
+        sys.stdout.flush()
         conn.rollback()
         return False
     finally:
         cursor.close()
 
-def batch_insert_with_join(conn, target_table, source_sql, description):
-    """分批插入带JOIN的数据"""
-    cursor = conn.cursor()
+
+def _ods_months(db_manager, table_name, column):
+    """ODS 源表数据覆盖的月份（用于创建按月分区）"""
+    cursor = db_manager.connection.cursor()
     try:
-        # 先统计源数据量
-        count_sql = f"SELECT COUNT(*) FROM ({source_sql}) t"
-        cursor.execute(count_sql)
-        total = cursor.fetchone()[0]
-        
-        if total == 0:
-            print(f"  {description}... ✓ 无数据")
-            return True
-        
-        batches = (total + BATCH_SIZE - 1) // BATCH_SIZE
-        print(f"  {description} ({total:,}行, {batches}批)...")
+        cursor.execute(f"SELECT MIN({column}), MAX({column}) FROM {table_name}")
+        low, high = cursor.fetchone()
+    except Exception:
+        return []
+    finally:
+        cursor.close()
+    if low is None:
+        return []
+    return month_range(low, high)
+
+
+def _partition_clause(months):
+    """date_key 按月分区子句（源表无数据时不分区）"""
+    return monthly_partition_clause('date_key', months, int_key=True) if months else ''
+
+
+def _month_filter(column, month, int_key=False):
+    """单月过滤条件：column 落在 month 当月"""
+    if int_key:
+        low = month.year * 10000 + month.month * 100 + 1
+        high_month = next_month(month)
+        high = high_month.year * 10000 + high_month.month * 100 + 1
+        return f"{column} >= {low} AND {column} < {high}"
+    return f"{column} >= '{month.isoformat()}' AND {column} < '{next_month(month).isoformat()}'"
+
+
+def rebuild_fact_months(db_manager, table_name, build_insert_sql, months):
+    """
+    分区级重建：逐月把数据构建到交换表，再 EXCHANGE PARTITION 原子替换
+    重建期间分区表其它月份照常可读
+    
+    Args:
+        build_insert_sql: 函数 (目标表, 月份) -> INSERT ... SELECT 语句
+        months: 需要重建的月份列表
+    """
+    conn = db_manager.connection
+    if not get_partitions(conn, table_name):
+        print(f"  ✗ {table_name} 不是分区表，请先执行全量构建")
         sys.stdout.flush()
-        
-        start_time = time.time()
-        processed = 0
-        
-        for batch in range(batches):
-            offset = batch * BATCH_SIZE
-            batch_sql = f"INSERT INTO {target_table} {source_sql} LIMIT {BATCH_SIZE} OFFSET {offset}"
-            cursor.execute(batch_sql)
-            conn.commit()
-            
-            processed += min(BATCH_SIZE, total - offset)
-            progress = int(processed / total * 100)
-            elapsed = time.time() - start_time
-            speed = int(processed / elapsed) if elapsed > 0 else 0
-            print(f"\r  {description} ({total:,}行, {batches}批)... {progress}% ({speed:,}行/秒)", end='', flush=True)
-        
-        elapsed = time.time() - start_time
-        speed = int(total / elapsed) if elapsed > 0 else 0
-        print(f"\r  {description}... ✓ {total:,}行 ({elapsed:.1f}秒, {speed:,}行/秒)")
+        return False
+    
+    ensure_month_partitions(conn, table_name, months, int_key=True)
+    existing = set(get_partitions(conn, table_name))
+    missing = [f"{month:%Y-%m}" for month in months if partition_name(month) not in existing]
+    if missing:
+        print(f"  ✗ {table_name} 无法为这些月份建立分区: {', '.join(missing)}（请先执行全量构建）")
         sys.stdout.flush()
-        return True
-    except Exception as e:
-        print(f" ✗ 失败: {e}")
-        conn.rollback()
         return False
+    for month in months:
+        exchange_table = f"{table_name}__{partition_name(month)}"
+        create_exchange_table(conn, table_name, exchange_table)
+        if not db_manager.execute_sql(build_insert_sql(exchange_table, month), f"构建 {month:%Y-%m} 分区数据"):
+            db_manager.execute_sql(f"DROP TABLE IF EXISTS {exchange_table}", "删除交换表")
+            return False
+        exchange_month_partition(conn, table_name, month, exchange_table)
+        db_manager.execute_sql(f"DROP TABLE IF EXISTS {exchange_table}", f"交换分区 {partition_name(month)} 并删除旧数据")
+    return True
+
+
+def apply_fact_retention(db_manager, retention_months):
+    """数据保留：删除分区事实表中早于最近 N 个月的分区"""
+    cursor = db_manager.connection.cursor()
+    try:
+        cursor.execute("SELECT MAX(date_key) FROM dwd_fact_order")
+        row = cursor.fetchone()
     finally:
         cursor.close()
+    if not row or not row[0]:
+        return
+    
+    latest = str(row[0])
+    cutoff = add_months(month_start(f"{latest[:4]}-{latest[4:6]}"), 1 - retention_months)
+    
+    log(f"【数据保留】保留 {cutoff:%Y-%m} 及之后的分区")
+    for table_name in PARTITIONED_FACTS:
+        dropped = drop_partitions_before(db_manager.connection, table_name, cutoff)
+        print(f"  ✓ {table_name}: 删除 {len(dropped)} 个分区")
+    sys.stdout.flush()
 
-def batch_update_simple(conn, table_name, update_sql, description):
-    """简单分批更新（使用主键范围）"""
-    cursor = conn.cursor()
+
+def _dim_merge_sql(dim_table, key_column, columns, source_sql):
+    """
+    维度合并（SCD1）：source_sql 输出 key_column + columns，按行哈希只写入新增或属性变化的成员
+    代理键即整数业务编号，变化的成员原地更新、键保持不变，事实表无需随维度重建
+    写入的成员 etl_time 为 NOW()，DWS 增量据此重算引用这些成员的汇总
+    """
+    hash_expr = "MD5(CONCAT_WS('|', " + ', '.join(f"COALESCE(src.{col}, '<null>')" for col in columns) + "))"
+    all_columns = [key_column] + columns
+    return f"""
+    INSERT INTO {dim_table} ({', '.join(all_columns)}, row_hash, etl_time)
+    SELECT {', '.join(f'src.{col}' for col in all_columns)}, {hash_expr}, NOW()
+    FROM ({source_sql}) src
+    LEFT JOIN {dim_table} d ON d.{key_column} = src.{key_column}
+    WHERE d.{key_column} IS NULL OR d.row_hash <> {hash_expr}
+    {_upsert_clause(dim_table, columns + ['row_hash', 'etl_time'])}
+    """
+
+
+def _prune_dim(db_manager, dim_table, key_column, source_table, source_key):
+    """
+    全量模式：删除源表中已不存在的维度成员
+    维度表不再 DROP 重建（构建期间和失败后下游仍能关联到完整维度），合并 + 清理后与源表一致
+    """
+    sql = f"""
+    DELETE d FROM {dim_table} d
+    LEFT JOIN {source_table} s ON s.{source_key} = d.{key_column}
+    WHERE s.{source_key} IS NULL
+    """
+    return db_manager.execute_sql(sql, "删除源表中已不存在的成员")
+
+
+def _date_range(db_manager):
+    """维度日期需要覆盖的范围：各事实来源 ODS 表的最早日期 ~ max(最晚日期, 今天)"""
+    lows, highs = [], []
+    cursor = db_manager.connection.cursor()
     try:
-        total = get_table_count(conn, table_name)
-        if total == 0:
-            print(f"  {description}... ✓ 无数据")
-            return True
-        
-        batches = (total + BATCH_SIZE - 1) // BATCH_SIZE
-        start_time = time.time()
-        
-        # 直接执行更新（MySQL会自动优化）
-        print(f"  {description}...", end='', flush=True)
-        cursor.execute(update_sql)
-        conn.commit()
-        
-        elapsed = time.time() - start_time
-        affected = cursor.rowcount
-        speed = int(affected / elapsed) if elapsed > 0 else 0
-        print(f" ✓ {affected:,}行 ({elapsed:.1f}秒, {speed:,}行/秒)")
-        sys.stdout.flush()
-        return True
-    except Exception as e:
-        print(f" ✗ 失败: {e}")
-        conn.rollback()
-        return False
+        for source_table, column in sorted(set(FACT_WATERMARKS.values())):
+            try:
+                cursor.execute(f"SELECT DATE(MIN({column})), DATE(MAX({column})) FROM {source_table}")
+            except pymysql.err.ProgrammingError as e:
+                # 尚未加载的来源表不参与计算，其它错误照常抛出
+                if e.args[0] != ER.NO_SUCH_TABLE:
+                    raise
+                continue
+            low, high = cursor.fetchone()
+            if low is not None:
+                lows.append(low)
+                highs.append(high)
     finally:
         cursor.close()
+    today = datetime.now().date()
+    return min(lows, default=today), max(highs + [today])
 
 
-def build_dim_tables(db_manager, mode='full'):
-    """构建DIM层维度表"""
-    log("【构建DIM层维度表】")
-    
-    # 跳过索引添加（ODS表已有索引，或者在导入时已创建）
-    # 添加索引很慢，如果表已有数据，跳过可节省10-20秒
-    
-    # 1. 日期维度表
+# 各维度表互相独立，可并发构建
+# 跳过索引添加（ODS表已有索引，或者在导入时已创建）
+# 添加索引很慢，如果表已有数据，跳过可节省10-20秒
+
+def build_dim_date(db_manager, mode='full'):
+    """日期维度表（只补充尚未覆盖的日期，已有日期不重建；日期成员固定不变，全量模式同样只补充）"""
     print("\n1. 日期维度表")
-    if mode == 'full':
-        db_manager.execute_sql("DROP TABLE IF EXISTS dim_date", "删除旧表")
     
     sql_dim_date = """
     CREATE TABLE IF NOT EXISTS dim_date (
@@ -193,64 +349,97 @@ def build_dim_tables(db_manager, mode='full'):
     """
     db_manager.execute_sql(sql_dim_date, "创建日期维度表结构")
     
-    sql_insert_dates = """
-    INSERT IGNORE INTO dim_date (date_key, date_value, `year`, `quarter`, `month`, `week`, `day`, `weekday`, weekday_name, is_weekend, `year_month`, `year_week`)
-    SELECT 
-        CAST(DATE_FORMAT(date_value, '%Y%m%d') AS UNSIGNED) AS date_key, date_value,
-        YEAR(date_value), QUARTER(date_value), MONTH(date_value), WEEK(date_value, 1), DAY(date_value),
-        WEEKDAY(date_value) + 1,
-        CASE WEEKDAY(date_value) WHEN 0 THEN '周一' WHEN 1 THEN '周二' WHEN 2 THEN '周三' WHEN 3 THEN '周四' WHEN 4 THEN '周五' WHEN 5 THEN '周六' WHEN 6 THEN '周日' END,
-        CASE WHEN WEEKDAY(date_value) IN (5, 6) THEN 1 ELSE 0 END,
-        DATE_FORMAT(date_value, '%Y-%m'), CONCAT(YEAR(date_value), '-W', LPAD(WEEK(date_value, 1), 2, '0'))
-    FROM (
-        SELECT DATE_SUB(CURDATE(), INTERVAL seq DAY) AS date_value FROM (
-            SELECT a.N + b.N * 10 + c.N * 100 + d.N * 1000 AS seq FROM 
-            (SELECT 0 AS N UNION SELECT 1 UNION SELECT 2 UNION SELECT 3 UNION SELECT 4 UNION SELECT 5 UNION SELECT 6 UNION SELECT 7 UNION SELECT 8 UNION SELECT 9) a,
-            (SELECT 0 AS N UNION SELECT 1 UNION SELECT 2 UNION SELECT 3 UNION SELECT 4 UNION SELECT 5 UNION SELECT 6 UNION SELECT 7 UNION SELECT 8 UNION SELECT 9) b,
-            (SELECT 0 AS N UNION SELECT 1 UNION SELECT 2 UNION SELECT 3 UNION SELECT 4 UNION SELECT 5 UNION SELECT 6 UNION SELECT 7 UNION SELECT 8 UNION SELECT 9) c,
-            (SELECT 0 AS N UNION SELECT 1 UNION SELECT 2) d
-        ) nums WHERE seq <= 1095
-    ) dates
-    """
-    db_manager.execute_sql(sql_insert_dates, "生成日期维度数据")
-    
-    # 2. 用户维度表（简化设计）
+    # 日期维度连续，只需补充现有范围之前和之后缺少的日期
+    low, high = _date_range(db_manager)
+    cursor = db_manager.connection.cursor()
+    try:
+        cursor.execute("SELECT MIN(date_value), MAX(date_value) FROM dim_date")
+        existing_low, existing_high = cursor.fetchone()
+    finally:
+        cursor.close()
+    if existing_low is None:
+        missing = [(low, high)]
+    else:
+        missing = []
+        if low < existing_low:
+            missing.append((low, existing_low - timedelta(days=1)))
+        if high > existing_high:
+            missing.append((existing_high + timedelta(days=1), high))
+    if not missing:
+        print(f"  ✓ 已覆盖 {existing_low} ~ {existing_high}，无新日期")
+        sys.stdout.flush()
+        return True
+    
+    for start, end in missing:
+        db_manager.execute_sql(
+            f"SET SESSION cte_max_recursion_depth = {(end - start).days + 1000}", "设置日期序列长度"
+        )
+        sql_insert_dates = f"""
+        INSERT IGNORE INTO dim_date (date_key, date_value, `year`, `quarter`, `month`, `week`, `day`, `weekday`, weekday_name, is_weekend, `year_month`, `year_week`)
+        WITH RECURSIVE dates (date_value) AS (
+            SELECT DATE('{start.isoformat()}')
+            UNION ALL
+            SELECT date_value + INTERVAL 1 DAY FROM dates WHERE date_value < '{end.isoformat()}'
+        )
+        SELECT 
+            CAST(DATE_FORMAT(date_value, '%Y%m%d') AS UNSIGNED) AS date_key, date_value,
+            YEAR(date_value), QUARTER(date_value), MONTH(date_value), WEEK(date_value, 1), DAY(date_value),
+            WEEKDAY(date_value) + 1,
+            CASE WEEKDAY(date_value) WHEN 0 THEN '周一' WHEN 1 THEN '周二' WHEN 2 THEN '周三' WHEN 3 THEN '周四' WHEN 4 THEN '周五' WHEN 5 THEN '周六' WHEN 6 THEN '周日' END,
+            CASE WHEN WEEKDAY(date_value) IN (5, 6) THEN 1 ELSE 0 END,
+            DATE_FORMAT(date_value, '%Y-%m'), CONCAT(YEAR(date_value), '-W', LPAD(WEEK(date_value, 1), 2, '0'))
+        FROM dates
+        """
+        if not db_manager.execute_sql(sql_insert_dates, f"补充日期 {start} ~ {end}"):
+            return False
+    return True
+
+
+def build_dim_user(db_manager, mode='full'):
+    """用户维度表（代理键直接使用 ODS 的整数用户编号；只写入新增或变化的用户）"""
     print("\n2. 用户维度表")
-    if mode == 'full':
-        db_manager.execute_sql("DROP TABLE IF EXISTS dim_user", "删除旧表")
     
     sql_dim_user = """
     CREATE TABLE IF NOT EXISTS dim_user (
-        user_key BIGINT AUTO_INCREMENT PRIMARY KEY,
-        user_id VARCHAR(50) NOT NULL UNIQUE,
+        user_key BIGINT PRIMARY KEY,
+        user_id VARCHAR(50) NOT NULL,
         user_name VARCHAR(100), gender VARCHAR(10),
         age INT, age_group VARCHAR(20), city VARCHAR(50),
         register_date DATE,
-        INDEX idx_user_id (user_id)
+        row_hash CHAR(32) NOT NULL,
+        etl_time DATETIME,
+        UNIQUE KEY uk_user_id (user_id)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
     """
     db_manager.execute_sql(sql_dim_user, "创建用户维度表结构")
+    ensure_column(db_manager.connection, 'dim_user', 'etl_time', DIM_ETL_TIME_COLUMN)
     
-    sql_insert_user = """
-    INSERT INTO dim_user (user_id, user_name, gender, age, age_group, city, register_date)
-    SELECT user_id, user_name, gender, age,
-        CASE WHEN age < 18 THEN '未成年' WHEN age BETWEEN 18 AND 25 THEN '18-25岁' WHEN age BETWEEN 26 AND 35 THEN '26-35岁'
-             WHEN age BETWEEN 36 AND 45 THEN '36-45岁' WHEN age BETWEEN 46 AND 55 THEN '46-55岁' ELSE '55岁以上' END,
-        city, register_date
-    FROM ods_users WHERE user_id IS NOT NULL
+    source_sql = """
+        SELECT user_no AS user_key, user_id, user_name, gender, age,
+            CASE WHEN age < 18 THEN '未成年' WHEN age BETWEEN 18 AND 25 THEN '18-25岁' WHEN age BETWEEN 26 AND 35 THEN '26-35岁'
+                 WHEN age BETWEEN 36 AND 45 THEN '36-45岁' WHEN age BETWEEN 46 AND 55 THEN '46-55岁' ELSE '55岁以上' END AS age_group,
+            city, register_date
+        FROM ods_users WHERE user_no IS NOT NULL
     """
-    db_manager.execute_sql(sql_insert_user, "加载用户维度数据")
-    
-    # 3. 商品维度表（SKU ID 全局唯一）
+    sql_merge = _dim_merge_sql(
+        'dim_user', 'user_key',
+        ['user_id', 'user_name', 'gender', 'age', 'age_group', 'city', 'register_date'], source_sql
+    )
+    if not db_manager.execute_sql(sql_merge, "合并用户维度（新增/变化）"):
+        return False
+    return mode != 'full' or _prune_dim(db_manager, 'dim_user', 'user_key', 'ods_users', 'user_no')
+
+
+def build_dim_product(db_manager, mode='full'):
+    """商品维度表（SKU 全局唯一，代理键直接使用整数 SKU 编号；只写入新增或变化的商品）"""
     print("\n3. 商品维度表")
-    if mode == 'full':
-        db_manager.execute_sql("DROP TABLE IF EXISTS dim_product", "删除旧表")
     
     sql_dim_product = """
     CREATE TABLE IF NOT EXISTS dim_product (
-        product_key BIGINT AUTO_INCREMENT PRIMARY KEY,
-        sku_id VARCHAR(100) NOT NULL UNIQUE,
+        product_key BIGINT PRIMARY KEY,
+        sku_id VARCHAR(100) NOT NULL,
         product_id VARCHAR(50) NOT NULL,
+        store_key BIGINT NOT NULL,
         store_id VARCHAR(20) NOT NULL,
         product_name VARCHAR(200),
         spec VARCHAR(100),
@@ -258,70 +447,321 @@ def build_dim_tables(db_manager, mode='full'):
         price DECIMAL(10,2), cost DECIMAL(10,2), profit_margin DECIMAL(5,2),
         stock INT,
         platform VARCHAR(20),
-        INDEX idx_sku_id (sku_id),
+        row_hash CHAR(32) NOT NULL,
+        etl_time DATETIME,
+        UNIQUE KEY uk_sku_id (sku_id),
         INDEX idx_product_id (product_id),
-        INDEX idx_store_id (store_id),
+        INDEX idx_store_key (store_key),
         INDEX idx_category (category_l1, category_l2)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
     """
     db_manager.execute_sql(sql_dim_product, "创建商品维度表结构")
+    ensure_column(db_manager.connection, 'dim_product', 'etl_time', DIM_ETL_TIME_COLUMN)
     
-    sql_insert_product = """
-    INSERT INTO dim_product (sku_id, product_id, store_id, product_name, spec, category_l1, category_l2, price, cost, profit_margin, stock, platform)
-    SELECT sku_id, product_id, store_id, product_name, spec, category_l1, category_l2, price, cost,
-        CASE WHEN price > 0 THEN ROUND((price - cost) / price * 100, 2) ELSE 0 END,
-        stock, platform
-    FROM ods_products WHERE sku_id IS NOT NULL
+    source_sql = """
+        SELECT sku_no AS product_key, sku_id, product_id, store_no AS store_key, store_id, product_name, spec,
+            category_l1, category_l2, price, cost,
+            CASE WHEN price > 0 THEN ROUND((price - cost) / price * 100, 2) ELSE 0 END AS profit_margin,
+            stock, platform
+        FROM ods_products WHERE sku_no IS NOT NULL
     """
-    db_manager.execute_sql(sql_insert_product, "加载商品维度数据")
-    
-    # 4. 店铺维度表（简化设计）
+    sql_merge = _dim_merge_sql(
+        'dim_product', 'product_key',
+        ['sku_id', 'product_id', 'store_key', 'store_id', 'product_name', 'spec', 'category_l1', 'category_l2',
+         'price', 'cost', 'profit_margin', 'stock', 'platform'],
+        source_sql
+    )
+    if not db_manager.execute_sql(sql_merge, "合并商品维度（新增/变化）"):
+        return False
+    return mode != 'full' or _prune_dim(db_manager, 'dim_product', 'product_key', 'ods_products', 'sku_no')
+
+
+def build_dim_store(db_manager, mode='full'):
+    """店铺维度表（代理键直接使用整数店铺编号；只写入新增或变化的店铺）"""
     print("\n4. 店铺维度表")
-    if mode == 'full':
-        db_manager.execute_sql("DROP TABLE IF EXISTS dim_store", "删除旧表")
     
     sql_dim_store = """
     CREATE TABLE IF NOT EXISTS dim_store (
-        store_key BIGINT AUTO_INCREMENT PRIMARY KEY,
-        store_id VARCHAR(20) NOT NULL UNIQUE,
+        store_key BIGINT PRIMARY KEY,
+        store_id VARCHAR(20) NOT NULL,
         store_name VARCHAR(100), platform VARCHAR(20),
         store_type VARCHAR(50), open_date DATE,
-        INDEX idx_store_id (store_id)
+        row_hash CHAR(32) NOT NULL,
+        etl_time DATETIME,
+        UNIQUE KEY uk_store_id (store_id)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
     """
     db_manager.execute_sql(sql_dim_store, "创建店铺维度表结构")
+    ensure_column(db_manager.connection, 'dim_store', 'etl_time', DIM_ETL_TIME_COLUMN)
     
-    sql_insert_store = """
-    INSERT INTO dim_store (store_id, store_name, platform, store_type, open_date)
-    SELECT store_id, store_name, platform,
-        CASE WHEN store_name LIKE '%旗舰店%' THEN '旗舰店' WHEN store_name LIKE '%专卖店%' THEN '专卖店'
-             WHEN store_name LIKE '%直营店%' THEN '直营店' ELSE '普通店' END,
-        open_date
-    FROM ods_stores WHERE store_id IS NOT NULL
+    source_sql = """
+        SELECT store_no AS store_key, store_id, store_name, platform,
+            CASE WHEN store_name LIKE '%旗舰店%' THEN '旗舰店' WHEN store_name LIKE '%专卖店%' THEN '专卖店'
+                 WHEN store_name LIKE '%直营店%' THEN '直营店' ELSE '普通店' END AS store_type,
+            open_date
+        FROM ods_stores WHERE store_no IS NOT NULL
     """
-    db_manager.execute_sql(sql_insert_store, "加载店铺维度数据")
+    sql_merge = _dim_merge_sql(
+        'dim_store', 'store_key', ['store_id', 'store_name', 'platform', 'store_type', 'open_date'], source_sql
+    )
+    if not db_manager.execute_sql(sql_merge, "合并店铺维度（新增/变化）"):
+        return False
+    return mode != 'full' or _prune_dim(db_manager, 'dim_store', 'store_key', 'ods_stores', 'store_no')
+
+
+def _source_filter(column, month=None, window=None, int_key=False):
+    """
+    源数据过滤条件（以 AND 开头，直接拼接在 WHERE 条件之后）
+    month: 单月重建；window: 增量窗口 (low, high)，low 为空表示不设下界
+    int_key: column 为 YYYYMMDD 整数（ODS 的 date_key 生成列），窗口按天换算
+    """
+    conditions = []
+    if month:
+        conditions.append(_month_filter(column, month, int_key))
+    if window:
+        low, high = window
+        if int_key:
+            low, high = low and _date_key(low), _date_key(high)
+            if low:
+                conditions.append(f"{column} >= {low}")
+            conditions.append(f"{column} <= {high}")
+        else:
+            if low:
+                conditions.append(f"{column} >= '{low}'")
+            conditions.append(f"{column} <= '{high}'")
+    return ''.join(f" AND {condition}" for condition in conditions)
+
+
+def _upsert_clause(target_table, columns):
+    """增量合并：唯一键冲突时用新值覆盖这些列（迟到的更新）；左侧列名带表名，避免与 SELECT 中的同名列冲突"""
+    return "ON DUPLICATE KEY UPDATE " + ', '.join(f"{target_table}.{col} = VALUES({col})" for col in columns)
+
+
+def _date_key(value):
+    """'YYYY-MM-DD...' -> YYYYMMDD 整数"""
+    return int(str(value)[:10].replace('-', ''))
+
+
+def _incremental_window(db_manager, fact_table, lookback_days):
+    """
+    计算增量窗口 (low, high)
+    high 为 ODS 源表当前最大值，low 为上次水位线回看 lookback_days 天（容纳迟到数据）
+    首次运行没有水位线时 low 为 None；源表为空返回 None
+    """
+    source_table, column = FACT_WATERMARKS[fact_table]
+    cursor = db_manager.connection.cursor()
+    try:
+        cursor.execute(f"SELECT MAX({column}) FROM {source_table}")
+        high = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    if high is None:
+        return None
+    
+    watermark = get_watermark(db_manager.connection, fact_table)
+    low = None
+    if watermark:
+        low = (datetime.strptime(watermark[:10], '%Y-%m-%d') - timedelta(days=lookback_days)).strftime('%Y-%m-%d')
+    return low, str(high)
+
+
+def _resolved_fact_file(db_manager, fact_table):
+    """
+    预解析的事实表CSV：每个来源 ODS 表都由指纹一致的文件整表加载时返回文件路径，否则返回 None
+    （ODS 经直连加载、增量合并或已重新生成时，预解析结果可能与库中数据不一致，回退到 SQL 构建）
+    """
+    manifest = read_ready_manifest(RESOLVED_DIR)
+    entry = (manifest or {}).get('tables', {}).get(fact_table)
+    if not entry:
+        return None
+    csv_path = os.path.join(RESOLVED_DIR, entry['file'])
+    if not os.path.exists(csv_path):
+        return None
+    loaded = get_load_manifest(db_manager.connection, full_replace_only=True)
+    if any(loaded.get(source) != fingerprint for source, fingerprint in entry['sources'].items()):
+        return None
+    return csv_path
+
+
+def _resolved_fact_derived(fact_table):
+    """预解析事实行导入时计算的派生列 [(列名, 表达式)]，与 SQL 构建使用同一表达式"""
+    if fact_table == 'dwd_fact_order':
+        return [('profit_amount', 'final_amount - total_cost')]
+    if fact_table == 'dwd_fact_order_detail':
+        return _fact_order_detail_measures('quantity', 'amount', 'cost', '@category_l1')
+    return []
+
+
+def load_resolved_fact(db_manager, fact_table, csv_path, description):
+    """
+    LOAD DATA 直接导入预解析的事实行（CSV 表头即列名，etl_date/etl_time 在导入时填充）
+    金额派生列在 SET 中由数据库按 DECIMAL 计算，舍入与 SQL 构建一致；RESOLVED_VARIABLES 中的表头只作计算输入
+    """
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        header = f.readline().strip().split(',')
+    columns = ', '.join(f'@{col}' if col in RESOLVED_VARIABLES else f'`{col}`' for col in header)
+    derived = ''.join(f", {column} = {expr}" for column, expr in _resolved_fact_derived(fact_table))
+    sql = f"""
+    LOAD DATA LOCAL INFILE '{csv_path.replace(os.sep, '/')}'
+    INTO TABLE {fact_table}
+    CHARACTER SET utf8mb4
+    FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+    LINES TERMINATED BY '\\n'
+    IGNORE 1 LINES
+    ({columns})
+    SET etl_date = CURDATE(), etl_time = NOW(){derived}
+    """
+    return db_manager.execute_sql(sql, f"{description}（预解析键，LOAD DATA）", batch_commit=True)
+
+
+def _set_unique_checks(db_manager, enabled):
+    """
+    切换会话的 unique_checks（性能配置默认关闭）
+    关闭时 InnoDB 可能跳过二级唯一索引的重复检测，ON DUPLICATE KEY UPDATE 合并前须打开
+    """
+    cursor = db_manager.connection.cursor()
+    try:
+        cursor.execute(f"SET SESSION unique_checks = {1 if enabled else 0}")
+    finally:
+        cursor.close()
+
+
+def _build_fact_rows(db_manager, fact_table, build_insert_sql, mode, lookback_days, description,
+                     replace_window=False, chunk_key=None, stale_rows=None):
+    """
+    写入事实表数据并推进水位线
+    全量：有可用的预解析CSV时直接 LOAD DATA；否则一次 INSERT SELECT 处理全部源数据，
+          指定 chunk_key=(源表, 键列, 键表达式) 时按键范围分块提交
+    续传（resume）：分块写入从上次中断的位置继续
+    增量：只处理水位线回看窗口内的源数据，按唯一键合并（replace_window=True 时先删除窗口内旧数据再插入）
+          stale_rows(window) 为合并前删除的旧行（唯一键含 date_key 时，日期变化的行按主键合并不到旧行）；
+          删除的行所在日期记入 etl_removed_dates，DWS 增量据此重算这些日期
+    """
+    window = _incremental_window(db_manager, fact_table, lookback_days)
+    if window is None:
+        print("  源表无数据，跳过")
+        sys.stdout.flush()
+        return True
+    
+    resolved_file = _resolved_fact_file(db_manager, fact_table) if mode == 'full' else None
+    if mode == 'incremental':
+        low, high = window
+        print(f"  增量窗口: {low or '首次（全部）'} ~ {high}")
+        sys.stdout.flush()
+        if fact_table in PARTITIONED_FACTS:
+            ensure_month_partitions(db_manager.connection, fact_table, month_range(low or high, high), int_key=True)
+        if replace_window:
+            # 没有水位线时窗口覆盖全部源数据，表中已有的行须全部删除，否则会重复插入
+            condition = f" WHERE date_key >= {_date_key(low)}" if low else ''
+            record_removed_dates(
+                db_manager.connection, fact_table, f"SELECT DISTINCT date_key FROM {fact_table}{condition}"
+            )
+            if not db_manager.execute_sql(
+                f"DELETE FROM {fact_table}{condition}", "删除窗口内旧数据" if low else "无水位线，删除全部旧数据"
+            ):
+                return False
+        # 合并依赖唯一键冲突检测，连接上关闭的 unique_checks 在合并期间临时打开
+        _set_unique_checks(db_manager, True)
+        try:
+            if stale_rows:
+                alias, rows_sql = stale_rows(window)
+                record_removed_dates(
+                    db_manager.connection, fact_table, f"SELECT DISTINCT {alias}.date_key FROM {rows_sql}"
+                )
+                if not db_manager.execute_sql(
+                    f"DELETE {alias} FROM {rows_sql}", "删除日期已变化的旧行", skip_commit=True
+                ):
+                    return False
+            if not db_manager.execute_sql(
+                build_insert_sql(fact_table, window=window, upsert=not replace_window), description, batch_commit=True
+            ):
+                return False
+        finally:
+            _set_unique_checks(db_manager, False)
+    elif resolved_file:
+        if not load_resolved_fact(db_manager, fact_table, resolved_file, description):
+            return False
+    elif chunk_key:
+        source_table, key_column, key_expr = chunk_key
+        if not keyset_execute(
+            db_manager, fact_table, source_table, key_column, key_expr,
+            lambda key_filter: build_insert_sql(fact_table, key_filter=key_filter),
+            description, resume=(mode == 'resume')
+        ):
+            return False
+    else:
+        if not db_manager.execute_sql(build_insert_sql(fact_table), description, batch_commit=True):
+            return False
     
-    log("  ✓ DIM层维度表构建完成")
+    set_watermark(db_manager.connection, fact_table, FACT_WATERMARKS[fact_table][1], window[1])
     return True
 
 
-def build_fact_order(db_manager, mode='full'):
-    """构建订单事实表（极速模式：一次INSERT SELECT完成）"""
+def _fact_order_insert_sql(target_table, month=None, window=None, upsert=False, key_filter=''):
+    """订单事实表 INSERT ... SELECT（不指定 month/window 时处理全部数据；key_filter 为分块键范围）"""
+    upsert_sql = _upsert_clause(target_table, [
+        'user_id', 'store_id', 'user_key', 'store_key', 'order_status', 'payment_method',
+        'traffic_source', 'platform', 'order_time', 'total_amount', 'discount_amount',
+        'shipping_fee', 'final_amount', 'total_cost', 'profit_amount', 'etl_date', 'etl_time'
+    ]) if upsert else ''
+    return f"""
+    INSERT INTO {target_table} 
+        (order_key, order_id, user_id, store_id, user_key, store_key,
+         order_status, payment_method, traffic_source, platform, order_time,
+         total_amount, discount_amount, shipping_fee, final_amount, total_cost, profit_amount,
+         date_key, etl_date, etl_time)
+    SELECT 
+        o.order_no, o.order_id, o.user_id, o.store_id, u.user_key, s.store_key,
+        o.order_status, o.payment_method, o.traffic_source, o.platform, o.order_time,
+        o.total_amount, COALESCE(o.discount_amount, 0), COALESCE(o.shipping_fee, 0),
+        o.final_amount, COALESCE(o.total_cost, 0),
+        (o.final_amount - COALESCE(o.total_cost, 0)),
+        o.date_key,
+        CURDATE(), NOW()
+    FROM ods_orders o
+    INNER JOIN dim_user u ON o.user_no = u.user_key
+    INNER JOIN dim_store s ON o.store_no = s.store_key
+    WHERE o.order_no IS NOT NULL{_source_filter('o.date_key', month, window, int_key=True)}{key_filter}
+    {upsert_sql}
+    """
+
+
+def _fact_order_stale_rows(window):
+    """
+    窗口内重新抽取的订单若下单日期变化（date_key 不同），按 (order_key, date_key) 合并会新增一行而不是更新，
+    合并前先删除这些订单的旧日期行；返回 (表别名, FROM ... WHERE 子句)
+    """
+    return 'f', f"""
+    dwd_fact_order f
+    INNER JOIN ods_orders o ON o.order_no = f.order_key
+    WHERE f.date_key <> o.date_key{_source_filter('o.date_key', window=window, int_key=True)}
+    """
+
+
+def build_fact_order(db_manager, mode='full', months=None, lookback_days=DEFAULT_LOOKBACK_DAYS):
+    """
+    构建订单事实表（极速模式：一次INSERT SELECT完成）
+    按 date_key 月度分区；months 不为空时只重建这些月份的分区
+    增量模式按 order_time 水位线只处理新数据；重新抽取后下单日期变化的订单先删除旧日期行再合并（每个订单只保留一行）
+    """
     log("1. 订单事实表")
     
+    if months:
+        return rebuild_fact_months(db_manager, 'dwd_fact_order', _fact_order_insert_sql, months)
+    
     if mode == 'full':
         db_manager.execute_sql("DROP TABLE IF EXISTS dwd_fact_order", "删除旧表")
     
-    # 创建表结构
-    sql_create = """
+    # 创建表结构（分区表的主键必须包含分区列 date_key）
+    sql_create = f"""
     CREATE TABLE IF NOT EXISTS dwd_fact_order (
-        order_key VARCHAR(20) PRIMARY KEY,
+        order_key BIGINT NOT NULL,
         order_id VARCHAR(20),
         user_id VARCHAR(50),
         store_id VARCHAR(20),
         user_key BIGINT,
         store_key BIGINT,
-        date_key INT,
+        date_key INT NOT NULL,
         order_status VARCHAR(20),
         payment_method VARCHAR(20),
         traffic_source VARCHAR(20),
@@ -335,59 +775,103 @@ def build_fact_order(db_manager, mode='full'):
         profit_amount DECIMAL(12,2),
         etl_date DATE,
         etl_time DATETIME,
+        PRIMARY KEY (order_key, date_key),
         INDEX idx_user_key (user_key),
         INDEX idx_store_key (store_key),
         INDEX idx_date_key (date_key),
-        INDEX idx_order_id (order_id),
         INDEX idx_traffic_source (traffic_source)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    {_partition_clause(_ods_months(db_manager, 'ods_orders', 'order_time'))}
     """
     db_manager.execute_sql(sql_create, "创建表结构")
     
-    # 极速模式：一次INSERT SELECT完成所有关联（避免UPDATE）
-    sql_insert_all = """
-    INSERT INTO dwd_fact_order 
-        (order_key, order_id, user_id, store_id, user_key, store_key,
-         order_status, payment_method, traffic_source, platform, order_time,
-         total_amount, discount_amount, shipping_fee, final_amount, total_cost, profit_amount,
-         date_key, etl_date, etl_time)
-    SELECT 
-        o.order_id, o.order_id, o.user_id, o.store_id, u.user_key, s.store_key,
-        o.order_status, o.payment_method, o.traffic_source, o.platform, o.order_time,
-        o.total_amount, COALESCE(o.discount_amount, 0), COALESCE(o.shipping_fee, 0),
-        o.final_amount, COALESCE(o.total_cost, 0),
-        (o.final_amount - COALESCE(o.total_cost, 0)),
-        CAST(DATE_FORMAT(o.order_time, '%Y%m%d') AS UNSIGNED),
+    # INSERT SELECT 一次完成所有关联（避免UPDATE），全量按订单号分块提交
+    return _build_fact_rows(
+        db_manager, 'dwd_fact_order', _fact_order_insert_sql, mode, lookback_days, "插入并关联",
+        chunk_key=('ods_orders', 'order_no', 'o.order_no'), stale_rows=_fact_order_stale_rows
+    )
+
+def _fact_order_detail_measures(quantity, amount, cost, category_l1):
+    """
+    明细的派生金额列 [(列名, SQL 表达式)]：成本/利润/毛利率和费用列（规则见 config/fee_config.py）
+    SQL 构建、预解析 CSV 导入和费用重算共用，DECIMAL 运算和 ROUND 全部在数据库中完成
+    """
+    measures = [
+        ('cost_amount', f"{cost} * {quantity}"),
+        ('profit_amount', f"{amount} - {cost} * {quantity}"),
+        ('profit_margin',
+         f"CASE WHEN {amount} > 0 THEN ROUND(({amount} - {cost} * {quantity}) / {amount} * 100, 2) ELSE 0 END"),
+        ('shipping_fee', f"ROUND({shipping_fee_sql(category_l1, quantity)}, 2)"),
+    ]
+    measures += [(column, amount_fee_sql(column, amount)) for column in AMOUNT_FEE_RATES]
+    return measures
+
+
+def _fact_order_detail_insert_sql(target_table, month=None, window=None, upsert=False, key_filter=''):
+    """订单明细事实表 INSERT ... SELECT（按订单事实表的 date_key 过滤；key_filter 为分块键范围）"""
+    upsert_sql = _upsert_clause(target_table, [
+        'order_detail_id', 'order_key', 'order_id', 'product_id', 'store_id', 'user_key', 'product_key', 'store_key',
+        'quantity', 'price', 'amount', 'cost', 'cost_amount', 'profit_amount', 'profit_margin',
+        'shipping_fee', *AMOUNT_FEE_RATES, 'etl_date', 'etl_time'
+    ]) if upsert else ''
+    measures = _fact_order_detail_measures('od.quantity', 'od.amount', 'COALESCE(p.cost, 0)', 'p.category_l1')
+    # 使用STRAIGHT_JOIN强制JOIN顺序，避免优化器选择错误
+    return f"""
+    INSERT INTO {target_table} 
+        (order_detail_key, order_detail_id, order_key, order_id, product_id, store_id,
+         user_key, product_key, store_key, date_key,
+         quantity, price, amount, cost, {', '.join(column for column, _ in measures)},
+         etl_date, etl_time)
+    SELECT STRAIGHT_JOIN
+        od.order_detail_no, od.order_detail_id, o.order_key, od.order_id, od.product_id, o.store_id,
+        o.user_key, p.product_key, o.store_key, o.date_key,
+        od.quantity, od.price, od.amount, COALESCE(p.cost, 0),
+        {', '.join(expr for _, expr in measures)},
         CURDATE(), NOW()
-    FROM ods_orders o
-    INNER JOIN dim_user u ON o.user_id = u.user_id
-    INNER JOIN dim_store s ON o.store_id = s.store_id
-    WHERE o.order_id IS NOT NULL
+    FROM ods_order_details od
+    STRAIGHT_JOIN dwd_fact_order o ON od.order_no = o.order_key
+    LEFT JOIN dim_product p ON od.sku_no = p.product_key
+    WHERE od.order_detail_no IS NOT NULL{_source_filter('o.date_key', month, window, int_key=True)}{key_filter}
+    {upsert_sql}
     """
-    if not db_manager.execute_sql(sql_insert_all, "一次性插入并关联（极速）"):
-        return False
-    
-    return True
 
-def build_fact_order_detail(db_manager, mode='full'):
-    """构建订单明细事实表（极速模式：一次INSERT SELECT完成所有关联）"""
+
+def _fact_order_detail_stale_rows(window):
+    """明细的 date_key 取自所属订单：订单日期变化后，删除仍停留在旧日期的明细行（订单事实表已先完成合并）"""
+    return 'd', f"""
+    dwd_fact_order_detail d
+    INNER JOIN dwd_fact_order o ON d.order_key = o.order_key
+    WHERE d.date_key <> o.date_key{_source_filter('o.date_key', window=window, int_key=True)}
+    """
+
+
+def build_fact_order_detail(db_manager, mode='full', months=None, lookback_days=DEFAULT_LOOKBACK_DAYS):
+    """
+    构建订单明细事实表（极速模式：一次INSERT SELECT完成所有关联）
+    按 date_key 月度分区；months 不为空时只重建这些月份的分区
+    增量模式按所属订单的 order_time 水位线只处理新数据；所属订单日期变化时旧日期的明细行先删除再合并
+    """
     log("2. 订单明细事实表")
     
+    if months:
+        return rebuild_fact_months(db_manager, 'dwd_fact_order_detail', _fact_order_detail_insert_sql, months)
+    
     if mode == 'full':
         db_manager.execute_sql("DROP TABLE IF EXISTS dwd_fact_order_detail", "删除旧表")
     
-    # 创建表结构
-    sql_create = """
-    CREATE TABLE dwd_fact_order_detail (
-        order_detail_key BIGINT AUTO_INCREMENT PRIMARY KEY,
+    # 创建表结构（分区与订单事实表一致；主键为整数明细编号，用于增量合并）
+    sql_create = f"""
+    CREATE TABLE IF NOT EXISTS dwd_fact_order_detail (
+        order_detail_key BIGINT NOT NULL,
         order_detail_id VARCHAR(20),
+        order_key BIGINT,
         order_id VARCHAR(20),
         product_id VARCHAR(50),
         store_id VARCHAR(20),
         user_key BIGINT,
         product_key BIGINT,
         store_key BIGINT,
-        date_key INT,
+        date_key INT NOT NULL,
         quantity INT,
         price DECIMAL(10,2),
         amount DECIMAL(12,2),
@@ -395,14 +879,19 @@ def build_fact_order_detail(db_manager, mode='full'):
         cost_amount DECIMAL(12,2),
         profit_amount DECIMAL(12,2),
         profit_margin DECIMAL(5,2),
+        shipping_fee DECIMAL(12,2),
+        after_sale_fee DECIMAL(12,2),
+        platform_fee DECIMAL(12,2),
+        mgmt_fee DECIMAL(12,2),
         etl_date DATE,
         etl_time DATETIME,
-        INDEX idx_order_detail_id (order_detail_id),
-        INDEX idx_order_id (order_id),
+        PRIMARY KEY (order_detail_key, date_key),
+        INDEX idx_order_key (order_key),
         INDEX idx_product_key (product_key),
         INDEX idx_date_key (date_key),
         INDEX idx_store_key (store_key)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    {_partition_clause(_ods_months(db_manager, 'ods_orders', 'order_time'))}
     """
     db_manager.execute_sql(sql_create, "创建表结构")
     
@@ -412,44 +901,78 @@ def build_fact_order_detail(db_manager, mode='full'):
     print(f"  源数据: ODS明细={ods_count:,}行, 商品维度={product_count:,}个")
     sys.stdout.flush()
     
-    # 极速模式：一次INSERT SELECT完成所有关联和计算（避免UPDATE）
-    # 使用STRAIGHT_JOIN强制JOIN顺序，避免优化器选择错误
-    sql_insert_all = """
-    INSERT INTO dwd_fact_order_detail 
-        (order_detail_id, order_id, product_id, store_id,
-         user_key, product_key, store_key, date_key,
-         quantity, price, amount, cost, cost_amount, profit_amount, profit_margin,
-         etl_date, etl_time)
-    SELECT STRAIGHT_JOIN
-        od.order_detail_id, od.order_id, od.product_id, o.store_id,
-        o.user_key, p.product_key, o.store_key, o.date_key,
-        od.quantity, od.price, od.amount, COALESCE(p.cost, 0),
-        COALESCE(p.cost, 0) * od.quantity,
-        od.amount - COALESCE(p.cost, 0) * od.quantity,
-        CASE WHEN od.amount > 0 THEN ROUND((od.amount - COALESCE(p.cost, 0) * od.quantity) / od.amount * 100, 2) ELSE 0 END,
+    # INSERT SELECT 一次完成所有关联和计算（避免UPDATE），全量按订单号分块提交（同一订单的明细总在同一块）
+    return _build_fact_rows(
+        db_manager, 'dwd_fact_order_detail', _fact_order_detail_insert_sql, mode, lookback_days, "插入并关联",
+        chunk_key=('ods_order_details', 'order_no', 'od.order_no'), stale_rows=_fact_order_detail_stale_rows
+    )
+
+def recompute_fact_order_detail_fees(db_manager):
+    """
+    按当前费用配置重算订单明细的费用列（调整运费规则或费率后执行，无需重建事实表）
+    etl_time 一并刷新，下次 DWS 增量转换会重算所有受影响的日期
+    """
+    log("订单明细费用重算")
+    fees = [
+        f"d.{column} = {expr}"
+        for column, expr in _fact_order_detail_measures('d.quantity', 'd.amount', 'd.cost', 'p.category_l1')
+        if column in FEE_COLUMNS
+    ]
+    sql = f"""
+    UPDATE dwd_fact_order_detail d
+    LEFT JOIN dim_product p ON d.product_key = p.product_key
+    SET {', '.join(fees)},
+        d.etl_time = NOW()
+    """
+    return db_manager.execute_sql(sql, "按费用配置更新明细费用列")
+
+def _fact_promotion_insert_sql(target_table, month=None, window=None, upsert=False):
+    """推广事实表 INSERT ... SELECT（不指定 month/window 时处理全部数据）"""
+    upsert_sql = _upsert_clause(target_table, [
+        'store_key', 'product_key', 'channel', 'platform', 'cost', 'impressions', 'clicks',
+        'ctr', 'cpc', 'etl_date', 'etl_time'
+    ]) if upsert else ''
+    return f"""
+    INSERT INTO {target_table} 
+        (promotion_id, date_key, store_key, product_key, channel, platform, 
+         cost, impressions, clicks, ctr, cpc, etl_date, etl_time)
+    SELECT 
+        pr.promotion_id,
+        pr.date_key,
+        s.store_key,
+        p.product_key,
+        pr.channel, pr.platform, pr.cost, pr.impressions, pr.clicks,
+        CASE WHEN pr.impressions > 0 THEN ROUND(pr.clicks / pr.impressions * 100, 2) ELSE 0 END,
+        CASE WHEN pr.clicks > 0 THEN ROUND(pr.cost / pr.clicks, 2) ELSE 0 END,
         CURDATE(), NOW()
-    FROM ods_order_details od
-    STRAIGHT_JOIN dwd_fact_order o ON od.order_id = o.order_id
-    LEFT JOIN dim_product p ON od.sku_id = p.sku_id
+    FROM ods_promotion pr
+    LEFT JOIN dim_store s ON pr.store_no = s.store_key
+    LEFT JOIN dim_product p ON pr.sku_no = p.product_key
+    WHERE pr.promotion_id IS NOT NULL AND pr.date_key IS NOT NULL{_source_filter('pr.date_key', month, window, int_key=True)}
+    {upsert_sql}
     """
-    if not db_manager.execute_sql(sql_insert_all, "一次性插入并关联（极速）", batch_commit=True):
-        return False
-    
-    return True
 
-def build_fact_promotion(db_manager, mode='full'):
-    """构建推广事实表（分步处理）"""
+
+def build_fact_promotion(db_manager, mode='full', months=None, lookback_days=DEFAULT_LOOKBACK_DAYS):
+    """
+    构建推广事实表（分步处理）
+    按 date_key 月度分区；months 不为空时只重建这些月份的分区
+    增量模式按 date 水位线只处理新数据
+    """
     log("3. 推广事实表")
     
+    if months:
+        return rebuild_fact_months(db_manager, 'dwd_fact_promotion', _fact_promotion_insert_sql, months)
+    
     if mode == 'full':
         db_manager.execute_sql("DROP TABLE IF EXISTS dwd_fact_promotion", "删除旧表")
     
     # 创建表结构
-    sql_create = """
-    CREATE TABLE dwd_fact_promotion (
-        promotion_key BIGINT AUTO_INCREMENT PRIMARY KEY,
+    sql_create = f"""
+    CREATE TABLE IF NOT EXISTS dwd_fact_promotion (
+        promotion_key BIGINT AUTO_INCREMENT,
         promotion_id VARCHAR(20),
-        date_key INT,
+        date_key INT NOT NULL,
         store_key BIGINT,
         product_key BIGINT,
         channel VARCHAR(50),
@@ -461,46 +984,47 @@ def build_fact_promotion(db_manager, mode='full'):
         cpc DECIMAL(10,2),
         etl_date DATE,
         etl_time DATETIME,
+        PRIMARY KEY (promotion_key, date_key),
+        UNIQUE KEY uk_promotion (promotion_id, date_key),
         INDEX idx_date_key (date_key),
         INDEX idx_product_key (product_key),
         INDEX idx_store_key (store_key)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    {_partition_clause(_ods_months(db_manager, 'ods_promotion', 'date'))}
     """
     db_manager.execute_sql(sql_create, "创建表结构")
     
     # 一次性插入所有数据（含关联，避免UPDATE）
-    sql_insert_all = """
-    INSERT INTO dwd_fact_promotion 
-        (promotion_id, date_key, store_key, product_key, channel, platform, 
-         cost, impressions, clicks, ctr, cpc, etl_date, etl_time)
+    return _build_fact_rows(
+        db_manager, 'dwd_fact_promotion', _fact_promotion_insert_sql, mode, lookback_days, "插入推广数据（含关联）"
+    )
+
+def _fact_traffic_insert_sql(target_table, month=None, window=None, upsert=False):
+    """流量事实表 INSERT ... SELECT（店铺键在插入时直接关联；流量无业务主键，增量时先删除窗口再插入）"""
+    return f"""
+    INSERT INTO {target_table} 
+        (date_key, store_key, platform, visitors, page_views, search_traffic, recommend_traffic, 
+         direct_traffic, other_traffic, avg_stay_time, bounce_rate, etl_date, etl_time)
     SELECT 
-        pr.promotion_id,
-        CAST(DATE_FORMAT(pr.date, '%Y%m%d') AS UNSIGNED),
-        s.store_key,
-        p.product_key,
-        pr.channel, pr.platform, pr.cost, pr.impressions, pr.clicks,
-        CASE WHEN pr.impressions > 0 THEN ROUND(pr.clicks / pr.impressions * 100, 2) ELSE 0 END,
-        CASE WHEN pr.clicks > 0 THEN ROUND(pr.cost / pr.clicks, 2) ELSE 0 END,
+        t.date_key, s.store_key,
+        t.platform, t.visitors, t.page_views, t.search_traffic, t.recommend_traffic,
+        t.direct_traffic, t.other_traffic, t.avg_stay_time, t.bounce_rate,
         CURDATE(), NOW()
-    FROM ods_promotion pr
-    LEFT JOIN dim_store s ON pr.store_id = s.store_id
-    LEFT JOIN dim_product p ON pr.sku_id = p.sku_id
-    WHERE pr.promotion_id IS NOT NULL
+    FROM ods_traffic t
+    LEFT JOIN dim_store s ON t.store_no = s.store_key
+    WHERE t.date_key IS NOT NULL{_source_filter('t.date_key', month, window, int_key=True)}
     """
-    if not db_manager.execute_sql(sql_insert_all, "插入推广数据（含关联）"):
-        return False
-    
-    return True
 
-def build_fact_traffic(db_manager, mode='full'):
-    """构建流量事实表"""
+
+def build_fact_traffic(db_manager, mode='full', lookback_days=DEFAULT_LOOKBACK_DAYS):
+    """构建流量事实表（一次 INSERT SELECT 完成店铺关联；增量模式重建水位线回看窗口内的日期）"""
     log("4. 流量事实表")
     
     if mode == 'full':
         db_manager.execute_sql("DROP TABLE IF EXISTS dwd_fact_traffic", "删除旧表")
     
     sql_create = """
-    CREATE TABLE dwd_fact_traffic (
+    CREATE TABLE IF NOT EXISTS dwd_fact_traffic (
         traffic_key BIGINT AUTO_INCREMENT PRIMARY KEY,
         date_key INT,
         store_key BIGINT,
@@ -521,42 +1045,46 @@ def build_fact_traffic(db_manager, mode='full'):
     """
     db_manager.execute_sql(sql_create, "创建表结构")
     
-    # 插入基础数据
-    sql_insert = """
-    INSERT INTO dwd_fact_traffic 
-        (date_key, platform, visitors, page_views, search_traffic, recommend_traffic, 
-         direct_traffic, other_traffic, avg_stay_time, bounce_rate, etl_date, etl_time)
+    return _build_fact_rows(
+        db_manager, 'dwd_fact_traffic', _fact_traffic_insert_sql, mode, lookback_days, "插入流量数据（含关联）",
+        replace_window=True
+    )
+
+def _fact_inventory_insert_sql(target_table, month=None, window=None, upsert=False):
+    """库存事实表 INSERT ... SELECT（不指定 window 时处理全部数据）"""
+    upsert_sql = _upsert_clause(target_table, [
+        'date_key', 'product_key', 'store_key', 'stock_quantity', 'in_quantity', 'out_quantity',
+        'etl_date', 'etl_time'
+    ]) if upsert else ''
+    return f"""
+    INSERT INTO {target_table} 
+        (inventory_id, date_key, product_key, store_key, stock_quantity, in_quantity, out_quantity, etl_date, etl_time)
     SELECT 
-        CAST(DATE_FORMAT(date, '%Y%m%d') AS UNSIGNED),
-        platform, visitors, page_views, search_traffic, recommend_traffic,
-        direct_traffic, other_traffic, avg_stay_time, bounce_rate,
+        i.inventory_id,
+        i.date_key,
+        p.product_key,
+        s.store_key,
+        i.stock_quantity,
+        CASE WHEN i.change_type = '入库' THEN i.change_quantity ELSE 0 END,
+        CASE WHEN i.change_type = '出库' THEN i.change_quantity ELSE 0 END,
         CURDATE(), NOW()
-    FROM ods_traffic WHERE date IS NOT NULL
-    """
-    if not db_manager.execute_sql(sql_insert, "插入基础数据"):
-        return False
-    
-    # 关联店铺（通过临时表减少锁）
-    sql_update = """
-    UPDATE dwd_fact_traffic f
-    INNER JOIN ods_traffic t ON f.date_key = CAST(DATE_FORMAT(t.date, '%Y%m%d') AS UNSIGNED) 
-        AND f.platform = t.platform
-    INNER JOIN dim_store s ON t.store_id = s.store_id
-    SET f.store_key = s.store_key
+    FROM ods_inventory i
+    LEFT JOIN dim_product p ON i.sku_no = p.product_key
+    LEFT JOIN dim_store s ON i.store_no = s.store_key
+    WHERE i.inventory_id IS NOT NULL{_source_filter('i.date_key', month, window, int_key=True)}
+    {upsert_sql}
     """
-    db_manager.execute_sql(sql_update, "关联店铺维度")
-    
-    return True
 
-def build_fact_inventory(db_manager, mode='full'):
-    """构建库存事实表"""
+
+def build_fact_inventory(db_manager, mode='full', lookback_days=DEFAULT_LOOKBACK_DAYS):
+    """构建库存事实表（增量模式按 date 水位线只处理新数据）"""
     log("5. 库存事实表")
     
     if mode == 'full':
         db_manager.execute_sql("DROP TABLE IF EXISTS dwd_fact_inventory", "删除旧表")
     
     sql_create = """
-    CREATE TABLE dwd_fact_inventory (
+    CREATE TABLE IF NOT EXISTS dwd_fact_inventory (
         inventory_key BIGINT AUTO_INCREMENT PRIMARY KEY,
         inventory_id VARCHAR(20),
         date_key INT,
@@ -567,6 +1095,7 @@ def build_fact_inventory(db_manager, mode='full'):
         out_quantity INT DEFAULT 0,
         etl_date DATE,
         etl_time DATETIME,
+        UNIQUE KEY uk_inventory_id (inventory_id),
         INDEX idx_date_key (date_key),
         INDEX idx_product_key (product_key),
         INDEX idx_store_key (store_key)
@@ -575,31 +1104,37 @@ def build_fact_inventory(db_manager, mode='full'):
     db_manager.execute_sql(sql_create, "创建表结构")
     
     # 一次性插入所有数据（含关联，避免UPDATE）
-    sql_insert_all = """
-    INSERT INTO dwd_fact_inventory 
-        (inventory_id, date_key, product_key, store_key, stock_quantity, in_quantity, out_quantity, etl_date, etl_time)
-    SELECT 
-        i.inventory_id,
-        CAST(DATE_FORMAT(i.date, '%Y%m%d') AS UNSIGNED),
-        p.product_key,
-        s.store_key,
-        i.stock_quantity,
-        CASE WHEN i.change_type = '入库' THEN i.change_quantity ELSE 0 END,
-        CASE WHEN i.change_type = '出库' THEN i.change_quantity ELSE 0 END,
-        CURDATE(), NOW()
-    FROM ods_inventory i
-    LEFT JOIN dim_product p ON i.sku_id = p.sku_id
-    LEFT JOIN dim_store s ON i.store_id = s.store_id
-    WHERE i.inventory_id IS NOT NULL
-    """
-    if not db_manager.execute_sql(sql_insert_all, "插入库存数据（含关联）"):
-        return False
-    
-    return True
+    return _build_fact_rows(
+        db_manager, 'dwd_fact_inventory', _fact_inventory_insert_sql, mode, lookback_days, "插入库存数据（含关联）"
+    )
 
 
-def transform_dwd(mode='full', db_config=None):
-    """转换DWD层数据"""
+def _on_own_connection(db_config, build, *args, **kwargs):
+    """包装为在独立连接上执行的无参函数（并发的 DAG 节点之间不共享连接）"""
+    def run():
+        manager = DatabaseManager(db_config)
+        if not manager.connect():
+            return False
+        try:
+            manager.optimize_for_performance(enable_global=False)
+            return build(manager, *args, **kwargs)
+        finally:
+            manager.close()
+    return run
+
+
+def transform_dwd(mode='full', db_config=None, months=None, retention_months=None,
+                  lookback_days=DEFAULT_LOOKBACK_DAYS, parallelism=DEFAULT_PARALLELISM):
+    """
+    转换DWD层数据
+    mode: 'full' 全量重建（维度表不删表，原地合并并删除源表已不存在的成员）；
+          'incremental' 按各事实表的水位线只处理新数据（回看 lookback_days 天）；
+          'resume' 续传上次中断的全量构建（分块写入的订单/明细从断点继续，其余事实表重建）；
+          'fees' 只按费用配置重算订单明细的费用列
+    months: 分区级重建的月份（如 ['2024-03']），只重建分区事实表的这些月份，维度表保持不变
+    retention_months: 分区事实表保留的月数，超出的旧分区被删除
+    parallelism: 互不依赖的维度/事实表构建的最大并发数
+    """
     global _start_time
     _start_time = time.time()
     
@@ -614,28 +1149,57 @@ def transform_dwd(mode='full', db_config=None):
         return False
     
     try:
-        # 第一步：构建DIM层维度表
-        if not build_dim_tables(db_manager, mode):
-            return False
+        ensure_control_tables(db_manager.connection)
         
-        # 第二步：构建事实表（分步处理）
-        log("【构建DWD事实表】")
+        if mode == 'fees':
+            return recompute_fact_order_detail_fees(db_manager)
         
-        if not build_fact_order(db_manager, mode):
-            return False
+        if months:
+            months = [month_start(month) for month in months]
+            log(f"【分区级重建】{', '.join(f'{month:%Y-%m}' for month in months)}")
+            if not build_fact_order(db_manager, mode, months):
+                return False
+            if not build_fact_order_detail(db_manager, mode, months):
+                return False
+            if not build_fact_promotion(db_manager, mode, months):
+                return False
+            log("  ✓ 分区重建完成")
+            return True
         
-        if not build_fact_order_detail(db_manager, mode):
-            return False
+        if mode == 'full':
+            # 全量构建开始前清除上次留下的分块进度，之后的续传不会跳过本次尚未重建的事实表
+            for job_name in CHUNKED_FACT_TABLES:
+                clear_chunk_progress(db_manager.connection, job_name)
         
-        if not build_fact_promotion(db_manager, mode):
-            return False
+        # 续传时维度按行哈希只合并新增/变化的成员（代理键保持不变），未分块的事实表直接重建
+        dim_mode = 'incremental' if mode == 'resume' else mode
+        rebuild_mode = 'full' if mode == 'resume' else mode
         
-        if not build_fact_traffic(db_manager, mode):
-            return False
+        # 按依赖并发构建维度表和事实表，每个节点使用独立连接
+        builds = {
+            'dim_date': (build_dim_date, (dim_mode,), {}),
+            'dim_user': (build_dim_user, (dim_mode,), {}),
+            'dim_product': (build_dim_product, (dim_mode,), {}),
+            'dim_store': (build_dim_store, (dim_mode,), {}),
+            'fact_order': (build_fact_order, (mode,), {'lookback_days': lookback_days}),
+            'fact_order_detail': (build_fact_order_detail, (mode,), {'lookback_days': lookback_days}),
+            'fact_promotion': (build_fact_promotion, (rebuild_mode,), {'lookback_days': lookback_days}),
+            'fact_traffic': (build_fact_traffic, (rebuild_mode, lookback_days), {}),
+            'fact_inventory': (build_fact_inventory, (rebuild_mode, lookback_days), {}),
+        }
+        tasks = {
+            name: (_on_own_connection(db_config, build, *args, **kwargs), DWD_DEPENDENCIES[name])
+            for name, (build, args, kwargs) in builds.items()
+        }
         
-        if not build_fact_inventory(db_manager, mode):
+        log(f"【构建DIM层维度表与DWD事实表】DAG 并发数: {parallelism}")
+        success, _ = run_dag(tasks, max_workers=parallelism)
+        if not success:
             return False
         
+        if retention_months:
+            apply_fact_retention(db_manager, retention_months)
+        
         total_elapsed = time.time() - _start_time
         print("\n" + "="*60)
         print(f"[{datetime.now().strftime('%H:%M:%S')}] ✓ DWD层转换完成！")
@@ -676,10 +1240,14 @@ def main():
     })
     
     mode = config.get('mode', 'full')
-    print(f"模式: {'全量' if mode == 'full' else '增量'}")
+    months = config.get('months')
+    retention_months = config.get('retentionMonths')
+    lookback_days = config.get('lookbackDays', DEFAULT_LOOKBACK_DAYS)
+    parallelism = config.get('parallelism', DEFAULT_PARALLELISM)
+    print(f"模式: {MODE_LABELS.get(mode, mode)}")
     
     try:
-        success = transform_dwd(mode, db_config)
+        success = transform_dwd(mode, db_config, months, retention_months, lookback_days, parallelism)
         if not success:
             sys.exit(1)
     except KeyboardInterrupt:
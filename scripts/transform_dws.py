@@ -2,14 +2,49 @@
 DWS层转换 - 汇总数据层
 按主题域组织：交易域、用户域、流量域、营销域
 支持千万级数据
+
+日汇总表按粒度建主键；增量模式只重算上次运行以来 DWD 有变化的 date_key，
+总汇总表只重算受影响的店铺/商品/类目/用户
+去重计数以 HyperLogLog 草图保存在日汇总行上，上卷时合并草图
 """
 import sys
 import json
 import signal
 import atexit
+from datetime import date, timedelta
+
+import pandas as pd
 
 # 导入数据库管理器
 from db_manager import get_db_manager, cleanup_global_db_manager
+from etl_control import (
+    ensure_control_tables, get_watermark, set_watermark, clear_watermark,
+    get_removed_dates, record_pending_dates, purge_removed_dates, ensure_column
+)
+from hll import HyperLogLog, group_sketches
+from parallel_aggregate import run_sliced_insert
+
+
+# 成交口径
+PAID_STATUSES = "('已完成', '已发货')"
+
+# DWS 增量水位线：记录上次运行开始时的数据库时间，DWD 中 etl_time 不早于它的行视为有变化
+# （此后删除过行的日期见 etl_removed_dates，属性变化的维度成员见维度表的 etl_time）
+DWS_WATERMARK = 'dws_layer'
+
+# IN 列表每批的键数
+KEY_BATCH_SIZE = 5000
+
+# 构建日草图时每批抽取的天数
+SKETCH_DATE_BATCH = 7
+
+# 日汇总默认并行切片数（每片占用一个数据库连接）
+DEFAULT_PARALLELISM = 4
+
+MODE_LABELS = {
+    'full': '全量',
+    'incremental': '增量',
+}
 
 
 def signal_handler(signum, frame):
@@ -19,232 +54,1226 @@ def signal_handler(signum, frame):
     sys.exit(1)
 
 
-def transform_dws(mode='full', db_config=None):
-    """转换DWS层数据 - 支持千万级数据"""
+# ========== 表结构 ==========
+
+SQL_CREATE_TABLES = {
+    'dws_paid_order_line': """
+    CREATE TABLE IF NOT EXISTS dws_paid_order_line (
+        date_key INT NOT NULL,
+        order_detail_key BIGINT NOT NULL,
+        order_key BIGINT NOT NULL,
+        user_key BIGINT,
+        store_key BIGINT,
+        product_key BIGINT,
+        platform VARCHAR(20),
+        traffic_source VARCHAR(20),
+        date_value DATE,
+        store_name VARCHAR(100),
+        product_id VARCHAR(50),
+        sku_id VARCHAR(100),
+        product_name VARCHAR(200),
+        spec VARCHAR(100),
+        category_l1 VARCHAR(50),
+        category_l2 VARCHAR(50),
+        quantity INT,
+        amount DECIMAL(12,2),
+        cost_amount DECIMAL(12,2),
+        profit_amount DECIMAL(12,2),
+        shipping_fee DECIMAL(12,2),
+        after_sale_fee DECIMAL(12,2),
+        platform_fee DECIMAL(12,2),
+        mgmt_fee DECIMAL(12,2),
+        etl_time DATETIME,
+        PRIMARY KEY (date_key, order_detail_key),
+        INDEX idx_date_store_product (date_key, store_key, product_key),
+        INDEX idx_product_key (product_key),
+        INDEX idx_category (category_l1, category_l2)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_trade_order_1d': """
+    CREATE TABLE IF NOT EXISTS dws_trade_order_1d (
+        date_key INT NOT NULL,
+        store_key BIGINT NOT NULL,
+        platform VARCHAR(20) NOT NULL,
+        order_count INT,
+        order_user_count INT,
+        order_amount DECIMAL(16,2),
+        payment_count INT,
+        payment_amount DECIMAL(16,2),
+        cost_amount DECIMAL(16,2),
+        profit_amount DECIMAL(16,2),
+        avg_order_amount DECIMAL(12,2),
+        etl_date DATE,
+        PRIMARY KEY (date_key, store_key, platform),
+        INDEX idx_store_key (store_key)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_trade_product_1d': """
+    CREATE TABLE IF NOT EXISTS dws_trade_product_1d (
+        date_key INT NOT NULL,
+        product_key BIGINT NOT NULL,
+        store_key BIGINT,
+        platform VARCHAR(20),
+        order_count INT,
+        sales_quantity INT,
+        sales_amount DECIMAL(16,2),
+        cost_amount DECIMAL(16,2),
+        profit_amount DECIMAL(16,2),
+        shipping_fee DECIMAL(16,2),
+        after_sale_fee DECIMAL(16,2),
+        platform_fee DECIMAL(16,2),
+        mgmt_fee DECIMAL(16,2),
+        buyer_count INT,
+        buyer_sketch BLOB,
+        order_sketch BLOB,
+        etl_date DATE,
+        PRIMARY KEY (date_key, product_key),
+        INDEX idx_product_key (product_key)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_store_daily': """
+    CREATE TABLE IF NOT EXISTS dws_store_daily (
+        date_key INT NOT NULL,
+        store_key BIGINT NOT NULL,
+        order_count INT,
+        user_count INT,
+        sales_amount DECIMAL(16,2),
+        cost_amount DECIMAL(16,2),
+        profit_amount DECIMAL(16,2),
+        profit_rate DECIMAL(10,2),
+        user_sketch BLOB,
+        PRIMARY KEY (date_key, store_key),
+        INDEX idx_store_key (store_key)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_promotion_daily': """
+    CREATE TABLE IF NOT EXISTS dws_promotion_daily (
+        date_key INT NOT NULL,
+        channel VARCHAR(50) NOT NULL,
+        platform VARCHAR(20) NOT NULL,
+        cost DECIMAL(16,2),
+        impressions BIGINT,
+        clicks BIGINT,
+        click_rate DECIMAL(10,2),
+        avg_click_cost DECIMAL(10,2),
+        PRIMARY KEY (date_key, channel, platform)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_traffic_daily': """
+    CREATE TABLE IF NOT EXISTS dws_traffic_daily (
+        date_key INT NOT NULL,
+        store_key BIGINT NOT NULL,
+        platform VARCHAR(20) NOT NULL,
+        visitors INT,
+        page_views INT,
+        avg_stay_time DECIMAL(10,2),
+        bounce_rate DECIMAL(5,2),
+        conversion_rate DECIMAL(10,2),
+        PRIMARY KEY (date_key, store_key, platform),
+        INDEX idx_store_key (store_key)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_store_monthly': """
+    CREATE TABLE IF NOT EXISTS dws_store_monthly (
+        month_key INT NOT NULL,
+        store_key BIGINT NOT NULL,
+        order_count INT,
+        user_count INT,
+        sales_amount DECIMAL(16,2),
+        cost_amount DECIMAL(16,2),
+        profit_amount DECIMAL(16,2),
+        profit_rate DECIMAL(10,2),
+        user_sketch BLOB,
+        PRIMARY KEY (month_key, store_key),
+        INDEX idx_store_key (store_key)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_product_monthly': """
+    CREATE TABLE IF NOT EXISTS dws_product_monthly (
+        month_key INT NOT NULL,
+        product_key BIGINT NOT NULL,
+        order_count INT,
+        sales_quantity INT,
+        sales_amount DECIMAL(16,2),
+        cost_amount DECIMAL(16,2),
+        profit_amount DECIMAL(16,2),
+        profit_rate DECIMAL(10,2),
+        buyer_count INT,
+        buyer_sketch BLOB,
+        order_sketch BLOB,
+        PRIMARY KEY (month_key, product_key),
+        INDEX idx_product_key (product_key)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_store_total': """
+    CREATE TABLE IF NOT EXISTS dws_store_total (
+        store_key BIGINT NOT NULL PRIMARY KEY,
+        store_id VARCHAR(20),
+        store_name VARCHAR(100),
+        platform VARCHAR(20),
+        order_count INT,
+        user_count INT,
+        sales_amount DECIMAL(16,2),
+        cost_amount DECIMAL(16,2),
+        profit_amount DECIMAL(16,2),
+        profit_rate DECIMAL(10,2),
+        avg_order_amount DECIMAL(12,2),
+        user_sketch BLOB
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_product_total': """
+    CREATE TABLE IF NOT EXISTS dws_product_total (
+        product_key BIGINT NOT NULL PRIMARY KEY,
+        product_id VARCHAR(50),
+        product_name VARCHAR(200),
+        category_l1 VARCHAR(50),
+        category_l2 VARCHAR(50),
+        platform VARCHAR(20),
+        order_count INT,
+        sales_quantity INT,
+        sales_amount DECIMAL(16,2),
+        cost_amount DECIMAL(16,2),
+        profit_amount DECIMAL(16,2),
+        profit_rate DECIMAL(10,2),
+        buyer_count INT,
+        buyer_sketch BLOB,
+        order_sketch BLOB,
+        INDEX idx_product_id (product_id, platform),
+        INDEX idx_category (category_l1, category_l2)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_spu_total': """
+    CREATE TABLE IF NOT EXISTS dws_spu_total (
+        product_id VARCHAR(50) NOT NULL,
+        platform VARCHAR(20) NOT NULL,
+        category_l1 VARCHAR(50),
+        category_l2 VARCHAR(50),
+        order_count INT,
+        sales_quantity INT,
+        sales_amount DECIMAL(16,2),
+        cost_amount DECIMAL(16,2),
+        profit_amount DECIMAL(16,2),
+        profit_rate DECIMAL(10,2),
+        order_sketch BLOB,
+        PRIMARY KEY (product_id, platform),
+        INDEX idx_category (category_l1, category_l2)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_category_total': """
+    CREATE TABLE IF NOT EXISTS dws_category_total (
+        category_l1 VARCHAR(50) NOT NULL,
+        category_l2 VARCHAR(50) NOT NULL,
+        platform VARCHAR(20) NOT NULL,
+        order_count INT,
+        sales_quantity INT,
+        sales_amount DECIMAL(16,2),
+        profit_amount DECIMAL(16,2),
+        profit_rate DECIMAL(10,2),
+        order_sketch BLOB,
+        PRIMARY KEY (category_l1, category_l2, platform)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'dws_user_total': """
+    CREATE TABLE IF NOT EXISTS dws_user_total (
+        user_key BIGINT NOT NULL PRIMARY KEY,
+        user_id VARCHAR(50),
+        gender VARCHAR(10),
+        age INT,
+        age_group VARCHAR(20),
+        city VARCHAR(50),
+        order_count INT,
+        total_amount DECIMAL(16,2),
+        avg_order_amount DECIMAL(12,2),
+        first_order_date DATETIME,
+        last_order_date DATETIME,
+        user_level VARCHAR(10),
+        INDEX idx_user_level (user_level)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+}
+
+# 建表语句中后来新增的列：增量模式不重建表，早期版本建的表在这里补上
+ADDED_COLUMNS = {
+    'dws_paid_order_line': [('etl_time', 'etl_time DATETIME')],
+}
+
+
+# ========== 日汇总（date_filter(列) 返回该列的 date_key 过滤条件，以 AND 开头） ==========
+
+def _sql_paid_order_line(date_filter):
+    """
+    成交订单明细宽表：订单明细 ⨝ 订单（成交口径）⨝ 日期/店铺/商品维度只关联一次
+    商品日汇总、类目汇总和 ADS 的销售统计都从这里读取，不再各自重复两张最大事实表的关联
+    etl_time 为写入时间，ADS 中间表据此找出重算过的日期
+    """
+    return f"""
+    INSERT INTO dws_paid_order_line
+        (date_key, order_detail_key, order_key, user_key, store_key, product_key, platform, traffic_source,
+         date_value, store_name, product_id, sku_id, product_name, spec, category_l1, category_l2,
+         quantity, amount, cost_amount, profit_amount, shipping_fee, after_sale_fee, platform_fee, mgmt_fee,
+         etl_time)
+    SELECT
+        fd.date_key, fd.order_detail_key, fd.order_key, f.user_key, f.store_key, fd.product_key,
+        f.platform, f.traffic_source,
+        d.date_value, s.store_name, p.product_id, p.sku_id, p.product_name, p.spec, p.category_l1, p.category_l2,
+        fd.quantity, fd.amount, fd.cost_amount, fd.profit_amount,
+        fd.shipping_fee, fd.after_sale_fee, fd.platform_fee, fd.mgmt_fee,
+        NOW()
+    FROM dwd_fact_order_detail fd
+    INNER JOIN dwd_fact_order f ON fd.order_key = f.order_key AND fd.date_key = f.date_key
+    LEFT JOIN dim_date d ON fd.date_key = d.date_key
+    LEFT JOIN dim_store s ON f.store_key = s.store_key
+    LEFT JOIN dim_product p ON fd.product_key = p.product_key
+    WHERE f.order_status IN {PAID_STATUSES}{date_filter('fd.date_key')}
+    ORDER BY fd.date_key, fd.order_detail_key
+    """
+
+
+def _sql_trade_order_1d(date_filter):
+    return f"""
+    INSERT INTO dws_trade_order_1d
+        (date_key, store_key, platform, order_count, order_user_count, order_amount, payment_count,
+         payment_amount, cost_amount, profit_amount, avg_order_amount, etl_date)
+    SELECT
+        f.date_key, f.store_key, COALESCE(f.platform, ''),
+        COUNT(DISTINCT f.order_key),
+        COUNT(DISTINCT f.user_key),
+        SUM(f.final_amount),
+        COUNT(DISTINCT CASE WHEN f.order_status IN {PAID_STATUSES} THEN f.order_key END),
+        SUM(CASE WHEN f.order_status IN {PAID_STATUSES} THEN f.final_amount ELSE 0 END),
+        SUM(CASE WHEN f.order_status IN {PAID_STATUSES} THEN f.total_cost ELSE 0 END),
+        SUM(CASE WHEN f.order_status IN {PAID_STATUSES} THEN f.profit_amount ELSE 0 END),
+        ROUND(AVG(CASE WHEN f.order_status IN {PAID_STATUSES} THEN f.final_amount END), 2),
+        CURDATE()
+    FROM dwd_fact_order f
+    WHERE 1 = 1{date_filter('f.date_key')}
+    GROUP BY f.date_key, f.store_key, COALESCE(f.platform, '')
+    ORDER BY f.date_key, f.store_key, COALESCE(f.platform, '')
+    """
+
+
+def _sql_trade_product_1d(date_filter):
+    return f"""
+    INSERT INTO dws_trade_product_1d
+        (date_key, product_key, store_key, platform, order_count, sales_quantity, sales_amount, cost_amount,
+         profit_amount, shipping_fee, after_sale_fee, platform_fee, mgmt_fee, buyer_count, etl_date)
+    SELECT
+        l.date_key, COALESCE(l.product_key, 0),
+        MAX(l.store_key),
+        MAX(l.platform),
+        COUNT(DISTINCT l.order_key),
+        SUM(l.quantity),
+        SUM(l.amount),
+        SUM(l.cost_amount),
+        SUM(l.profit_amount),
+        SUM(l.shipping_fee),
+        SUM(l.after_sale_fee),
+        SUM(l.platform_fee),
+        SUM(l.mgmt_fee),
+        COUNT(DISTINCT l.user_key),
+        CURDATE()
+    FROM dws_paid_order_line l
+    WHERE 1 = 1{date_filter('l.date_key')}
+    GROUP BY l.date_key, COALESCE(l.product_key, 0)
+    ORDER BY l.date_key, COALESCE(l.product_key, 0)
+    """
+
+
+def _sql_store_daily(date_filter):
+    return f"""
+    INSERT INTO dws_store_daily
+        (date_key, store_key, order_count, user_count, sales_amount, cost_amount, profit_amount, profit_rate)
+    SELECT
+        f.date_key, f.store_key,
+        COUNT(DISTINCT f.order_key),
+        COUNT(DISTINCT f.user_key),
+        SUM(f.final_amount),
+        SUM(f.total_cost),
+        SUM(f.profit_amount),
+        CASE WHEN SUM(f.final_amount) > 0 THEN ROUND(SUM(f.profit_amount) / SUM(f.final_amount) * 100, 2) ELSE 0 END
+    FROM dwd_fact_order f
+    WHERE f.order_status IN {PAID_STATUSES}{date_filter('f.date_key')}
+    GROUP BY f.date_key, f.store_key
+    ORDER BY f.date_key, f.store_key
+    """
+
+
+def _sql_promotion_daily(date_filter):
+    return f"""
+    INSERT INTO dws_promotion_daily
+        (date_key, channel, platform, cost, impressions, clicks, click_rate, avg_click_cost)
+    SELECT
+        fp.date_key, COALESCE(fp.channel, ''), COALESCE(fp.platform, ''),
+        SUM(fp.cost),
+        SUM(fp.impressions),
+        SUM(fp.clicks),
+        CASE WHEN SUM(fp.impressions) > 0 THEN ROUND(SUM(fp.clicks) / SUM(fp.impressions) * 100, 2) ELSE 0 END,
+        CASE WHEN SUM(fp.clicks) > 0 THEN ROUND(SUM(fp.cost) / SUM(fp.clicks), 2) ELSE 0 END
+    FROM dwd_fact_promotion fp
+    WHERE 1 = 1{date_filter('fp.date_key')}
+    GROUP BY fp.date_key, COALESCE(fp.channel, ''), COALESCE(fp.platform, '')
+    ORDER BY fp.date_key, COALESCE(fp.channel, ''), COALESCE(fp.platform, '')
+    """
+
+
+def _sql_traffic_daily(date_filter):
+    return f"""
+    INSERT INTO dws_traffic_daily
+        (date_key, store_key, platform, visitors, page_views, avg_stay_time, bounce_rate, conversion_rate)
+    SELECT
+        ft.date_key, COALESCE(ft.store_key, 0), COALESCE(ft.platform, ''),
+        SUM(ft.visitors), SUM(ft.page_views),
+        ROUND(AVG(ft.avg_stay_time), 2), ROUND(AVG(ft.bounce_rate), 2),
+        CASE WHEN SUM(ft.visitors) > 0 THEN ROUND(COALESCE(MAX(o.order_cnt), 0) / SUM(ft.visitors) * 100, 2) ELSE 0 END
+    FROM dwd_fact_traffic ft
+    LEFT JOIN (
+        SELECT date_key, store_key, COUNT(DISTINCT order_key) AS order_cnt
+        FROM dwd_fact_order
+        WHERE order_status IN {PAID_STATUSES}{date_filter('date_key')}
+        GROUP BY date_key, store_key
+    ) o ON ft.date_key = o.date_key AND ft.store_key = o.store_key
+    WHERE ft.date_key IS NOT NULL{date_filter('ft.date_key')}
+    GROUP BY ft.date_key, COALESCE(ft.store_key, 0), COALESCE(ft.platform, '')
+    ORDER BY ft.date_key, COALESCE(ft.store_key, 0), COALESCE(ft.platform, '')
+    """
+
+
+# 日汇总表：(标题, 生成 INSERT 的函数, 数据来源的 DWD 事实表)，按顺序执行（成交明细宽表须最先刷新）
+DAILY_TABLES = {
+    'dws_paid_order_line': ('成交订单明细宽表', _sql_paid_order_line, ['dwd_fact_order', 'dwd_fact_order_detail']),
+    'dws_trade_order_1d': ('订单日汇总表', _sql_trade_order_1d, ['dwd_fact_order']),
+    'dws_trade_product_1d': ('商品日汇总表', _sql_trade_product_1d, ['dwd_fact_order', 'dwd_fact_order_detail']),
+    'dws_store_daily': ('店铺日汇总表', _sql_store_daily, ['dwd_fact_order']),
+    'dws_promotion_daily': ('推广日汇总表', _sql_promotion_daily, ['dwd_fact_promotion']),
+    'dws_traffic_daily': ('流量日汇总表', _sql_traffic_daily, ['dwd_fact_traffic', 'dwd_fact_order']),
+}
+
+# 日汇总中冗余的维度属性 (维度表, 键列)：维度成员变化（SCD1 原地更新）时，引用它们的日期须重算
+DAILY_DIMENSIONS = {
+    'dws_paid_order_line': [('dim_store', 'store_key'), ('dim_product', 'product_key')],
+}
+
+# 日汇总草图：从明细抽取 (分组键..., 去重对象...)，在 Python 中按天构建 HyperLogLog 后写回日汇总行
+DAILY_SKETCHES = {
+    'dws_store_daily': {
+        'extract': lambda date_filter: f"""
+            SELECT date_key, store_key, user_key FROM dwd_fact_order
+            WHERE order_status IN {PAID_STATUSES}{date_filter('date_key')}
+        """,
+        'keys': ['date_key', 'store_key'],
+        'sketches': [('user_sketch', 'user_key')],
+    },
+    'dws_trade_product_1d': {
+        'extract': lambda date_filter: f"""
+            SELECT date_key, COALESCE(product_key, 0), user_key, order_key FROM dws_paid_order_line
+            WHERE 1 = 1{date_filter('date_key')}
+        """,
+        'keys': ['date_key', 'product_key'],
+        'sketches': [('buyer_sketch', 'user_key'), ('order_sketch', 'order_key')],
+    },
+}
+
+
+# ========== 上卷汇总 ==========
+# 由细粒度汇总表推导粗粒度汇总表：时间 日 → 月 → 总计，商品 SKU → SPU → 类目
+# sums 为可加指标，直接 SUM；ratios 为比率，由上卷后的可加指标重新计算
+# sketches 为不可加的去重计数（跨天/跨 SKU 会重复计数）：合并下层的 HyperLogLog 草图，
+# (草图列, 计数列)，计数列为 None 时只保存草图供更上层合并
+
+PROFIT_RATE = "CASE WHEN r.sales_amount > 0 THEN ROUND(r.profit_amount / r.sales_amount * 100, 2) ELSE 0 END"
+
+ROLLUPS = {
+    'dws_store_monthly': {
+        'title': '店铺月汇总表',
+        'source': 'dws_store_daily d',
+        'keys': [('month_key', 'd.date_key DIV 100'), ('store_key', 'd.store_key')],
+        'sums': ['order_count', 'sales_amount', 'cost_amount', 'profit_amount'],
+        'ratios': [('profit_rate', PROFIT_RATE)],
+        'sketches': [('user_sketch', 'user_count')],
+        # (刷新键, 源表过滤列)；month_key 按所含日期范围过滤
+        'refresh': ('month_key', 'd.date_key'),
+        'facts': ['dwd_fact_order'],
+    },
+    'dws_store_total': {
+        'title': '店铺总汇总表',
+        'source': 'dws_store_monthly m',
+        'keys': [('store_key', 'm.store_key')],
+        'joins': "LEFT JOIN dim_store s ON r.store_key = s.store_key",
+        'attributes': [('store_id', 's.store_id'), ('store_name', 's.store_name'), ('platform', 's.platform')],
+        'sums': ['order_count', 'sales_amount', 'cost_amount', 'profit_amount'],
+        'ratios': [
+            ('profit_rate', PROFIT_RATE),
+            ('avg_order_amount', "CASE WHEN r.order_count > 0 THEN ROUND(r.sales_amount / r.order_count, 2) ELSE 0 END"),
+        ],
+        'sketches': [('user_sketch', 'user_count')],
+        'refresh': ('store_key', 'm.store_key'),
+        'affected': (
+            "SELECT DISTINCT store_key FROM dwd_fact_order WHERE etl_time >= {since} "
+            "UNION SELECT store_key FROM dim_store WHERE etl_time >= {since}"
+        ),
+    },
+    'dws_product_monthly': {
+        'title': '商品月汇总表',
+        'source': 'dws_trade_product_1d d',
+        'keys': [('month_key', 'd.date_key DIV 100'), ('product_key', 'd.product_key')],
+        # 一个订单只属于一天，单个 SKU 的订单数跨天可加
+        'sums': ['order_count', 'sales_quantity', 'sales_amount', 'cost_amount', 'profit_amount'],
+        'ratios': [('profit_rate', PROFIT_RATE)],
+        'sketches': [('buyer_sketch', 'buyer_count'), ('order_sketch', None)],
+        'refresh': ('month_key', 'd.date_key'),
+        'facts': ['dwd_fact_order', 'dwd_fact_order_detail'],
+    },
+    'dws_product_total': {
+        'title': '商品总汇总表',
+        'source': 'dws_product_monthly m',
+        'keys': [('product_key', 'm.product_key')],
+        'joins': "LEFT JOIN dim_product p ON r.product_key = p.product_key",
+        'attributes': [
+            ('product_id', 'p.product_id'), ('product_name', 'p.product_name'),
+            ('category_l1', 'p.category_l1'), ('category_l2', 'p.category_l2'), ('platform', 'p.platform'),
+        ],
+        'sums': ['order_count', 'sales_quantity', 'sales_amount', 'cost_amount', 'profit_amount'],
+        'ratios': [('profit_rate', PROFIT_RATE)],
+        'sketches': [('buyer_sketch', 'buyer_count'), ('order_sketch', None)],
+        'refresh': ('product_key', 'm.product_key'),
+        'affected': (
+            "SELECT DISTINCT COALESCE(product_key, 0) FROM dwd_fact_order_detail WHERE etl_time >= {since} "
+            "UNION SELECT product_key FROM dim_product WHERE etl_time >= {since}"
+        ),
+    },
+    'dws_spu_total': {
+        'title': 'SPU总汇总表',
+        'source': 'dws_product_total t',
+        'keys': [('product_id', "COALESCE(t.product_id, '')"), ('platform', "COALESCE(t.platform, '')")],
+        'carry': [('category_l1', 'MAX(t.category_l1)'), ('category_l2', 'MAX(t.category_l2)')],
+        'sums': ['sales_quantity', 'sales_amount', 'cost_amount', 'profit_amount'],
+        'ratios': [('profit_rate', PROFIT_RATE)],
+        # 同一订单可能包含同一 SPU 的多个 SKU，订单数跨 SKU 不可加
+        'sketches': [('order_sketch', 'order_count')],
+        'refresh': ('product_id', "COALESCE(t.product_id, '')"),
+        'affected': (
+            "SELECT DISTINCT COALESCE(p.product_id, '') FROM dwd_fact_order_detail fd "
+            "LEFT JOIN dim_product p ON fd.product_key = p.product_key WHERE fd.etl_time >= {since} "
+            "UNION SELECT COALESCE(product_id, '') FROM dim_product WHERE etl_time >= {since} "
+            "UNION SELECT COALESCE(t.product_id, '') FROM dws_product_total t "
+            "INNER JOIN dim_product p ON t.product_key = p.product_key WHERE p.etl_time >= {since}"
+        ),
+    },
+    'dws_category_total': {
+        'title': '类目总汇总表',
+        'source': 'dws_spu_total t',
+        'keys': [
+            ('category_l1', "COALESCE(t.category_l1, '')"), ('category_l2', "COALESCE(t.category_l2, '')"),
+            ('platform', 't.platform'),
+        ],
+        'sums': ['sales_quantity', 'sales_amount', 'profit_amount'],
+        'ratios': [('profit_rate', PROFIT_RATE)],
+        'sketches': [('order_sketch', 'order_count')],
+        'refresh': ('category_l1', "COALESCE(t.category_l1, '')"),
+        'affected': (
+            "SELECT DISTINCT COALESCE(p.category_l1, '') FROM dwd_fact_order_detail fd "
+            "LEFT JOIN dim_product p ON fd.product_key = p.product_key WHERE fd.etl_time >= {since} "
+            "UNION SELECT COALESCE(category_l1, '') FROM dim_product WHERE etl_time >= {since} "
+            "UNION SELECT COALESCE(t.category_l1, '') FROM dws_product_total t "
+            "INNER JOIN dim_product p ON t.product_key = p.product_key WHERE p.etl_time >= {since}"
+        ),
+    },
+}
+
+
+def rollup_sql(table_name, spec, source_filter=''):
+    """
+    生成上卷 INSERT：先在源表按目标粒度 SUM 可加指标，再关联维度属性、计算比率
+    去重计数由 merge_rollup_sketches 随后写入
+
+    Args:
+        source_filter: 源表过滤条件（以 AND 开头）
+    """
+    keys = spec['keys']
+    carry = spec.get('carry', [])
+    attributes = spec.get('attributes', [])
+    ratios = spec.get('ratios', [])
+
+    inner = [f"{expr} AS {name}" for name, expr in keys + carry]
+    inner += [f"SUM({name}) AS {name}" for name in spec['sums']]
+
+    columns = [name for name, _ in keys + attributes + carry] + spec['sums'] + [name for name, _ in ratios]
+    select = [f"r.{name}" for name, _ in keys] + [expr for _, expr in attributes]
+    select += [f"r.{name}" for name, _ in carry] + [f"r.{name}" for name in spec['sums']]
+    select += [expr for _, expr in ratios]
+
+    return f"""
+    INSERT INTO {table_name} ({', '.join(columns)})
+    SELECT {', '.join(select)}
+    FROM (
+        SELECT {', '.join(inner)}
+        FROM {spec['source']}
+        WHERE 1 = 1{source_filter}
+        GROUP BY {', '.join(expr for _, expr in keys)}
+    ) r
+    {spec.get('joins', '')}
+    ORDER BY {', '.join(f"r.{name}" for name, _ in keys)}
+    """
+
+
+# ========== 滑动窗口 ==========
+# dws_*_7d / dws_*_30d：截至最新日期的近 N 天汇总，每个实体一行
+# 窗口前移时加上新进入的天、减去移出的天（可加指标），去重计数合并窗口内各天的草图
+# 窗口内已有的日期发生变化（迟到数据、重算）或窗口不重叠时整窗重建
+
+WINDOW_DAYS = (7, 30)
+
+WINDOW_COLUMN_TYPES = {
+    'store_key': 'BIGINT NOT NULL',
+    'product_key': 'BIGINT NOT NULL',
+    'channel': 'VARCHAR(50) NOT NULL',
+    'platform': 'VARCHAR(20) NOT NULL',
+    'order_count': 'INT',
+    'sales_quantity': 'INT',
+    'sales_amount': 'DECIMAL(16,2)',
+    'cost_amount': 'DECIMAL(16,2)',
+    'profit_amount': 'DECIMAL(16,2)',
+    'cost': 'DECIMAL(16,2)',
+    'impressions': 'BIGINT',
+    'clicks': 'BIGINT',
+    'profit_rate': 'DECIMAL(10,2)',
+    'click_rate': 'DECIMAL(10,2)',
+    'avg_click_cost': 'DECIMAL(10,2)',
+}
+
+WINDOW_PROFIT_RATE = "CASE WHEN sales_amount > 0 THEN ROUND(profit_amount / sales_amount * 100, 2) ELSE 0 END"
+
+WINDOWS = {
+    'dws_store': {
+        'title': '店铺',
+        'source': 'dws_store_daily',
+        'keys': ['store_key'],
+        'sums': ['order_count', 'sales_amount', 'cost_amount', 'profit_amount'],
+        'ratios': [('profit_rate', WINDOW_PROFIT_RATE)],
+        'sketches': [('user_sketch', 'user_count')],
+    },
+    'dws_product': {
+        'title': '商品',
+        'source': 'dws_trade_product_1d',
+        'keys': ['product_key'],
+        'sums': ['order_count', 'sales_quantity', 'sales_amount', 'cost_amount', 'profit_amount'],
+        'ratios': [('profit_rate', WINDOW_PROFIT_RATE)],
+        'sketches': [('buyer_sketch', 'buyer_count')],
+    },
+    'dws_promotion': {
+        'title': '推广',
+        'source': 'dws_promotion_daily',
+        'keys': ['channel', 'platform'],
+        'sums': ['cost', 'impressions', 'clicks'],
+        'ratios': [
+            ('click_rate', "CASE WHEN impressions > 0 THEN ROUND(clicks / impressions * 100, 2) ELSE 0 END"),
+            ('avg_click_cost', "CASE WHEN clicks > 0 THEN ROUND(cost / clicks, 2) ELSE 0 END"),
+        ],
+        'sketches': [],
+    },
+}
+
+
+def _key_to_date(date_key):
+    return date(date_key // 10000, date_key // 100 % 100, date_key % 100)
+
+
+def _date_to_key(value):
+    return value.year * 10000 + value.month * 100 + value.day
+
+
+def _shift_date_key(date_key, days):
+    return _date_to_key(_key_to_date(date_key) + timedelta(days=days))
+
+
+def window_table_sql(table_name, spec):
+    """滑动窗口表结构：实体键为主键，day_count 记录窗口内有数据的天数（为 0 时删除该行）"""
+    columns = ["window_end INT NOT NULL"]
+    columns += [f"{key} {WINDOW_COLUMN_TYPES[key]}" for key in spec['keys']]
+    columns.append("day_count INT")
+    columns += [f"{name} {WINDOW_COLUMN_TYPES[name]}" for name in spec['sums']]
+    columns += [f"{name} {WINDOW_COLUMN_TYPES[name]}" for name, _ in spec['ratios']]
+    for sketch_column, count_column in spec['sketches']:
+        columns += [f"{count_column} INT", f"{sketch_column} BLOB"]
+    columns.append(f"PRIMARY KEY ({', '.join(spec['keys'])})")
+    return (
+        f"CREATE TABLE IF NOT EXISTS {table_name} (\n        "
+        + ",\n        ".join(columns)
+        + "\n    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    )
+
+
+def _window_delta_sql(table_name, spec, days_condition, sign, mark=False):
+    """
+    把满足 days_condition（date_key 条件）的各天日汇总加到（sign=1）或减出（sign=-1）窗口表
+    mark: 减出时把涉及的行的 window_end 置 0，随后重新合并这些行的去重草图
+    """
+    keys, sums = spec['keys'], ['day_count'] + spec['sums']
+    inner = f"""
+        SELECT {', '.join(keys)}, COUNT(*) AS day_count, {', '.join(f'SUM({name}) AS {name}' for name in spec['sums'])}
+        FROM {spec['source']}
+        WHERE {days_condition}
+        GROUP BY {', '.join(keys)}"""
+    if sign > 0:
+        return f"""
+        INSERT INTO {table_name} (window_end, {', '.join(keys + sums)})
+        SELECT 0, {', '.join(f'x.{name}' for name in keys + sums)}
+        FROM ({inner}
+        ) x
+        ON DUPLICATE KEY UPDATE {', '.join(f'{name} = {table_name}.{name} + VALUES({name})' for name in sums)}
+        """
+    assignments = [f't.{name} = t.{name} - x.{name}' for name in sums] + (['t.window_end = 0'] if mark else [])
+    return f"""
+        UPDATE {table_name} t
+        INNER JOIN ({inner}
+        ) x ON {' AND '.join(f't.{key} = x.{key}' for key in keys)}
+        SET {', '.join(assignments)}
+        """
+
+
+def _days_in(date_keys):
+    return f"date_key IN ({', '.join(str(date_key) for date_key in date_keys)})"
+
+
+def retract_window_days(db_manager, table_name, spec, days, date_keys):
+    """
+    增量模式：日汇总重算这些日期之前，先从窗口表减去其中仍在窗口内的日期的旧值（重算后由 refresh_window 加回新值）
+    减出与清除窗口水位线同事务提交：之后的步骤失败时，下次运行因没有水位线而整窗重建，不会重复减出
+
+    Returns:
+        (old_end, 已减出的 date_key)；窗口尚无水位线时返回 None（refresh_window 整窗重建）
+    """
+    conn = db_manager.connection
+    old_end = get_watermark(conn, table_name)
+    if not old_end:
+        return None
+    old_end = int(old_end)
+    old_start = _shift_date_key(old_end, 1 - days)
+    retracted = sorted(date_key for date_key in date_keys if old_start <= date_key <= old_end)
+    if retracted:
+        if not db_manager.execute_sql(
+            _window_delta_sql(table_name, spec, _days_in(retracted), -1, mark=True),
+            f"{table_name}: 减去将重算的 {len(retracted)} 天", skip_commit=True
+        ):
+            raise RuntimeError(f"{table_name} 减去重算日期失败")
+        clear_watermark(conn, table_name)
+    return old_end, retracted
+
+
+def refresh_window(db_manager, table_name, spec, days, state, full):
+    """
+    刷新一个滑动窗口表
+
+    Args:
+        days: 窗口天数
+        state: retract_window_days 的结果 (old_end, 已减出的 date_key)；为 None 时整窗重建
+        full: 是否整窗重建
+    """
+    conn = db_manager.connection
+    db_manager.execute_sql(window_table_sql(table_name, spec), "创建表结构")
+    new_end = _fetch_column(db_manager, f"SELECT MAX(date_key) FROM {spec['source']}")[0]
+    if new_end is None:
+        print("  ✓ 无日汇总数据，跳过")
+        sys.stdout.flush()
+        return True
+    new_start = _shift_date_key(new_end, 1 - days)
+
+    old_end, retracted = (None, []) if full or state is None else state
+    old_start = _shift_date_key(old_end, 1 - days) if old_end else None
+    rebuild = old_end is None or new_end < old_end or new_start > old_end
+
+    keys = spec['keys']
+    if rebuild:
+        print(f"  整窗重建: {new_start} ~ {new_end}")
+        sys.stdout.flush()
+        if not db_manager.execute_sql(f"DELETE FROM {table_name}", "清空窗口", skip_commit=True):
+            return False
+        steps = [(f"date_key BETWEEN {new_start} AND {new_end}", 1, "汇总窗口内各天")]
+    else:
+        print(f"  窗口前移: {old_end} → {new_end}（重算 {len(retracted)} 天）")
+        sys.stdout.flush()
+        steps = []
+        if new_start > old_start:
+            expired = f"date_key BETWEEN {old_start} AND {_shift_date_key(new_start, -1)}"
+            if retracted:
+                # 已减出的天不再重复减
+                expired += f" AND NOT {_days_in(retracted)}"
+            steps.append((expired, -1, "减去移出窗口的天"))
+        readd = [date_key for date_key in retracted if date_key >= new_start]
+        if readd:
+            steps.append((_days_in(readd), 1, "加回重算的天"))
+        if new_end > old_end:
+            steps.append((f"date_key BETWEEN {_shift_date_key(old_end, 1)} AND {new_end}", 1, "加上新进入窗口的天"))
+        if not steps:
+            print("  ✓ 窗口未变化，跳过")
+            sys.stdout.flush()
+            set_watermark(conn, table_name, 'date_key', new_end)
+            return True
+    for condition, sign, description in steps:
+        if not db_manager.execute_sql(_window_delta_sql(table_name, spec, condition, sign), description):
+            return False
+
+    db_manager.execute_sql(f"DELETE FROM {table_name} WHERE day_count <= 0", "删除移出窗口的实体")
+
+    # 去重计数：对有天数进出窗口或被重算的实体（window_end = 0），合并窗口内各天的草图
+    if spec['sketches']:
+        key_list = ', '.join(keys)
+        changed = ' OR '.join(f"({condition})" for condition, _, _ in steps)
+        merge_rollup_sketches(db_manager, table_name, {
+            'source': f"{spec['source']} d",
+            'keys': [(key, f"d.{key}") for key in keys],
+            'sketches': spec['sketches'],
+        }, f" AND d.date_key BETWEEN {new_start} AND {new_end}"
+           f" AND (({key_list}) IN (SELECT {key_list} FROM {spec['source']} WHERE {changed})"
+           f" OR ({key_list}) IN (SELECT {key_list} FROM {table_name} WHERE window_end = 0))")
+
+    ratios = [f"{name} = {expr}" for name, expr in spec['ratios']]
+    db_manager.execute_sql(
+        f"UPDATE {table_name} SET {', '.join([f'window_end = {new_end}'] + ratios)}", "更新窗口比率"
+    )
+
+    set_watermark(conn, table_name, 'date_key', new_end)
+    return True
+
+
+# ========== 用户汇总（key_filter(列) 返回受影响键的过滤条件，以 AND 开头） ==========
+
+def _sql_user_total(key_filter):
+    """用户总汇总：首末次下单时间等没有更细的用户汇总可上卷，按用户从订单事实表计算（用户键有索引，只读受影响用户的订单）"""
+    return f"""
+    INSERT INTO dws_user_total
+        (user_key, user_id, gender, age, age_group, city, order_count, total_amount, avg_order_amount,
+         first_order_date, last_order_date, user_level)
+    SELECT
+        f.user_key, u.user_id, u.gender, u.age, u.age_group, u.city,
+        COUNT(DISTINCT f.order_key),
+        SUM(f.final_amount),
+        ROUND(AVG(f.final_amount), 2),
+        MIN(f.order_time),
+        MAX(f.order_time),
+        CASE
+            WHEN SUM(f.final_amount) >= 10000 THEN '高价值'
+            WHEN SUM(f.final_amount) >= 5000 THEN '中价值'
+            ELSE '低价值'
+        END
+    FROM dwd_fact_order f
+    LEFT JOIN dim_user u ON f.user_key = u.user_key
+    WHERE f.order_status IN {PAID_STATUSES}{key_filter('f.user_key')}
+    GROUP BY f.user_key, u.user_id, u.gender, u.age, u.age_group, u.city
+    ORDER BY f.user_key
+    """
+
+
+# 按键刷新的汇总表：(标题, 生成 INSERT 的函数, 键列, 查询受影响键的语句（{since} 为上次运行时间）)
+TOTAL_TABLES = {
+    'dws_user_total': (
+        '用户总汇总表', _sql_user_total, 'user_key',
+        "SELECT DISTINCT user_key FROM dwd_fact_order WHERE etl_time >= {since} "
+        "UNION SELECT user_key FROM dim_user WHERE etl_time >= {since}"
+    ),
+}
+
+
+# ========== 执行 ==========
+
+def _fetch_column(db_manager, sql):
+    """执行查询并返回第一列"""
+    cursor = db_manager.connection.cursor()
+    try:
+        cursor.execute(sql)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _in_filter(db_manager, values):
+    """生成 key_filter/date_filter 函数：列 IN (values)"""
+    values_sql = ', '.join(db_manager.connection.escape(value) for value in values)
+    return lambda column: f" AND {column} IN ({values_sql})"
+
+
+def _month_filter(months):
+    """生成按月过滤 date_key 的函数：列落在这些月份的日期范围内（可用 date_key 索引/分区裁剪）"""
+    ranges = ' OR '.join(f"{{column}} BETWEEN {month * 100 + 1} AND {month * 100 + 31}" for month in months)
+    return lambda column: f" AND ({ranges.format(column=column)})"
+
+
+def _no_filter(column):
+    return ''
+
+
+def touched_date_keys(db_manager, fact_tables, since):
+    """上次运行以来这些事实表中有新增、更新或删除（etl_removed_dates）的 date_key"""
+    date_keys = set(get_removed_dates(db_manager.connection, fact_tables, since))
+    for fact_table in fact_tables:
+        date_keys.update(_fetch_column(
+            db_manager,
+            f"SELECT DISTINCT date_key FROM {fact_table} "
+            f"WHERE etl_time >= {db_manager.connection.escape(since)} AND date_key IS NOT NULL"
+        ))
+    return sorted(date_keys)
+
+
+def dimension_date_keys(db_manager, table_name, since):
+    """上次运行以来冗余的维度属性有变化的 date_key（取自日汇总表中引用这些成员的行）"""
+    date_keys = set()
+    for dim_table, key_column in DAILY_DIMENSIONS.get(table_name, []):
+        date_keys.update(_fetch_column(
+            db_manager,
+            f"SELECT DISTINCT t.date_key FROM {table_name} t "
+            f"INNER JOIN {dim_table} d ON t.{key_column} = d.{key_column} "
+            f"WHERE d.etl_time >= {db_manager.connection.escape(since)}"
+        ))
+    return date_keys
+
+
+def refresh_daily_table(db_manager, table_name, build_sql, date_keys, fact_tables=None, parallelism=1):
+    """
+    写入日汇总表
+    date_keys 为 None 时写入全部日期；否则只删除并重算这些 date_key
+    parallelism > 1 时按 date_key 切片在多个连接上并行聚合（全量时日期取自来源事实表）
+    """
+    if date_keys is None and parallelism > 1 and fact_tables:
+        date_keys = sorted(set().union(*(
+            _fetch_column(db_manager, f"SELECT DISTINCT date_key FROM {fact_table} WHERE date_key IS NOT NULL")
+            for fact_table in fact_tables
+        )))
+        if len(date_keys) > 1:
+            return not run_sliced_insert(db_manager, table_name, build_sql, date_keys, parallelism)
+        date_keys = None
+    if date_keys is None:
+        return db_manager.execute_sql(build_sql(_no_filter), "汇总全部日期")
+    if not date_keys:
+        print("  ✓ 无变化的日期，跳过")
+        sys.stdout.flush()
+        return True
+    date_filter = _in_filter(db_manager, date_keys)
+    print(f"  变化日期: {len(date_keys)} 天 ({date_keys[0]} ~ {date_keys[-1]})")
+    sys.stdout.flush()
+    if parallelism > 1 and len(date_keys) > 1:
+        # 并行切片使用各自的连接，删除须先提交；切片失败的日期已被删除，记为待重算，
+        # 本次运行失败不推进水位线，下次运行与新变化的日期一起重算
+        if not db_manager.execute_sql(
+            f"DELETE FROM {table_name} WHERE 1 = 1{date_filter('date_key')}", "删除变化日期的旧汇总"
+        ):
+            return False
+        failed = run_sliced_insert(db_manager, table_name, build_sql, date_keys, parallelism)
+        if failed:
+            record_pending_dates(db_manager.connection, table_name, failed)
+            print(f"  ✗ {len(failed)} 天写入失败，已记录待下次重算")
+            sys.stdout.flush()
+            return False
+        return True
+    if not db_manager.execute_sql(
+        f"DELETE FROM {table_name} WHERE 1 = 1{date_filter('date_key')}", "删除变化日期的旧汇总", skip_commit=True
+    ):
+        return False
+    return db_manager.execute_sql(build_sql(date_filter), "重算变化日期")
+
+
+def refresh_total_table(db_manager, table_name, build_sql, key_column, keys):
+    """
+    写入总汇总表
+    keys 为 None 时写入全部；否则按批删除并重算受影响的键
+    """
+    if keys is None:
+        return db_manager.execute_sql(build_sql(_no_filter), "汇总全部数据")
+    if not keys:
+        print("  ✓ 无受影响的数据，跳过")
+        sys.stdout.flush()
+        return True
+    print(f"  受影响: {len(keys):,} 个 {key_column}")
+    sys.stdout.flush()
+    for start in range(0, len(keys), KEY_BATCH_SIZE):
+        key_filter = _in_filter(db_manager, keys[start:start + KEY_BATCH_SIZE])
+        if not db_manager.execute_sql(
+            f"DELETE FROM {table_name} WHERE 1 = 1{key_filter(key_column)}", "删除旧汇总", skip_commit=True
+        ):
+            return False
+        if not db_manager.execute_sql(build_sql(key_filter), f"重算第{start // KEY_BATCH_SIZE + 1}批"):
+            return False
+    return True
+
+
+def _plain(value):
+    """NumPy 标量转为 Python 值（pymysql 不能直接转义 NumPy 类型）"""
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _upsert_rows(db_manager, table_name, key_columns, value_columns, rows):
+    """按主键批量写入列值（行已由汇总语句插入，这里只更新草图/计数列）"""
+    if not rows:
+        return
+    columns = key_columns + value_columns
+    sql = (
+        f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON DUPLICATE KEY UPDATE {', '.join(f'{c} = VALUES({c})' for c in value_columns)}"
+    )
+    cursor = db_manager.connection.cursor()
+    try:
+        for start in range(0, len(rows), KEY_BATCH_SIZE):
+            cursor.executemany(sql, rows[start:start + KEY_BATCH_SIZE])
+        db_manager.connection.commit()
+    finally:
+        cursor.close()
+
+
+def refresh_daily_sketches(db_manager, table_name, spec, date_keys):
+    """
+    构建日汇总行的去重草图：按批抽取明细，Python 中按分组构建 HyperLogLog 并写回
+    date_keys 为 None 时处理表中全部日期
+    """
+    if date_keys is None:
+        date_keys = _fetch_column(db_manager, f"SELECT DISTINCT date_key FROM {table_name} ORDER BY date_key")
+    if not date_keys:
+        return True
+
+    keys = spec['keys']
+    sketch_columns = [column for column, _ in spec['sketches']]
+    value_columns = [column for _, column in spec['sketches']]
+    total = 0
+    cursor = db_manager.connection.cursor()
+    try:
+        for start in range(0, len(date_keys), SKETCH_DATE_BATCH):
+            cursor.execute(spec['extract'](_in_filter(db_manager, date_keys[start:start + SKETCH_DATE_BATCH])))
+            df = pd.DataFrame(list(cursor.fetchall()), columns=keys + value_columns)
+            sketches = {}
+            for index, value_column in enumerate(value_columns):
+                for key, sketch in group_sketches(df[keys], df[value_column]):
+                    sketches.setdefault(key, [None] * len(value_columns))[index] = sketch.to_bytes()
+            rows = [tuple(_plain(k) for k in key) + tuple(blobs) for key, blobs in sketches.items()]
+            _upsert_rows(db_manager, table_name, keys, sketch_columns, rows)
+            total += len(rows)
+    finally:
+        cursor.close()
+    print(f"  ✓ 去重草图: {total:,} 行")
+    sys.stdout.flush()
+    return True
+
+
+def merge_rollup_sketches(db_manager, table_name, spec, source_filter=''):
+    """
+    合并下层汇总行的草图，写入上卷行的草图列和去重计数列
+    下层行按上卷键排序读取，同一上卷键的行连续出现：内存中只保留当前键的草图，
+    完成的行每 KEY_BATCH_SIZE 行写回一次
+    """
+    if not spec.get('sketches'):
+        return True
+    alias = spec['source'].split()[-1]
+    keys = spec['keys']
+    key_names = [name for name, _ in keys]
+    sketch_columns = [column for column, _ in spec['sketches']]
+    count_columns = [column for _, column in spec['sketches'] if column]
+
+    rows = []
+    total = 0
+
+    def finish(key, sketches):
+        counts = [
+            sketch.count() if sketch is not None else 0
+            for sketch, (_, count_column) in zip(sketches, spec['sketches']) if count_column
+        ]
+        blobs = [sketch.to_bytes() if sketch is not None else None for sketch in sketches]
+        rows.append(tuple(key) + tuple(blobs) + tuple(counts))
+
+    def flush():
+        nonlocal total
+        _upsert_rows(db_manager, table_name, key_names, sketch_columns + count_columns, rows)
+        total += len(rows)
+        rows.clear()
+
+    current_key, sketches = None, None
+    cursor = db_manager.connection.cursor()
+    try:
+        cursor.execute(
+            f"SELECT {', '.join(expr for _, expr in keys)}, {', '.join(f'{alias}.{c}' for c in sketch_columns)} "
+            f"FROM {spec['source']} WHERE 1 = 1{source_filter} "
+            f"ORDER BY {', '.join(expr for _, expr in keys)}"
+        )
+        while True:
+            batch = cursor.fetchmany(KEY_BATCH_SIZE)
+            if not batch:
+                break
+            for row in batch:
+                key = row[:len(keys)]
+                if key != current_key:
+                    if current_key is not None:
+                        finish(current_key, sketches)
+                        if len(rows) >= KEY_BATCH_SIZE:
+                            flush()
+                    current_key, sketches = key, [None] * len(sketch_columns)
+                for index, blob in enumerate(row[len(keys):]):
+                    if blob:
+                        sketch = HyperLogLog.from_bytes(blob)
+                        sketches[index] = sketch if sketches[index] is None else sketches[index].merge(sketch)
+    finally:
+        cursor.close()
+
+    if current_key is not None:
+        finish(current_key, sketches)
+    flush()
+    print(f"  ✓ 合并去重草图: {total:,} 行")
+    sys.stdout.flush()
+    return True
+
+
+def refresh_rollup(db_manager, table_name, spec, values):
+    """
+    写入上卷汇总表
+    values 为 None 时写入全部；否则按批删除并重算这些刷新键（month_key 为月份，其它为键值）
+    """
+    if values is None:
+        return (db_manager.execute_sql(rollup_sql(table_name, spec), "由下层汇总上卷")
+                and merge_rollup_sketches(db_manager, table_name, spec))
+    if not values:
+        print("  ✓ 无受影响的数据，跳过")
+        sys.stdout.flush()
+        return True
+    column, source_column = spec['refresh']
+    print(f"  受影响: {len(values):,} 个 {column}")
+    sys.stdout.flush()
+    for start in range(0, len(values), KEY_BATCH_SIZE):
+        batch = values[start:start + KEY_BATCH_SIZE]
+        key_filter = _in_filter(db_manager, batch)
+        source_filter = (_month_filter(batch) if column == 'month_key' else key_filter)(source_column)
+        if not db_manager.execute_sql(
+            f"DELETE FROM {table_name} WHERE 1 = 1{key_filter(column)}", "删除旧汇总", skip_commit=True
+        ):
+            return False
+        if not db_manager.execute_sql(rollup_sql(table_name, spec, source_filter), f"上卷第{start // KEY_BATCH_SIZE + 1}批"):
+            return False
+        if not merge_rollup_sketches(db_manager, table_name, spec, source_filter):
+            return False
+    return True
+
+
+def transform_dws(mode='full', db_config=None, parallelism=DEFAULT_PARALLELISM):
+    """
+    转换DWS层数据 - 支持千万级数据
+    mode: 'full' 删除重建全部汇总表；'incremental' 只重算上次运行以来 DWD 有变化的日期和受影响的键
+    parallelism: 日汇总按 date_key 切片并行聚合的连接数（1 为单条语句执行）
+    """
     print("="*60)
     print("DWS层数据转换 - 多维度汇总（支持千万级）")
     print("="*60)
-    
+
     # 使用数据库管理器
     db_manager = get_db_manager(db_config)
     if not db_manager:
         return False
-    
+
     try:
-        # ========== 1. 交易域汇总 ==========
-        print("\n【第一步】交易域汇总")
-        
-        print("\n1.1 订单日汇总表")
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS dws_trade_order_1d", "删除旧表")
-        
-        sql_order_1d = """
-        CREATE TABLE IF NOT EXISTS dws_trade_order_1d AS
-        SELECT 
-            f.date_key, f.store_key, f.platform,
-            COUNT(DISTINCT f.order_id) AS order_count,
-            COUNT(DISTINCT f.user_key) AS order_user_count,
-            SUM(f.final_amount) AS order_amount,
-            COUNT(DISTINCT CASE WHEN f.order_status IN ('已完成', '已发货') THEN f.order_id END) AS payment_count,
-            SUM(CASE WHEN f.order_status IN ('已完成', '已发货') THEN f.final_amount ELSE 0 END) AS payment_amount,
-            SUM(CASE WHEN f.order_status IN ('已完成', '已发货') THEN f.total_cost ELSE 0 END) AS cost_amount,
-            SUM(CASE WHEN f.order_status IN ('已完成', '已发货') THEN f.profit_amount ELSE 0 END) AS profit_amount,
-            ROUND(AVG(CASE WHEN f.order_status IN ('已完成', '已发货') THEN f.final_amount END), 2) AS avg_order_amount,
-            CURDATE() AS etl_date
-        FROM dwd_fact_order f
-        GROUP BY f.date_key, f.store_key, f.platform
-        """
-        db_manager.execute_sql(sql_order_1d, "创建订单日汇总表")
-        
-        print("\n1.2 商品日汇总表")
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS dws_trade_product_1d", "删除旧表")
-        
-        sql_product_1d = """
-        CREATE TABLE IF NOT EXISTS dws_trade_product_1d AS
-        SELECT 
-            fd.date_key, fd.product_key,
-            COUNT(DISTINCT fd.order_id) AS order_count,
-            SUM(fd.quantity) AS sales_quantity,
-            SUM(fd.amount) AS sales_amount,
-            SUM(fd.cost_amount) AS cost_amount,
-            SUM(fd.profit_amount) AS profit_amount,
-            COUNT(DISTINCT fd.user_key) AS buyer_count,
-            CURDATE() AS etl_date
-        FROM dwd_fact_order_detail fd
-        INNER JOIN dwd_fact_order f ON fd.order_id = f.order_id
-        WHERE f.order_status IN ('已完成', '已发货')
-        GROUP BY fd.date_key, fd.product_key
-        """
-        db_manager.execute_sql(sql_product_1d, "创建商品日汇总表")
-        
-        # ========== 2. 店铺维度汇总 ==========
-        print("\n【第二步】店铺维度汇总")
-        
-        print("\n2.1 店铺日汇总表")
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS dws_store_daily", "删除旧表")
-        
-        sql_store_daily = """
-        CREATE TABLE IF NOT EXISTS dws_store_daily AS
-        SELECT 
-            f.date_key, f.store_key,
-            COUNT(DISTINCT f.order_id) AS order_count,
-            COUNT(DISTINCT f.user_key) AS user_count,
-            SUM(f.final_amount) AS sales_amount,
-            SUM(f.total_cost) AS cost_amount,
-            SUM(f.profit_amount) AS profit_amount,
-            CASE WHEN SUM(f.final_amount) > 0 THEN ROUND(SUM(f.profit_amount) / SUM(f.final_amount) * 100, 2) ELSE 0 END AS profit_rate
-        FROM dwd_fact_order f
-        WHERE f.order_status IN ('已完成', '已发货')
-        GROUP BY f.date_key, f.store_key
-        """
-        db_manager.execute_sql(sql_store_daily, "创建店铺日汇总表")
-        
-        print("\n2.2 店铺总汇总表")
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS dws_store_total", "删除旧表")
-        
-        sql_store_total = """
-        CREATE TABLE IF NOT EXISTS dws_store_total AS
-        SELECT 
-            f.store_key, s.store_id, s.store_name, s.platform,
-            COUNT(DISTINCT f.order_id) AS order_count,
-            COUNT(DISTINCT f.user_key) AS user_count,
-            SUM(f.final_amount) AS sales_amount,
-            SUM(f.total_cost) AS cost_amount,
-            SUM(f.profit_amount) AS profit_amount,
-            CASE WHEN SUM(f.final_amount) > 0 THEN ROUND(SUM(f.profit_amount) / SUM(f.final_amount) * 100, 2) ELSE 0 END AS profit_rate,
-            ROUND(AVG(f.final_amount), 2) AS avg_order_amount
-        FROM dwd_fact_order f
-        LEFT JOIN dim_store s ON f.store_key = s.store_key
-        WHERE f.order_status IN ('已完成', '已发货')
-        GROUP BY f.store_key, s.store_id, s.store_name, s.platform
-        """
-        db_manager.execute_sql(sql_store_total, "创建店铺总汇总表")
-
-        
-        # ========== 3. 商品维度汇总 ==========
-        print("\n【第三步】商品维度汇总")
-        
-        print("\n3.1 商品总汇总表")
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS dws_product_total", "删除旧表")
-        
-        sql_product_total = """
-        CREATE TABLE IF NOT EXISTS dws_product_total AS
-        SELECT 
-            fd.product_key, p.product_id, p.product_name, p.category_l1, p.category_l2,
-            COUNT(DISTINCT fd.order_id) AS order_count,
-            SUM(fd.quantity) AS sales_quantity,
-            SUM(fd.amount) AS sales_amount,
-            SUM(fd.cost_amount) AS cost_amount,
-            SUM(fd.profit_amount) AS profit_amount,
-            CASE WHEN SUM(fd.amount) > 0 THEN ROUND(SUM(fd.profit_amount) / SUM(fd.amount) * 100, 2) ELSE 0 END AS profit_rate
-        FROM dwd_fact_order_detail fd
-        LEFT JOIN dim_product p ON fd.product_key = p.product_key
-        INNER JOIN dwd_fact_order f ON fd.order_id = f.order_id
-        WHERE f.order_status IN ('已完成', '已发货')
-        GROUP BY fd.product_key, p.product_id, p.product_name, p.category_l1, p.category_l2
-        """
-        db_manager.execute_sql(sql_product_total, "创建商品总汇总表")
-        
-        # ========== 4. 类目维度汇总 ==========
-        print("\n【第四步】类目维度汇总")
-        
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS dws_category_total", "删除旧表")
-        
-        sql_category_total = """
-        CREATE TABLE IF NOT EXISTS dws_category_total AS
-        SELECT 
-            p.category_l1, p.category_l2, f.platform,
-            COUNT(DISTINCT fd.order_id) AS order_count,
-            SUM(fd.quantity) AS sales_quantity,
-            SUM(fd.amount) AS sales_amount,
-            SUM(fd.profit_amount) AS profit_amount,
-            CASE WHEN SUM(fd.amount) > 0 THEN ROUND(SUM(fd.profit_amount) / SUM(fd.amount) * 100, 2) ELSE 0 END AS profit_rate
-        FROM dwd_fact_order_detail fd
-        LEFT JOIN dim_product p ON fd.product_key = p.product_key
-        INNER JOIN dwd_fact_order f ON fd.order_id = f.order_id
-        WHERE f.order_status IN ('已完成', '已发货')
-        GROUP BY p.category_l1, p.category_l2, f.platform
-        """
-        db_manager.execute_sql(sql_category_total, "创建类目总汇总表")
-        
-        # ========== 5. 用户维度汇总 ==========
-        print("\n【第五步】用户维度汇总")
-        
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS dws_user_total", "删除旧表")
-        
-        sql_user_total = """
-        CREATE TABLE IF NOT EXISTS dws_user_total AS
-        SELECT 
-            f.user_key, u.user_id, u.gender, u.age, u.age_group, u.city,
-            COUNT(DISTINCT f.order_id) AS order_count,
-            SUM(f.final_amount) AS total_amount,
-            ROUND(AVG(f.final_amount), 2) AS avg_order_amount,
-            MIN(f.order_time) AS first_order_date,
-            MAX(f.order_time) AS last_order_date,
-            CASE 
-                WHEN SUM(f.final_amount) >= 10000 THEN '高价值'
-                WHEN SUM(f.final_amount) >= 5000 THEN '中价值'
-                ELSE '低价值'
-            END AS user_level
-        FROM dwd_fact_order f
-        LEFT JOIN dim_user u ON f.user_key = u.user_key
-        WHERE f.order_status IN ('已完成', '已发货')
-        GROUP BY f.user_key, u.user_id, u.gender, u.age, u.age_group, u.city
-        """
-        db_manager.execute_sql(sql_user_total, "创建用户总汇总表")
-        
-        # ========== 6. 推广维度汇总 ==========
-        print("\n【第六步】推广维度汇总")
-        
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS dws_promotion_daily", "删除旧表")
-        
-        sql_promotion_daily = """
-        CREATE TABLE IF NOT EXISTS dws_promotion_daily AS
-        SELECT 
-            fp.date_key, fp.channel, fp.platform,
-            SUM(fp.cost) AS cost,
-            SUM(fp.impressions) AS impressions,
-            SUM(fp.clicks) AS clicks,
-            CASE WHEN SUM(fp.impressions) > 0 THEN ROUND(SUM(fp.clicks) / SUM(fp.impressions) * 100, 2) ELSE 0 END AS click_rate,
-            CASE WHEN SUM(fp.clicks) > 0 THEN ROUND(SUM(fp.cost) / SUM(fp.clicks), 2) ELSE 0 END AS avg_click_cost
-        FROM dwd_fact_promotion fp
-        GROUP BY fp.date_key, fp.channel, fp.platform
-        """
-        db_manager.execute_sql(sql_promotion_daily, "创建推广日汇总表")
-        
-        # ========== 7. 流量维度汇总 ==========
-        print("\n【第七步】流量维度汇总")
-        
-        if mode == 'full':
-            db_manager.execute_sql("DROP TABLE IF EXISTS dws_traffic_daily", "删除旧表")
-        
-        sql_traffic_daily = """
-        CREATE TABLE IF NOT EXISTS dws_traffic_daily AS
-        SELECT 
-            ft.date_key, ft.store_key, ft.platform,
-            ft.visitors, ft.page_views, ft.avg_stay_time, ft.bounce_rate,
-            CASE WHEN ft.visitors > 0 THEN ROUND(COALESCE(o.order_cnt, 0) / ft.visitors * 100, 2) ELSE 0 END AS conversion_rate
-        FROM dwd_fact_traffic ft
-        LEFT JOIN (
-            SELECT date_key, store_key, COUNT(DISTINCT order_id) AS order_cnt
-            FROM dwd_fact_order WHERE order_status IN ('已完成', '已发货')
-            GROUP BY date_key, store_key
-        ) o ON ft.date_key = o.date_key AND ft.store_key = o.store_key
-        """
-        db_manager.execute_sql(sql_traffic_daily, "创建流量日汇总表")
-        
+        conn = db_manager.connection
+        ensure_control_tables(conn)
+
+        # 本次运行开始时间（数据库时钟，与 DWD 的 etl_time 一致），成功后作为下次的水位线
+        run_started = _fetch_column(db_manager, "SELECT NOW()")[0]
+        since = get_watermark(conn, DWS_WATERMARK) if mode == 'incremental' else None
+        if mode == 'incremental' and since is None:
+            print("未找到上次运行记录，执行全量汇总")
+            mode = 'full'
+        else:
+            print(f"上次运行: {since or '-'}")
+        sys.stdout.flush()
+
+        touched = {}
+
+        def touched_dates(fact_tables):
+            """这些事实表上次运行以来变化的 date_key（按表缓存）"""
+            for fact_table in fact_tables:
+                if fact_table not in touched:
+                    touched[fact_table] = touched_date_keys(db_manager, [fact_table], since)
+            return sorted(set().union(*(touched[fact_table] for fact_table in fact_tables)))
+
+        def prepare(table_name):
+            if mode == 'full':
+                db_manager.execute_sql(f"DROP TABLE IF EXISTS {table_name}", "删除旧表")
+            db_manager.execute_sql(SQL_CREATE_TABLES[table_name], "创建表结构")
+            for column_name, definition in ADDED_COLUMNS.get(table_name, []):
+                ensure_column(conn, table_name, column_name, definition)
+
+        # 上卷/用户汇总受影响的键在刷新任何汇总表之前查询：
+        # 汇总表中此时仍是维度变化前的属性（如商品原来的 SPU/类目），原属的键同样需要重算
+        affected = {}
+        if mode == 'incremental':
+            for table_name, spec in ROLLUPS.items():
+                if 'affected' in spec:
+                    affected[table_name] = _fetch_column(db_manager, spec['affected'].format(since=conn.escape(since)))
+            for table_name, (_, _, _, affected_sql) in TOTAL_TABLES.items():
+                affected[table_name] = _fetch_column(db_manager, affected_sql.format(since=conn.escape(since)))
+
+        # 滑动窗口表 -> retract_window_days 的结果（增量模式）
+        window_states = {}
+
+        # ========== 1. 日汇总 ==========
+        print("\n【第一步】日汇总")
+        for index, (table_name, (title, build_sql, fact_tables)) in enumerate(DAILY_TABLES.items(), 1):
+            print(f"\n1.{index} {title}")
+            prepare(table_name)
+            date_keys = None
+            if mode == 'incremental':
+                date_keys = sorted(
+                    set(touched_dates(fact_tables))
+                    | dimension_date_keys(db_manager, table_name, since)
+                    | set(get_removed_dates(conn, [table_name], since))  # 上次写入失败待重算的日期
+                )
+                # 以本表为来源的滑动窗口先减去这些日期的旧值，窗口步骤再加回重算后的新值
+                for name, spec in WINDOWS.items():
+                    if spec['source'] == table_name:
+                        for days in WINDOW_DAYS:
+                            window_states[f"{name}_{days}d"] = retract_window_days(
+                                db_manager, f"{name}_{days}d", spec, days, date_keys
+                            )
+            if not refresh_daily_table(db_manager, table_name, build_sql, date_keys, fact_tables, parallelism):
+                return False
+            if table_name in DAILY_SKETCHES:
+                refresh_daily_sketches(db_manager, table_name, DAILY_SKETCHES[table_name], date_keys)
+
+        # ========== 2. 上卷汇总 ==========
+        print("\n【第二步】上卷汇总（日 → 月 → 总计，SKU → SPU → 类目）")
+        for index, (table_name, spec) in enumerate(ROLLUPS.items(), 1):
+            print(f"\n2.{index} {spec['title']}")
+            prepare(table_name)
+            values = None
+            if mode == 'incremental':
+                if spec['refresh'][0] == 'month_key':
+                    values = sorted({date_key // 100 for date_key in touched_dates(spec['facts'])})
+                else:
+                    values = affected[table_name]
+            if not refresh_rollup(db_manager, table_name, spec, values):
+                return False
+
+        # ========== 3. 滑动窗口 ==========
+        print("\n【第三步】滑动窗口（近7天 / 近30天）")
+        index = 0
+        for name, spec in WINDOWS.items():
+            for days in WINDOW_DAYS:
+                index += 1
+                table_name = f"{name}_{days}d"
+                print(f"\n3.{index} {spec['title']}近{days}天汇总表 ({table_name})")
+                if mode == 'full':
+                    db_manager.execute_sql(f"DROP TABLE IF EXISTS {table_name}", "删除旧表")
+                state = window_states.get(table_name)
+                if not refresh_window(db_manager, table_name, spec, days, state, mode == 'full'):
+                    return False
+
+        # ========== 4. 用户汇总 ==========
+        print("\n【第四步】用户汇总")
+        for index, (table_name, (title, build_sql, key_column, _)) in enumerate(TOTAL_TABLES.items(), 1):
+            print(f"\n4.{index} {title}")
+            prepare(table_name)
+            keys = affected[table_name] if mode == 'incremental' else None
+            if not refresh_total_table(db_manager, table_name, build_sql, key_column, keys):
+                return False
+
+        set_watermark(conn, DWS_WATERMARK, 'etl_time', run_started)
+        purge_removed_dates(conn, run_started)
+
         print("\n" + "="*60)
         print("✓ DWS层转换完成！")
         print("="*60)
         return True
-        
+
     except Exception as e:
         print(f"✗ 转换失败: {e}")
         return False
@@ -255,23 +1284,24 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     atexit.register(cleanup_global_db_manager)
-    
+
     config = {}
     if len(sys.argv) > 1:
         try:
             config = json.loads(sys.argv[1])
         except:
             pass
-    
+
     db_config = config.get('dbConfig', {
         'host': 'localhost', 'port': 3306, 'database': 'datas', 'user': 'root', 'password': ''
     })
-    
+
     mode = config.get('mode', 'full')
-    print(f"模式: {'全量' if mode == 'full' else '增量'}")
-    
+    parallelism = config.get('parallelism', DEFAULT_PARALLELISM)
+    print(f"模式: {MODE_LABELS.get(mode, mode)}")
+
     try:
-        success = transform_dws(mode, db_config)
+        success = transform_dws(mode, db_config, parallelism)
         if not success:
             sys.exit(1)
     except KeyboardInterrupt:
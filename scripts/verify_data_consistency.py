@@ -10,6 +10,8 @@ import sys
 import json
 from pathlib import Path
 
+from config import AMOUNT_FEE_RATES
+
 def get_db_connection(db_config):
     """获取数据库连接"""
     return pymysql.connect(
@@ -62,7 +64,7 @@ def collect_all_metrics(csv_orders_path, csv_promo_path, db_config):
         cursor.execute('''
             SELECT SUM(od.quantity)
             FROM ods_order_details od
-            INNER JOIN ods_orders o ON od.order_id = o.order_id
+            INNER JOIN ods_orders o ON od.order_no = o.order_no
             WHERE o.order_status = '已完成'
         ''')
         qty_row = cursor.fetchone()
@@ -393,10 +395,10 @@ def display_metrics_table(metrics):
         # 推广费率
         promo_rate = (promo / sales * 100) if sales > 0 else 0
         
-        # 其他费用
-        after_sales = sales * 0.02
-        platform_fee = sales * 0.05
-        management = sales * 0.10
+        # 其他费用（比例见费用配置）
+        after_sales = sales * AMOUNT_FEE_RATES['after_sale_fee']
+        platform_fee = sales * AMOUNT_FEE_RATES['platform_fee']
+        management = sales * AMOUNT_FEE_RATES['mgmt_fee']
         
         # 净利润
         net_profit = gross_profit - promo - after_sales - platform_fee - management
@@ -0,0 +1,5 @@
+"""测试从 scripts 目录导入模块（脚本以 scripts 为工作目录运行，模块之间直接按文件名导入）"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
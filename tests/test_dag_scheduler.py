@@ -0,0 +1,49 @@
+import pytest
+
+from dag_scheduler import run_dag
+
+
+def test_runs_in_dependency_order():
+    order = []
+
+    def step(name):
+        return lambda: order.append(name) or True
+
+    ok, timings = run_dag({
+        'a': (step('a'), []),
+        'b': (step('b'), ['a']),
+        'c': (step('c'), ['a']),
+        'd': (step('d'), ['b', 'c']),
+    }, max_workers=2)
+    assert ok
+    assert set(timings) == {'a', 'b', 'c', 'd'}
+    assert order[0] == 'a' and order[-1] == 'd'
+
+
+def test_skips_downstream_of_failure():
+    ran = []
+
+    def step(name, result=True):
+        return lambda: ran.append(name) or result
+
+    def boom():
+        raise RuntimeError('boom')
+
+    ok, timings = run_dag({
+        'a': (step('a', False), []),
+        'b': (step('b'), ['a']),
+        'c': (step('c'), ['b']),
+        'd': (step('d'), []),
+        'e': (boom, []),
+        'f': (step('f'), ['e']),
+    })
+    assert not ok
+    assert sorted(ran) == ['a', 'd']
+    assert set(timings) == {'a', 'd', 'e'}
+
+
+def test_rejects_cycles_and_unknown_dependencies():
+    with pytest.raises(ValueError):
+        run_dag({'a': (lambda: True, ['b']), 'b': (lambda: True, ['a'])})
+    with pytest.raises(ValueError):
+        run_dag({'a': (lambda: True, ['missing'])})
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from hll import HyperLogLog, group_sketches, merge_sketches
+
+
+def test_estimate_within_3_percent():
+    values = np.arange(100000, dtype=np.int64)
+    estimate = HyperLogLog().add(values).count()
+    assert abs(estimate - 100000) / 100000 < 0.03
+
+
+def test_small_cardinality_and_nulls():
+    assert HyperLogLog().count() == 0
+    assert HyperLogLog().add(pd.Series([1, 2, 2, None, 3], dtype='Int64')).count() == 3
+
+
+def test_merge_equals_union():
+    left = HyperLogLog().add(np.arange(0, 60000))
+    right = HyperLogLog().add(np.arange(40000, 100000))
+    union = HyperLogLog().add(np.arange(0, 100000))
+    merged = HyperLogLog().merge(left).merge(right)
+    assert np.array_equal(merged.registers, union.registers)
+    assert merged.count() == union.count()
+
+
+def test_bytes_round_trip():
+    sketch = HyperLogLog().add(np.arange(5000))
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+    assert np.array_equal(restored.registers, sketch.registers)
+    assert merge_sketches([sketch.to_bytes(), None]).count() == sketch.count()
+
+
+def test_group_sketches_match_per_group_sketches():
+    groups = pd.DataFrame({'date_key': [1, 1, 2, 2, 2, 3], 'store_key': [10, 10, 10, 20, 20, None]})
+    values = pd.Series([100, 101, 100, 100, 102, 100])
+    result = dict(group_sketches(groups, values, batch_groups=1))
+    assert set(result) == {(1, 10), (2, 10), (2, 20)}
+    assert result[(1, 10)].count() == 2
+    assert np.array_equal(result[(2, 20)].registers, HyperLogLog().add([100, 102]).registers)
@@ -0,0 +1,23 @@
+import pandas as pd
+
+from key_resolution import DimensionKeyMap, add_integer_ids
+
+
+def test_lookup_with_missing_keys():
+    key_map = DimensionKeyMap(['U003', 'U001', 'U002'], [3, 1, 2], level=['C', 'A', 'B'])
+    keys = key_map.lookup(['U002', 'U999', 'U001', 'U000'])
+    assert list(pd.Series(keys).isna()) == [False, True, False, True]
+    assert list(pd.Series(keys).dropna()) == [2, 1]
+    assert list(key_map.attribute('level', ['U003', 'U998'], default='-')) == ['C', '-']
+
+
+def test_lookup_on_empty_map():
+    keys = DimensionKeyMap([], []).lookup(['U001'])
+    assert pd.Series(keys).isna().all()
+
+
+def test_add_integer_ids():
+    df = add_integer_ids(pd.DataFrame({'用户ID': ['U00000012', None]}))
+    assert list(df.columns) == ['用户ID', '用户编号']
+    assert df['用户编号'].iloc[0] == 12
+    assert pd.isna(df['用户编号'].iloc[1])
@@ -0,0 +1,16 @@
+from parallel_aggregate import run_sliced_insert, split_slices
+
+
+def test_split_slices_covers_all_dates_in_order():
+    date_keys = [20240105, 20240101, 20240103, 20240102, 20240104]
+    slices = split_slices(date_keys, 2)
+    assert slices == [[20240101, 20240102, 20240103], [20240104, 20240105]]
+
+
+def test_split_slices_more_slices_than_dates():
+    assert split_slices([20240101, 20240102], 8) == [[20240101], [20240102]]
+    assert split_slices([], 4) == []
+
+
+def test_run_sliced_insert_without_dates():
+    assert run_sliced_insert(None, 'dws_sales_daily', lambda date_filter: '', [], 4) == []
@@ -0,0 +1,74 @@
+from datetime import date
+
+from partitioning import ensure_month_partitions, month_range, monthly_partition_clause
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        if 'information_schema.PARTITIONS' in sql:
+            self.rows = [(name,) for name in self.conn.partitions]
+        else:
+            self.conn.statements.append(sql)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """记录执行的 DDL，分区查询返回预设的分区名"""
+
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+
+def test_monthly_partition_clause_int_key():
+    clause = monthly_partition_clause('date_key', month_range('2024-01', '2024-02'), int_key=True)
+    assert 'PARTITION BY RANGE (date_key)' in clause
+    assert 'PARTITION p0 VALUES LESS THAN (20240101)' in clause
+    assert 'PARTITION p202401 VALUES LESS THAN (20240201)' in clause
+    assert 'PARTITION p202402 VALUES LESS THAN (20240301)' in clause
+    assert clause.rstrip().endswith('PARTITION pmax VALUES LESS THAN MAXVALUE\n)')
+
+
+def test_ensure_partitions_before_first_month():
+    conn = FakeConnection(['p0', 'p202403', 'p202404', 'pmax'])
+    added = ensure_month_partitions(conn, 'dwd_fact_order', [date(2024, 1, 1)], int_key=True)
+    assert added == 2
+    assert conn.statements == [
+        "ALTER TABLE `dwd_fact_order` REORGANIZE PARTITION p0 INTO ("
+        "PARTITION p0 VALUES LESS THAN (20240101), "
+        "PARTITION p202401 VALUES LESS THAN (20240201), "
+        "PARTITION p202402 VALUES LESS THAN (20240301))"
+    ]
+
+
+def test_ensure_partitions_after_last_month():
+    conn = FakeConnection(['p0', 'p202401', 'pmax'])
+    added = ensure_month_partitions(conn, 'ods_orders', [date(2024, 1, 1), date(2024, 3, 1)])
+    assert added == 2
+    assert conn.statements == [
+        "ALTER TABLE `ods_orders` REORGANIZE PARTITION pmax INTO ("
+        "PARTITION p202402 VALUES LESS THAN (TO_DAYS('2024-03-01')), "
+        "PARTITION p202403 VALUES LESS THAN (TO_DAYS('2024-04-01')), "
+        "PARTITION pmax VALUES LESS THAN MAXVALUE)"
+    ]
+
+
+def test_ensure_partitions_skips_unpartitioned_table():
+    conn = FakeConnection([])
+    assert ensure_month_partitions(conn, 'ods_orders', [date(2024, 1, 1)]) == 0
+    assert conn.statements == []